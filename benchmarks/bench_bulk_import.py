@@ -0,0 +1,66 @@
+"""Bulk booking import throughput, end to end through POST /api/bookings/import.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_bulk_import --rows 100000 --flights 2000
+
+Builds a synthetic database, then imports one partner file of `rows` bookings spread over
+`flights` flights, as CSV and as NDJSON. Exits non-zero below the 20k rows/sec target.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_db import build_synthetic_db
+
+TARGET_ROWS_PER_SEC = 20_000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--flights", type=int, default=2000, help="distinct flights the file books onto")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="flight-bench-")
+    path = os.path.join(workdir.name, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    build_synthetic_db(path, 10_000, bookings=100_000)
+
+    import main as api  # imported after DATABASE_URL points at the synthetic database
+    from fastapi.testclient import TestClient
+
+    rng = random.Random(7)
+    flight_ids = rng.sample(range(1, 10_001), args.flights)
+    rows = [(rng.choice(flight_ids), f"First{i}", f"Last{i}") for i in range(args.rows)]
+    files = {
+        "csv": ("text/csv", "reference,flight_id,first_name,last_name\n" + "".join(
+            f"R{i},{flight_id},{first},{last}\n" for i, (flight_id, first, last) in enumerate(rows))),
+        "ndjson": ("application/x-ndjson", "".join(
+            json.dumps({"reference": f"R{i}", "flight_id": flight_id, "first_name": first, "last_name": last}) + "\n"
+            for i, (flight_id, first, last) in enumerate(rows))),
+    }
+
+    slowest = None
+    with TestClient(api.app) as client:
+        for fmt, (content_type, body) in files.items():
+            start = time.perf_counter()
+            response = client.post("/api/bookings/import", content=body.encode(), headers={"content-type": content_type})
+            elapsed = time.perf_counter() - start
+            response.raise_for_status()
+            report = response.json()
+            rate = report["rows"] / elapsed
+            slowest = rate if slowest is None else min(slowest, rate)
+            print(f"{fmt:<7}{report['rows']:>9,} rows in {elapsed:.2f} s ({rate:,.0f} rows/s), "
+                  f"{report['booked']:,} booked, {report['rejected']:,} rejected")
+
+    api.engine.dispose()
+    workdir.cleanup()
+    if slowest < TARGET_ROWS_PER_SEC:
+        sys.exit(f"import is below the {TARGET_ROWS_PER_SEC:,} rows/s target")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Booking throughput with a commit per request vs group commit, under many concurrent clients.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_group_commit --clients 500 --bookings 20000
+
+Each mode runs in its own process against a freshly built synthetic database in which every
+flight has plenty of seats. `clients` threads call create_booking directly (no HTTP), each with
+its own session, until `bookings` bookings have been requested. Reports bookings/sec and
+p50/p99 latency per mode, and checks afterwards that every flight's seat count matches its
+bookings. Put --dir on a real disk: the point is the fsync per commit.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic_db import build_synthetic_db
+
+MODES = ("per-request", "group-commit")
+
+def run_mode(mode: str, clients: int, bookings: int, flights: int, directory: str) -> dict:
+    workdir = tempfile.TemporaryDirectory(prefix="flight-bench-", dir=directory)
+    path = os.path.join(workdir.name, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    build_synthetic_db(path, flights)
+
+    import main as api  # imported after DATABASE_URL points at the synthetic database
+    from fastapi import HTTPException
+
+    with api.engine.begin() as conn:
+        conn.execute(api.text("UPDATE flights SET total_seats = 2000, seats_available = 2000"))
+    with api.SessionLocal() as db:
+        api.pricing_engine.load()
+        api.flight_index.build(db)
+        api.price_table.build(db)
+    if mode == "group-commit":
+        api.booking_writer.start()
+
+    rng = random.Random(11)
+    requests = [
+        api.BookingRequest(flight_id=rng.randint(1, flights), passenger=api.Passenger(first_name="Bench", last_name=f"Mark{i}"))
+        for i in range(bookings)
+    ]
+
+    def book(request) -> tuple:
+        start = time.perf_counter()
+        try:
+            with api.SessionLocal() as db:
+                api.create_booking(request, idempotency_key=None, db=db)
+            outcome = 201
+        except HTTPException as e:
+            outcome = e.status_code
+        return outcome, time.perf_counter() - start
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(clients) as executor:
+        outcomes = list(executor.map(book, requests))
+    elapsed = time.perf_counter() - started
+    writer = api.booking_writer.stats()
+    api.booking_writer.stop()
+
+    with api.engine.connect() as conn:
+        mismatched = conn.execute(api.text(
+            "SELECT COUNT(*) FROM flights f WHERE f.total_seats - f.seats_available != "
+            "(SELECT COUNT(*) FROM bookings b WHERE b.flight_id = f.id AND b.status IN ('Pending', 'Confirmed'))"
+        )).scalar()
+    api.engine.dispose()
+    workdir.cleanup()
+
+    latencies = sorted(latency for _, latency in outcomes)
+    return {
+        "responses": dict(Counter(status for status, _ in outcomes)),
+        "bookings_per_sec": round(bookings / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2),
+        "average_batch": writer["average_batch"], "mismatched_flights": mismatched,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--bookings", type=int, default=20_000)
+    parser.add_argument("--flights", type=int, default=200)
+    parser.add_argument("--dir", default=os.getcwd(), help="where the throwaway databases are created")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(run_mode(args.worker, args.clients, args.bookings, args.flights, args.dir), sys.stdout)
+        return
+
+    results = {}
+    for mode in MODES:
+        # A fresh process per mode, since main binds its database at import time
+        worker = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_group_commit", "--worker", mode, "--clients", str(args.clients),
+             "--bookings", str(args.bookings), "--flights", str(args.flights), "--dir", args.dir],
+            stdout=subprocess.PIPE, check=True, text=True,
+        )
+        results[mode] = r = json.loads(worker.stdout)
+        batch = f", {r['average_batch']:.1f} per batch" if r["average_batch"] else ""
+        print(f"{mode:<14}{r['bookings_per_sec']:>10,.0f} bookings/s  p50 {r['p50_ms']:>8.2f} ms  p99 {r['p99_ms']:>8.2f} ms  "
+              f"responses {r['responses']}{batch}")
+
+    speedup = results["group-commit"]["bookings_per_sec"] / results["per-request"]["bookings_per_sec"]
+    print(f"group commit: {speedup:.1f}x the per-request throughput")
+    if any(r["mismatched_flights"] for r in results.values()):
+        sys.exit("seat counts do not match bookings")
+
+if __name__ == "__main__":
+    main()
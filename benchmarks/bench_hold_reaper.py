@@ -0,0 +1,70 @@
+"""Hold expiry throughput: how fast the reaper expires lapsed Pending bookings and frees their seats.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_hold_reaper --flights 10000 --bookings 200000
+
+Builds a synthetic database whose bookings are about half Pending, makes every flight's seat
+count and seat map agree with its bookings, lets every hold lapse and runs the reaper once.
+Reports expired bookings/sec, then checks that no Pending booking is left, that each flight's
+seat count equals total seats minus the bookings still holding a seat, and that each seat map
+has exactly that many seats taken. Exits non-zero on any violation.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic_db import build_synthetic_db
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flights", type=int, default=10_000)
+    parser.add_argument("--bookings", type=int, default=200_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="flight-bench-")
+    path = os.path.join(workdir.name, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    build_synthetic_db(path, args.flights, bookings=args.bookings)
+
+    import main as api  # imported after DATABASE_URL points at the synthetic database
+
+    holding = (
+        "(SELECT COUNT(*) FROM bookings b WHERE b.flight_id = f.id AND b.status IN ('Pending', 'Confirmed'))"
+    )
+    with api.engine.begin() as conn:
+        conn.execute(api.text(f"UPDATE flights AS f SET total_seats = MAX(total_seats, {holding})"))
+        conn.execute(api.text(f"UPDATE flights AS f SET seats_available = total_seats - {holding}"))
+    with api.SessionLocal() as db:
+        flights = api.fetch_flight_rows(db, range(1, args.flights + 1))
+        held = {flight_id: flight.total_seats - flight.seats_available for flight_id, flight in flights.items()}
+        api.save_seat_maps(db, api.load_seat_maps(db, flights, held))
+        db.commit()
+
+    with api.engine.connect() as conn:
+        pending = conn.execute(api.text("SELECT COUNT(*) FROM bookings WHERE status = 'Pending'")).scalar()
+    start = time.perf_counter()
+    expired = api.expire_lapsed_holds(time.time() + api.PENDING_HOLD_SECONDS + 1)
+    elapsed = time.perf_counter() - start
+    stats = api.hold_reaper_stats.stats()
+    print(f"expired {expired:,} of {pending:,} holds in {elapsed:.2f} s ({expired / elapsed:,.0f} bookings/s, "
+          f"{stats['expired_batches']} batches)")
+
+    with api.engine.connect() as conn:
+        left = conn.execute(api.text("SELECT COUNT(*) FROM bookings WHERE status = 'Pending'")).scalar()
+        miscounted = conn.execute(api.text(f"SELECT COUNT(*) FROM flights f WHERE f.total_seats - f.seats_available != {holding}")).scalar()
+        maps = conn.execute(api.text(
+            "SELECT s.occupied, f.total_seats - f.seats_available FROM seat_maps s JOIN flights f ON f.id = s.flight_id"
+        )).all()
+    mismatched_maps = sum(1 for occupied, sold in maps if bin(int.from_bytes(occupied, "little")).count("1") != sold)
+    print(f"pending left: {left}, flights miscounted: {miscounted}, seat maps out of step: {mismatched_maps}")
+
+    api.engine.dispose()
+    workdir.cleanup()
+    if left or miscounted or mismatched_maps or expired != pending:
+        sys.exit("hold expiry left inventory inconsistent")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""PNR generation throughput across worker processes, and a uniqueness check over every PNR issued.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pnr --pnrs 10000000 --processes 4
+
+Builds a synthetic database whose bookings carry old-style PNRs, then starts `processes`
+workers that each import main and draw their share of `pnrs` PNRs through generate_pnr(),
+reserving blocks from the shared sequence row as they go. Every PNR is collected and checked:
+exits non-zero on any duplicate, any clash with an existing booking, any malformed PNR, or an
+aggregate rate below 50k PNRs/sec.
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_db import build_synthetic_db
+
+TARGET_PNRS_PER_SEC = 50_000
+PNR_PATTERN = re.compile(rb"^[0-9A-Z]{6}$")
+
+def run_worker(count: int, output: str):
+    import main as api  # DATABASE_URL is inherited from the parent
+
+    started = time.time()
+    pnrs = [api.generate_pnr() for _ in range(count)]
+    finished = time.time()
+    np.save(output, np.array(pnrs, dtype="S6"))
+    json.dump({"started": started, "finished": finished, **api.pnr_allocator.stats()}, sys.stdout)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pnrs", type=int, default=10_000_000)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--bookings", type=int, default=100_000, help="existing bookings with old-style PNRs")
+    parser.add_argument("--worker", nargs=2, metavar=("COUNT", "OUTPUT"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(int(args.worker[0]), args.worker[1])
+        return
+
+    workdir = tempfile.TemporaryDirectory(prefix="flight-bench-")
+    path = os.path.join(workdir.name, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    build_synthetic_db(path, 1000, bookings=args.bookings)
+
+    share, extra = divmod(args.pnrs, args.processes)
+    outputs = [os.path.join(workdir.name, f"pnrs-{i}.npy") for i in range(args.processes)]
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_pnr", "--worker", str(share + (i < extra)), output],
+            stdout=subprocess.PIPE, text=True,
+        )
+        for i, output in enumerate(outputs)
+    ]
+    reports = []
+    for worker in workers:
+        stdout, _ = worker.communicate()
+        if worker.returncode:
+            sys.exit(f"worker exited with status {worker.returncode}")
+        reports.append(json.loads(stdout))
+
+    elapsed = max(r["finished"] for r in reports) - min(r["started"] for r in reports)
+    rate = args.pnrs / elapsed
+    blocks = sum(r["blocks_reserved"] for r in reports)
+    print(f"{args.pnrs:,} PNRs from {args.processes} processes in {elapsed:.2f} s ({rate:,.0f} PNRs/s), {blocks:,} blocks reserved")
+
+    pnrs = np.concatenate([np.load(output) for output in outputs])
+    duplicates = len(pnrs) - len(np.unique(pnrs))
+    malformed = sum(1 for pnr in pnrs[:100_000] if not PNR_PATTERN.match(pnr))
+    with sqlite3.connect(path) as con:
+        existing = np.array([row[0] for row in con.execute("SELECT pnr FROM bookings")], dtype="S6")
+    clashes = int(np.isin(pnrs, existing).sum())
+    print(f"duplicates: {duplicates}, clashes with existing bookings: {clashes}, malformed (first 100k): {malformed}")
+
+    workdir.cleanup()
+    if duplicates or clashes or malformed:
+        sys.exit("PNRs are not unique")
+    if rate < TARGET_PNRS_PER_SEC:
+        sys.exit(f"PNR generation is below the {TARGET_PNRS_PER_SEC:,} PNRs/s target")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Price history recording cost on the search path, and batch flush throughput.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_price_history --page 50
+
+Times PriceHistoryBuffer.append for one search page of prices (the hot-path cost, budget
+50 us) and then the batch insert of everything recorded into a throwaway database.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.synthetic_db import build_synthetic_db
+
+HOT_PATH_BUDGET_US = 50
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--page", type=int, default=50, help="prices recorded per search page")
+    parser.add_argument("--pages", type=int, default=20_000)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="flight-bench-")
+    path = os.path.join(workdir.name, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    build_synthetic_db(path, 10_000)
+
+    import main as api  # imported after DATABASE_URL points at the synthetic database
+
+    rng = np.random.default_rng(3)
+    latencies = []
+    for _ in range(args.pages):
+        flight_ids = rng.integers(1, 10_000, size=args.page).tolist()
+        prices = rng.uniform(2000, 12000, size=args.page)
+        start = time.perf_counter()
+        api.price_history.append(flight_ids, prices)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    p50, p99 = statistics.median(latencies) * 1e6, latencies[int(len(latencies) * 0.99) - 1] * 1e6
+    print(f"append {args.page} prices: p50 {p50:.2f} us, p99 {p99:.2f} us")
+
+    start = time.perf_counter()
+    written = api.flush_price_history()
+    elapsed = time.perf_counter() - start
+    print(f"flush: {written} samples in {elapsed:.2f} s ({written / elapsed:,.0f} samples/s)")
+
+    api.engine.dispose()
+    workdir.cleanup()
+    if p99 > HOT_PATH_BUDGET_US:
+        sys.exit(f"p99 append cost is over the {HOT_PATH_BUDGET_US} us budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Pricing throughput: the old hard-coded thresholds vs compiled pricing rule sets.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pricing_rules --flights 100000
+
+Prices the same synthetic flights with the original fixed-array batch function, with the
+default rule set, and with a mix of airline/route rule sets, and exits non-zero when the
+scalar and batch paths price a flight differently, or when the default rule set prices more
+than --tolerance slower than the original, in batch or one flight at a time. The gate
+compares the median of several interleaved rounds, so a burst of machine noise during one
+of them does not fail the run.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from pricing_rules import CompiledRules
+
+# The batch pricing code as it was before rule sets, kept here as the baseline
+LEGACY_OCCUPANCY_BREAKPOINTS = np.array([0.4, 0.8])
+LEGACY_SEAT_FACTORS = np.array([0.9, 1.2, 1.5])
+LEGACY_DAYS_BREAKPOINTS = np.array([10, 45])
+LEGACY_TIME_FACTORS = np.array([1.4, 1.1, 0.85])
+
+def legacy_list_fares(base_fares, seats_available, total_seats, departures, now):
+    now = np.datetime64(now, "us")
+    occupancy = (np.asarray(total_seats, dtype=np.float64) - np.asarray(seats_available, dtype=np.float64)) / np.asarray(total_seats, dtype=np.float64)
+    seat_factor = LEGACY_SEAT_FACTORS[np.searchsorted(LEGACY_OCCUPANCY_BREAKPOINTS, occupancy, side="right")]
+    days_to_departure = (np.asarray(departures, dtype="datetime64[us]") - now) // np.timedelta64(1, "D")
+    time_factor = LEGACY_TIME_FACTORS[np.searchsorted(LEGACY_DAYS_BREAKPOINTS, days_to_departure, side="left")]
+    return np.asarray(base_fares, dtype=np.float64) * seat_factor * time_factor
+
+def legacy_scalar(base_fare, seats_available, total_seats, departure, now):
+    occupancy = (total_seats - seats_available) / total_seats
+    if occupancy < 0.4: seat_factor = 0.9
+    elif occupancy < 0.8: seat_factor = 1.2
+    else: seat_factor = 1.5
+    days_to_departure = (departure - now).days
+    if days_to_departure > 45: time_factor = 0.85
+    elif days_to_departure > 10: time_factor = 1.1
+    else: time_factor = 1.4
+    return base_fare * seat_factor * time_factor
+
+def example_rules() -> CompiledRules:
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pricing_rules.example.json")
+    with open(path) as f:
+        return CompiledRules.from_config(json.load(f))
+
+def best_of(fn, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+def interleaved(fns, repeats: int) -> list:
+    """Best time of each function, alternating between them so drift in machine speed hits all alike."""
+    timings = [[] for _ in fns]
+    for _ in range(repeats):
+        for fn, fn_timings in zip(fns, timings):
+            start = time.perf_counter()
+            fn()
+            fn_timings.append(time.perf_counter() - start)
+    return [min(t) for t in timings]
+
+def slowdown(baseline, candidate, repeats: int, rounds: int = 5) -> float:
+    """Median over `rounds` of candidate's best time relative to baseline's, minus one."""
+    ratios = []
+    for _ in range(rounds):
+        baseline_time, candidate_time = interleaved([baseline, candidate], repeats)
+        ratios.append(candidate_time / baseline_time)
+    return statistics.median(ratios) - 1
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flights", type=int, default=100_000)
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown of the default rule set")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(7)
+    now = datetime.now()
+    total = rng.choice([72, 150, 180, 220], size=args.flights)
+    seats = (total * rng.random(args.flights)).astype(np.int64)
+    base = rng.integers(2000, 9000, size=args.flights).astype(np.float64)
+    departures = np.datetime64(now, "us") + (rng.integers(-1, 90 * 24 * 60, size=args.flights) * 60_000_000).astype("timedelta64[us]")
+
+    default_rules = CompiledRules.from_config({})
+    mixed_rules = example_rules()
+    mixed_ids = rng.integers(0, len(mixed_rules.rule_sets), size=args.flights)
+    one_airline_ids = np.full(args.flights, 1)
+
+    expected = legacy_list_fares(base, seats, total, departures, now)
+    if not np.array_equal(expected, default_rules.list_fares(base, seats, total, departures, now=now)):
+        sys.exit("default rule set does not reproduce the legacy fares")
+
+    # The scalar list_fare is generated code, so check it against the batch path under every rule set
+    sample = min(args.flights, 20_000)
+    rows = list(zip(base[:sample].tolist(), seats[:sample].tolist(), total[:sample].tolist(), departures[:sample].astype(datetime).tolist()))
+    batch = mixed_rules.list_fares(base[:sample], seats[:sample], total[:sample], departures[:sample], mixed_ids[:sample], now=now)
+    scalar = [mixed_rules.list_fare(b, s, t, d, int(rule_id), now) for (b, s, t, d), rule_id in zip(rows, mixed_ids[:sample])]
+    if not np.allclose(batch, scalar, rtol=1e-12, atol=0):
+        sys.exit("scalar list_fare disagrees with the batch list fares")
+
+    cases = {
+        "legacy fixed arrays": lambda: legacy_list_fares(base, seats, total, departures, now),
+        "rules: default": lambda: default_rules.list_fares(base, seats, total, departures, now=now),
+        "rules: one airline set": lambda: mixed_rules.list_fares(base, seats, total, departures, one_airline_ids, now=now),
+        "rules: mixed sets": lambda: mixed_rules.list_fares(base, seats, total, departures, mixed_ids, now=now),
+    }
+    print(f"{args.flights} flights, median of {args.repeats} runs\n")
+    print(f"{'case':<28}{'ms':>10}{'Mflights/s':>12}")
+    results = {}
+    for name, fn in cases.items():
+        fn()
+        results[name] = best_of(fn, args.repeats)
+        print(f"{name:<28}{results[name] * 1000:>10.2f}{args.flights / results[name] / 1e6:>12.2f}")
+
+    list_fare = default_rules.list_fare
+    scalar_cases = [
+        lambda: [legacy_scalar(b, s, t, d, now) for b, s, t, d in rows],
+        lambda: [list_fare(b, s, t, d, 0, now) for b, s, t, d in rows],
+    ]
+    scalar_legacy, scalar_rules = interleaved(scalar_cases, args.repeats)
+    print(f"\n{'scalar: legacy':<28}{scalar_legacy / sample * 1e6:>10.2f} us/flight")
+    print(f"{'scalar: rules':<28}{scalar_rules / sample * 1e6:>10.2f} us/flight")
+
+    batch_slowdown = slowdown(cases["legacy fixed arrays"], cases["rules: default"], args.repeats)
+    scalar_slowdown = slowdown(*scalar_cases, args.repeats)
+    print(f"\nDefault rule set vs legacy: {batch_slowdown:+.1%} batch, {scalar_slowdown:+.1%} scalar")
+    if batch_slowdown > args.tolerance or scalar_slowdown > args.tolerance:
+        sys.exit(f"Pricing throughput regressed by more than {args.tolerance:.0%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Read path benchmark: full ORM hydration (the old code) vs Core column projection.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_read_path --flights 100000
+
+Builds a throwaway database, then times each variant per request and records the peak
+memory traced by tracemalloc while the request runs.
+"""
+import argparse
+import itertools
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from benchmarks.synthetic_db import build_synthetic_db
+
+def measure(fn, iterations: int) -> dict:
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    peaks = []
+    tracemalloc.start()
+    for _ in range(min(iterations, 50)):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "peak_kib": statistics.median(peaks) / 1024,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--flights", type=int, default=100_000)
+    parser.add_argument("--bookings", type=int, default=20_000)
+    parser.add_argument("--iterations", type=int, default=300)
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="flight-bench-")
+    path = os.path.join(workdir.name, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    print(f"Building {args.flights} flights / {args.bookings} bookings in {path} ...")
+    facts = build_synthetic_db(path, args.flights, args.bookings)
+
+    import main as api  # imported after DATABASE_URL points at the synthetic database
+    from main import Booking, BookingResponse, Flight, FlightResponse
+
+    with api.SessionLocal() as db:
+        api.airport_catalog.load(db)
+        api.flight_index.build(db)
+    route = facts["busy_route"]
+    origin_id, destination_id = api.airport_catalog.resolve(route["origin"]), api.airport_catalog.resolve(route["destination"])
+    day = api.datetime.strptime(route["date"], "%Y-%m-%d").date()
+    page_ids = api.flight_index.lookup(origin_id, destination_id, day)[:api.SEARCH_DEFAULT_LIMIT]
+    pnrs = itertools.cycle(facts["pnrs"])
+    print(f"Search page: {len(page_ids)} flights on {route['origin']} -> {route['destination']} {route['date']}")
+
+    def orm_search_page():
+        with api.SessionLocal() as db:
+            flights = db.query(Flight).filter(Flight.id.in_(page_ids)).all()
+            prices = api.price_flights(flights).tolist()
+            return [
+                FlightResponse(
+                    flight_id=f.id, flight_no=f.flight_no, origin=f.origin, destination=f.destination,
+                    departure=f.departure, arrival=f.arrival,
+                    duration_hours=round((f.arrival - f.departure).total_seconds() / 3600, 2), dynamic_price=p,
+                    seats_available=f.seats_available, airline_name=f.airline_name,
+                )
+                for f, p in zip(flights, prices)
+            ]
+
+    def core_search_page():
+        with api.SessionLocal() as db:
+            rows = list(api.fetch_flight_rows(db, page_ids).values())
+            return [api.flight_response(r, p) for r, p in zip(rows, api.price_flights(rows).tolist())]
+
+    def orm_get_booking():
+        with api.SessionLocal() as db:
+            booking = db.query(Booking).filter(Booking.pnr.ilike(next(pnrs))).first()
+            flight = db.query(Flight).filter(Flight.id == booking.flight_id).first()
+            return BookingResponse(
+                pnr=booking.pnr, flight_no=flight.flight_no, passenger_name=booking.passenger_name,
+                status=booking.status, price=float(booking.price), departure=flight.departure,
+                origin=flight.origin, destination=flight.destination,
+            )
+
+    def core_get_booking():
+        with api.SessionLocal() as db:
+            return api.get_booking(next(pnrs), db)
+
+    print(f"\n{'case':<28}{'p50 ms':>10}{'p99 ms':>10}{'peak KiB':>12}")
+    for name, fn in (
+        ("search page / ORM", orm_search_page), ("search page / Core", core_search_page),
+        ("get_booking / ORM", orm_get_booking), ("get_booking / Core", core_get_booking),
+    ):
+        fn()  # warm up statement caches
+        result = measure(fn, args.iterations)
+        print(f"{name:<28}{result['p50_ms']:>10.3f}{result['p99_ms']:>10.3f}{result['peak_kib']:>12.1f}")
+    api.engine.dispose()
+    workdir.cleanup()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Concurrency stress test for seat inventory: no oversell, no double release, no 500s.
+
+Run from the repository root:
+
+    python -m benchmarks.stress_seat_inventory --threads 64 --seats 100 --attempts 1000
+
+Builds a throwaway database with one flight, then drives the API through many threads:
+every thread books the same flight until it sells out, pays for each booking twice at
+once, and cancels every confirmed booking twice at once. After each phase the seat count
+must equal total seats minus the bookings still holding a seat, the seat map must have
+exactly that many seats taken, and no two of those bookings may share a seat. Exits non-zero
+on any violation or on any 5xx response.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic_db import build_synthetic_db
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--seats", type=int, default=100)
+    parser.add_argument("--attempts", type=int, default=1000, help="booking requests fired at the flight")
+    args = parser.parse_args()
+
+    workdir = tempfile.TemporaryDirectory(prefix="flight-stress-")
+    path = os.path.join(workdir.name, "stress.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    build_synthetic_db(path, 1)
+
+    import main as api  # imported after DATABASE_URL points at the throwaway database
+    from fastapi.testclient import TestClient
+
+    with api.engine.begin() as conn:
+        conn.execute(api.text("UPDATE flights SET total_seats = :n, seats_available = :n"), {"n": args.seats})
+        flight_id = conn.execute(api.text("SELECT id FROM flights")).scalar()
+
+    def seats_left() -> int:
+        with api.engine.connect() as conn:
+            return conn.execute(api.text("SELECT seats_available FROM flights WHERE id = :id"), {"id": flight_id}).scalar()
+
+    def holding_seats() -> int:
+        with api.engine.connect() as conn:
+            return conn.execute(api.text(
+                "SELECT COUNT(*) FROM bookings WHERE flight_id = :id AND status IN ('Pending', 'Confirmed')"
+            ), {"id": flight_id}).scalar()
+
+    def seat_map_taken() -> int:
+        with api.engine.connect() as conn:
+            occupied = conn.execute(api.text("SELECT occupied FROM seat_maps WHERE flight_id = :id"), {"id": flight_id}).scalar()
+        return bin(int.from_bytes(occupied or b"", "little")).count("1")
+
+    def distinct_seats() -> int:
+        with api.engine.connect() as conn:
+            return conn.execute(api.text(
+                "SELECT COUNT(DISTINCT seat_no) FROM bookings WHERE flight_id = :id AND status IN ('Pending', 'Confirmed')"
+            ), {"id": flight_id}).scalar()
+
+    failures = []
+
+    def check(phase: str, statuses: Counter):
+        left, held, taken, seated = seats_left(), holding_seats(), seat_map_taken(), distinct_seats()
+        ok = (
+            left == args.seats - held and 0 <= left <= args.seats and taken == held and seated == held
+            and not any(code >= 500 for code in statuses)
+        )
+        print(
+            f"{phase:<10} responses {dict(sorted(statuses.items()))}  seats left {left}  bookings holding seats {held}  "
+            f"seat map taken {taken}  distinct seats {seated}  {'OK' if ok else 'FAILED'}"
+        )
+        if not ok:
+            failures.append(phase)
+
+    with TestClient(api.app) as client, ThreadPoolExecutor(max_workers=args.threads) as pool:
+        def book(i):
+            response = client.post("/api/bookings", json={
+                "flight_id": flight_id, "passenger": {"first_name": "Stress", "last_name": f"Test{i}"},
+            })
+            return response.status_code, response.json().get("pnr")
+
+        results = list(pool.map(book, range(args.attempts)))
+        check("book", Counter(code for code, _ in results))
+        pnrs = [pnr for code, pnr in results if code == 201]
+        if len(pnrs) != min(args.seats, args.attempts):
+            print(f"expected {min(args.seats, args.attempts)} successful bookings, got {len(pnrs)}")
+            failures.append("book count")
+
+        def pay(pnr):
+            return client.post(f"/api/bookings/{pnr}/pay").status_code
+
+        check("pay x2", Counter(pool.map(pay, pnrs + pnrs)))
+
+        def cancel(pnr):
+            return client.delete(f"/api/bookings/{pnr}").status_code
+
+        with api.engine.connect() as conn:
+            confirmed = [row[0] for row in conn.execute(api.text("SELECT pnr FROM bookings WHERE status = 'Confirmed'"))]
+        check("cancel x2", Counter(pool.map(cancel, confirmed + confirmed)))
+
+    api.engine.dispose()
+    workdir.cleanup()
+    if failures:
+        sys.exit(f"Inventory invariant violated in: {', '.join(failures)}")
+    print("No oversell, no double release, seat map in step with the counter, no server errors.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Benchmark suite for the pricing, search and booking paths at several database sizes.
+
+Run from the repository root:
+
+    python -m benchmarks.suite                                   # 1k, 100k and 1M flights
+    python -m benchmarks.suite --sizes 1000 100000 --iterations 200
+    python -m benchmarks.suite --baseline benchmarks/results/abc1234.json --threshold 0.2
+
+Each size runs in its own process against a freshly built synthetic database, calling the
+endpoint functions directly (no HTTP). Results (p50/p99 latency and ops/sec per operation)
+are written as JSON, by default to benchmarks/results/<commit>.json. With --baseline, any
+operation whose p50 or p99 is more than --threshold slower than the baseline is reported and
+the run exits non-zero.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from benchmarks.synthetic_db import build_synthetic_db
+
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+def measure(fn, iterations: int) -> dict:
+    fn()  # warm up statement caches
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": round(statistics.median(latencies) * 1000, 4),
+        "p99_ms": round(latencies[max(int(len(latencies) * 0.99) - 1, 0)] * 1000, 4),
+        "ops_per_sec": round(iterations / elapsed, 1),
+    }
+
+def run_size(flights: int, iterations: int, seed: int) -> dict:
+    """Builds a database with `flights` flights and benchmarks every operation against it."""
+    workdir = tempfile.TemporaryDirectory(prefix="flight-bench-")
+    path = os.path.join(workdir.name, "bench.db")
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    build_started = time.perf_counter()
+    facts = build_synthetic_db(path, flights, bookings=min(flights // 5, 200_000) or 100, seed=seed)
+    print(f"[{flights}] database built in {time.perf_counter() - build_started:.1f} s", file=sys.stderr)
+
+    import main as api  # imported after DATABASE_URL points at the synthetic database
+    from starlette.responses import Response
+
+    with api.SessionLocal() as db:
+        api.pricing_engine.load()
+        api.airport_catalog.load(db)
+        api.flight_index.build(db)
+        api.build_route_graph(db)
+        api.price_table.build(db)
+        # Flights whose counter covers the bookings they already hold, so their seat maps have as
+        # many free seats as seats_available says; create_booking stops picking a flight once it is full
+        holding = "(SELECT COUNT(*) FROM bookings b WHERE b.flight_id = f.id AND b.status IN ('Pending', 'Confirmed'))"
+        seats_left = dict(db.execute(api.text(
+            f"SELECT f.id, f.seats_available FROM flights f WHERE f.seats_available > 0 AND f.total_seats - f.seats_available >= {holding} LIMIT 5000"
+        )).all())
+        fare_inputs = [
+            (float(r.base_fare), r.seats_available, r.total_seats, r.departure)
+            for r in db.query(api.Flight).limit(1000)
+        ]
+
+    rng = random.Random(seed)
+    bookable = list(seats_left)
+    route = facts["busy_route"]
+    existing_pnrs = itertools.cycle(facts["pnrs"])
+    fares = itertools.cycle(fare_inputs)
+    created_pnrs = []
+
+    def calculate_dynamic_price():
+        api.calculate_dynamic_price(*next(fares))
+
+    def search_flights():
+        api.search_cache.clear()
+        with api.SessionLocal() as db:
+            api.search_flights(Response(), route["origin"], route["destination"], route["date"], limit=api.SEARCH_DEFAULT_LIMIT, cursor=None, stream=False, accept=None, db=db)
+
+    def search_flights_cached():
+        with api.SessionLocal() as db:
+            api.search_flights(Response(), route["origin"], route["destination"], route["date"], limit=api.SEARCH_DEFAULT_LIMIT, cursor=None, stream=False, accept=None, db=db)
+
+    def create_booking():
+        flight_id = rng.choice(bookable)
+        request = api.BookingRequest(flight_id=flight_id, passenger=api.Passenger(first_name="Bench", last_name="Mark"))
+        with api.SessionLocal() as db:
+            created_pnrs.append(api.create_booking(request, idempotency_key=None, db=db).pnr)
+        seats_left[flight_id] -= 1
+        if not seats_left[flight_id]:
+            bookable.remove(flight_id)
+
+    pay_queue, cancel_queue = iter(()), iter(())
+
+    def pay_for_booking():
+        with api.SessionLocal() as db:
+            api.pay_for_booking(next(pay_queue), idempotency_key=None, db=db)
+
+    def cancel_booking():
+        with api.SessionLocal() as db:
+            api.cancel_booking(next(cancel_queue), db=db)
+
+    def get_booking():
+        with api.SessionLocal() as db:
+            api.get_booking(next(existing_pnrs), db=db)
+
+    results = {}
+    for name, fn in (
+        ("calculate_dynamic_price", calculate_dynamic_price),
+        ("generate_pnr", api.generate_pnr),
+        ("search_flights", search_flights),
+        ("search_flights[cached]", search_flights_cached),
+        ("create_booking", create_booking),
+        ("pay_for_booking", pay_for_booking),
+        ("cancel_booking", cancel_booking),
+        ("get_booking", get_booking),
+    ):
+        if name == "pay_for_booking":
+            # Pay for half of the bookings just created and cancel the other half
+            half = len(created_pnrs) // 2
+            pay_queue, cancel_queue = iter(created_pnrs[:half]), iter(created_pnrs[half:])
+        count = iterations
+        if name in ("pay_for_booking", "cancel_booking"):
+            count = min(iterations, len(created_pnrs) // 2 - 1)
+        results[name] = measure(fn, count)
+        print(f"[{flights}] {name:<26}{results[name]['p50_ms']:>10.3f} ms p50", file=sys.stderr)
+
+    api.engine.dispose()
+    workdir.cleanup()
+    return results
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Lists (size, operation, metric, baseline, current) for every metric slower than allowed."""
+    regressions = []
+    for size, operations in results["sizes"].items():
+        for name, current in operations.items():
+            previous = baseline.get("sizes", {}).get(size, {}).get(name)
+            if not previous:
+                continue
+            for metric in ("p50_ms", "p99_ms"):
+                if current[metric] > previous[metric] * (1 + threshold):
+                    regressions.append((size, name, metric, previous[metric], current[metric]))
+    return regressions
+
+def print_table(results: dict, baseline: dict = None):
+    for size, operations in results["sizes"].items():
+        print(f"\n{int(size):,} flights")
+        print(f"  {'operation':<26}{'p50 ms':>10}{'p99 ms':>10}{'ops/sec':>12}{'p50 vs base':>13}")
+        for name, r in operations.items():
+            previous = (baseline or {}).get("sizes", {}).get(size, {}).get(name)
+            delta = f"{r['p50_ms'] / previous['p50_ms'] - 1:+.1%}" if previous and previous["p50_ms"] else ""
+            print(f"  {name:<26}{r['p50_ms']:>10.3f}{r['p99_ms']:>10.3f}{r['ops_per_sec']:>12,.1f}{delta:>13}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed slowdown before flagging, e.g. 0.15 = 15%%")
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        json.dump(run_size(args.worker, args.iterations, args.seed), sys.stdout)
+        return
+
+    commit = current_commit()
+    results = {
+        "commit": commit, "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(), "platform": platform.platform(),
+        "iterations": args.iterations, "sizes": {},
+    }
+    for size in args.sizes:
+        # A fresh process per size, since main binds its database at import time
+        worker = subprocess.run(
+            [sys.executable, "-m", "benchmarks.suite", "--worker", str(size), "--iterations", str(args.iterations), "--seed", str(args.seed)],
+            stdout=subprocess.PIPE, check=True, text=True,
+        )
+        results["sizes"][str(size)] = json.loads(worker.stdout)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    print(f"\nResults written to {output}")
+
+    if baseline:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\nRegressions beyond {args.threshold:.0%} against {baseline.get('commit', args.baseline)}:")
+            for size, name, metric, before, after in regressions:
+                print(f"  {int(size):,} flights  {name:<26}{metric:<8}{before:.3f} -> {after:.3f} ms")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.threshold:.0%} against {baseline.get('commit', args.baseline)}.")
+
+if __name__ == "__main__":
+    main()
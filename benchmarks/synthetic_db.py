@@ -0,0 +1,86 @@
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+# City pool for synthetic schedules; codes match KNOWN_AIRPORTS where there is one
+CITIES = [
+    ("DEL", "Delhi"), ("BOM", "Mumbai"), ("MAA", "Chennai"), ("CCU", "Kolkata"), ("BLR", "Bengaluru"),
+    ("HYD", "Hyderabad"), ("PNQ", "Pune"), ("AMD", "Ahmedabad"), ("GOI", "Goa"), ("JAI", "Jaipur"),
+    ("COK", "Kochi"), ("LKO", "Lucknow"), ("IXC", "Chandigarh"), ("PAT", "Patna"), ("GAU", "Guwahati"),
+    ("BBI", "Bhubaneswar"), ("IDR", "Indore"), ("NAG", "Nagpur"), ("VNS", "Varanasi"), ("SXR", "Srinagar"),
+]
+AIRLINES = ["Air India", "IndiGo", "Vistara", "SpiceJet", "Akasa Air"]
+
+def _pnr(n: int) -> str:
+    digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    out = []
+    for _ in range(6):
+        n, r = divmod(n, 36)
+        out.append(digits[r])
+    return "".join(reversed(out))
+
+def build_synthetic_db(path: str, flights: int, bookings: int = 0, days: int = 60, seed: int = 42) -> dict:
+    """Creates a SQLite database at `path` with `flights` random future flights and `bookings` bookings.
+
+    Returns a few handy facts about the data (a busy route-day, sample PNRs) for benchmarks to use.
+    """
+    from main import Base, apply_migrations
+
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=engine)
+
+    rng = random.Random(seed)
+    start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    con = sqlite3.connect(path)
+    con.executemany("INSERT INTO airports (code, city, country) VALUES (?, ?, 'India')", CITIES)
+    airport_ids = dict(con.execute("SELECT city, id FROM airports"))
+
+    batch = []
+    for i in range(flights):
+        (_, origin), (_, destination) = rng.sample(CITIES, 2)
+        departure = start + timedelta(minutes=rng.randrange(days * 24 * 60))
+        arrival = departure + timedelta(minutes=rng.randint(60, 240))
+        total_seats = rng.choice((150, 180, 200))
+        batch.append((
+            f"SY{i}", origin, destination, departure.isoformat(sep=" "), arrival.isoformat(sep=" "),
+            rng.randint(3000, 12000), total_seats, rng.randint(1, total_seats),
+            rng.choice(AIRLINES), airport_ids[origin], airport_ids[destination],
+        ))
+        if len(batch) == 50000:
+            _insert_flights(con, batch)
+            batch = []
+    _insert_flights(con, batch)
+
+    flight_count = con.execute("SELECT MAX(id) FROM flights").fetchone()[0] or 0
+    pnrs = []
+    if bookings and flight_count:
+        rows = []
+        for i in range(bookings):
+            pnr = _pnr(i + 1)
+            rows.append((rng.randint(1, flight_count), f"Passenger {i}", pnr, rng.randint(3000, 15000), rng.choice(("Pending", "Confirmed"))))
+            if i < 1000:
+                pnrs.append(pnr)
+        con.executemany("INSERT INTO bookings (flight_id, passenger_name, pnr, price, status) VALUES (?, ?, ?, ?, ?)", rows)
+
+    busiest = con.execute(
+        "SELECT o.city, d.city, date(f.departure) AS day, COUNT(*) AS n FROM flights f "
+        "JOIN airports o ON o.id = f.origin_airport_id JOIN airports d ON d.id = f.destination_airport_id "
+        "GROUP BY f.origin_airport_id, f.destination_airport_id, day ORDER BY n DESC LIMIT 1"
+    ).fetchone()
+    con.commit()
+    con.close()
+    apply_migrations(engine)
+    engine.dispose()
+    return {
+        "flights": flights, "bookings": bookings, "pnrs": pnrs,
+        "busy_route": {"origin": busiest[0], "destination": busiest[1], "date": busiest[2], "flights": busiest[3]} if busiest else None,
+    }
+
+def _insert_flights(con, batch):
+    con.executemany(
+        "INSERT INTO flights (flight_no, origin, destination, departure, arrival, base_fare, total_seats, seats_available, "
+        "airline_name, origin_airport_id, destination_airport_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        batch,
+    )
@@ -14,6 +14,14 @@ USE flight_booking_system;
 -- TABLE CREATION
 -- ---------------------------------
 
+-- Create the 'airports' catalog so flights can reference canonical city codes
+CREATE TABLE airports (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    code CHAR(3) NOT NULL UNIQUE,
+    city VARCHAR(50) NOT NULL UNIQUE,
+    country VARCHAR(50)
+);
+
 -- Create the 'flights' table to store flight information
 CREATE TABLE flights (
     id INT AUTO_INCREMENT PRIMARY KEY,
@@ -28,6 +36,12 @@ CREATE TABLE flights (
     airline_name VARCHAR(50) NOT NULL,
     -- 'economy', 'business', 'first' can be used for pricing tiers
     airline_tier VARCHAR(20) DEFAULT 'economy',
+    origin_airport_id INT,
+    destination_airport_id INT,
+    FOREIGN KEY (origin_airport_id) REFERENCES airports(id),
+    FOREIGN KEY (destination_airport_id) REFERENCES airports(id),
+    -- Route searches filter on both airports and a departure range
+    INDEX ix_flights_route_departure (origin_airport_id, destination_airport_id, departure),
     -- Add a check constraint to ensure seats_available is logical
     CONSTRAINT chk_seats_available CHECK (seats_available >= 0 AND seats_available <= total_seats)
 );
@@ -42,14 +56,66 @@ CREATE TABLE bookings (
     price DECIMAL(10, 2) NOT NULL,
     status VARCHAR(20) NOT NULL DEFAULT 'Confirmed', -- e.g., Confirmed, Cancelled, Paid
     booking_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at DOUBLE, -- Unix time a Pending booking's seat hold lapses; the reaper then expires it
     -- Establish a foreign key relationship with the 'flights' table
+    FOREIGN KEY (flight_id) REFERENCES flights(id) ON DELETE CASCADE,
+    -- Seat maps are rebuilt from a flight's bookings
+    INDEX ix_bookings_flight_id (flight_id),
+    -- The expiry reaper and the held-seat metrics read Pending bookings by expiry
+    INDEX ix_bookings_status_expires_at (status, expires_at)
+);
+
+-- Create the 'price_history' table: every quoted and charged price, appended in batches
+CREATE TABLE price_history (
+    id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    flight_id INT NOT NULL,
+    recorded_at DOUBLE NOT NULL, -- Unix time in seconds
+    price DOUBLE NOT NULL,
+    kind TINYINT NOT NULL, -- 0 = quoted, 1 = charged
+    FOREIGN KEY (flight_id) REFERENCES flights(id) ON DELETE CASCADE,
+    -- A flight's price trajectory is read as a time range
+    INDEX ix_price_history_flight_time (flight_id, recorded_at)
+);
+
+-- Create the 'seat_maps' table: one bit per seat, set when the seat is taken
+CREATE TABLE seat_maps (
+    flight_id INT PRIMARY KEY,
+    layout VARCHAR(20) NOT NULL, -- seat letters per row, spaces for aisles, e.g. 'ABC DEF'
+    occupied BLOB NOT NULL, -- bit i = i-th seat counting row by row, little-endian
+    version INT NOT NULL DEFAULT 0, -- bumped on every write, for optimistic concurrency
     FOREIGN KEY (flight_id) REFERENCES flights(id) ON DELETE CASCADE
 );
 
+-- Create the 'pnr_sequence' table: one row, from which worker processes reserve blocks of PNRs
+CREATE TABLE pnr_sequence (
+    id INT PRIMARY KEY,
+    next_value BIGINT NOT NULL DEFAULT 0, -- first sequence number not yet reserved
+    scramble_key VARCHAR(64) NOT NULL -- key of the sequence-to-PNR permutation; never changes
+);
+
+-- Create the 'idempotency_keys' table: the stored response of each keyed booking or payment request
+CREATE TABLE idempotency_keys (
+    scope VARCHAR(32) NOT NULL, -- the endpoint, e.g. 'bookings.create' or 'bookings.pay'
+    `key` VARCHAR(255) NOT NULL, -- the client's Idempotency-Key header
+    request_hash CHAR(64) NOT NULL, -- SHA-256 of the request, to reject a key reused for another request
+    status_code INT, -- NULL while the first request is still running
+    response TEXT, -- JSON body of the completed response
+    created_at DOUBLE NOT NULL, -- Unix time the key was claimed; kept for 24 hours
+    PRIMARY KEY (scope, `key`),
+    INDEX ix_idempotency_keys_created_at (created_at)
+);
+
 -- ---------------------------------
 -- DATA INSERTION (Populating the DB)
 -- ---------------------------------
 
+INSERT INTO airports (code, city, country)
+VALUES
+('DEL', 'Delhi', 'India'),
+('BOM', 'Mumbai', 'India'),
+('MAA', 'Chennai', 'India'),
+('CCU', 'Kolkata', 'India');
+
 INSERT INTO flights (flight_no, origin, destination, departure, arrival, base_fare, total_seats, seats_available, airline_name)
 VALUES
 ('AI101', 'Delhi', 'Mumbai', '2025-11-20 10:00:00', '2025-11-20 12:00:00', 8000.00, 200, 150, 'Air India'),
@@ -60,6 +126,10 @@ VALUES
 ('UK302', 'Chennai', 'Mumbai', '2025-11-22 16:00:00', '2025-11-22 18:30:00', 7000.00, 150, 140, 'Vistara'),
 ('SG401', 'Delhi', 'Kolkata', '2025-11-23 07:00:00', '2025-11-23 09:00:00', 5500.00, 180, 100, 'SpiceJet');
 
+-- Backfill the airport references from the city names
+UPDATE flights f JOIN airports a ON a.city = f.origin SET f.origin_airport_id = a.id;
+UPDATE flights f JOIN airports a ON a.city = f.destination SET f.destination_airport_id = a.id;
+
 
 -- ---------------------------------
 -- SQL PRACTICE QUERIES
@@ -0,0 +1,126 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from pricing_rules import CompiledRules
+
+# --- Monte Carlo Revenue Forecast ---
+# Simulates the rest of each flight's sales window one day at a time, for many paths at once.
+# Every simulated day prices every (flight, path) pair with the live pricing rules and demand
+# jitter, draws booking requests from a Poisson process that ramps up towards departure, and
+# lets each request buy with a probability that falls as the price rises above the base fare.
+
+@dataclass(frozen=True)
+class DemandModel:
+    """Booking-request assumptions. The defaults are a plausible starting point, not fitted to data."""
+    requests_per_seat_per_day: float = 0.01   # request rate far from departure, per seat of capacity
+    late_surge: float = 4.0                   # extra multiple of that rate right before departure
+    surge_decay_days: float = 10.0            # how fast the surge fades with days to departure
+    price_elasticity: float = 1.5             # purchase probability = exp(-elasticity * (price / base_fare - 1))
+
+@dataclass
+class FlightBatch:
+    """Column arrays describing the flights to forecast."""
+    flight_ids: np.ndarray
+    base_fares: np.ndarray
+    seats_available: np.ndarray
+    total_seats: np.ndarray
+    departures: np.ndarray  # datetime64[us]
+    rule_ids: np.ndarray
+
+    def __len__(self):
+        return len(self.flight_ids)
+
+    def take(self, idx) -> "FlightBatch":
+        return FlightBatch(*(column[idx] for column in (
+            self.flight_ids, self.base_fares, self.seats_available, self.total_seats, self.departures, self.rule_ids,
+        )))
+
+FORECAST_FIELDS = ("expected_revenue", "revenue_p10", "revenue_p90", "expected_seats_sold", "expected_load_factor", "sellout_probability")
+
+def simulate(
+    flights: FlightBatch, rules: CompiledRules, demand_range: Tuple[float, float], paths: int = 2000,
+    demand: DemandModel = DemandModel(), now: Optional[datetime] = None, seed=None,
+) -> Dict[str, np.ndarray]:
+    """Runs `paths` sales trajectories for every flight and returns one array per FORECAST_FIELDS entry."""
+    rng = np.random.default_rng(seed)
+    now = np.datetime64(now or datetime.now(), "us")
+    count = len(flights)
+    seats = np.repeat(flights.seats_available.astype(np.int64)[:, None], paths, axis=1)
+    revenue = np.zeros((count, paths))
+    flight_ids = np.arange(count)
+    one_day = np.timedelta64(1, "D")
+    horizon = int(math.ceil(max(((flights.departures - now) / one_day).max(initial=0), 0)))
+
+    for day in range(horizon):
+        sim_now = now + day * one_day
+        active = flight_ids[(flights.departures > sim_now) & (seats > 0).any(axis=1)]
+        if not len(active):
+            break
+        days_left = (flights.departures[active] - sim_now) / one_day
+        total = flights.total_seats[active].astype(np.float64)
+        base = flights.base_fares[active]
+
+        # Price every path of every active flight with the same rule set factors search uses
+        left = seats[active]
+        rule_ids = flights.rule_ids[active]
+        seat_factor = rules.seat_factor((total[:, None] - left) / total[:, None], rule_ids)
+        time_factor = rules.time_factor(np.floor(days_left), rule_ids)
+        list_fares = rules.bound(base[:, None] * seat_factor * time_factor[:, None], base, rule_ids)
+        prices = np.round(list_fares * rng.uniform(*demand_range, size=list_fares.shape), 2)
+
+        # Requests expected today; the last, partial day before departure gets its share only
+        rate = demand.requests_per_seat_per_day * total * (1 + demand.late_surge * np.exp(-days_left / demand.surge_decay_days))
+        buy_probability = np.minimum(1.0, np.exp(-demand.price_elasticity * (prices / base[:, None] - 1)))
+        # Each Poisson request buys independently, so purchases are Poisson with the thinned rate
+        sold = np.minimum(rng.poisson((rate * np.minimum(days_left, 1))[:, None] * buy_probability), left)
+        seats[active] = left - sold
+        revenue[active] += sold * prices
+
+    total = flights.total_seats.astype(np.float64)
+    sold = flights.seats_available[:, None] - seats
+    return {
+        "expected_revenue": revenue.mean(axis=1),
+        "revenue_p10": np.percentile(revenue, 10, axis=1),
+        "revenue_p90": np.percentile(revenue, 90, axis=1),
+        "expected_seats_sold": sold.mean(axis=1),
+        "expected_load_factor": ((total[:, None] - seats) / total[:, None]).mean(axis=1),
+        "sellout_probability": (seats == 0).mean(axis=1),
+    }
+
+def _simulate_chunk(args):
+    return simulate(*args)
+
+def make_forecast_pool(workers: Optional[int] = None) -> Optional[ProcessPoolExecutor]:
+    """A process pool to pass to forecast(), or None when there is only one CPU to run on.
+    Create it once and reuse it: each worker is a fresh interpreter that has to import NumPy."""
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        return None
+    # spawn rather than fork: the API process is multi-threaded
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+def forecast(
+    flights: FlightBatch, rules: CompiledRules, demand_range: Tuple[float, float], paths: int = 2000,
+    demand: DemandModel = DemandModel(), now: Optional[datetime] = None, seed=None,
+    pool: Optional[Executor] = None, chunk_cells: int = 500_000,
+) -> Dict[str, np.ndarray]:
+    """Like simulate(), but splits the flights into chunks of about `chunk_cells` flight-paths and runs
+    them on `pool` (see make_forecast_pool). Without a pool, or with a single chunk, runs in this process."""
+    chunk_size = max(1, chunk_cells // paths)
+    chunks = [np.arange(start, min(start + chunk_size, len(flights))) for start in range(0, len(flights), chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunks))
+    tasks = [(flights.take(idx), rules, demand_range, paths, demand, now, s) for idx, s in zip(chunks, seeds)]
+    if pool is None or len(tasks) <= 1:
+        results = [_simulate_chunk(task) for task in tasks]
+    else:
+        results = list(pool.map(_simulate_chunk, tasks))
+    if not results:
+        return {field: np.empty(0) for field in FORECAST_FIELDS}
+    return {field: np.concatenate([r[field] for r in results]) for field in FORECAST_FIELDS}
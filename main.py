@@ -1,28 +1,65 @@
 import asyncio
+import base64
+import codecs
+import csv
+import gzip
+import hashlib
+import heapq
+import hmac
+import json
+import os
+import queue
 import random
-import string
-from datetime import datetime
+import secrets
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future
+from dataclasses import dataclass
+from datetime import date as date_type, datetime, timedelta, timezone
+from email.utils import format_datetime
 from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException, status
+import numpy as np
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
 # --- NEW IMPORTS ---
 from fastapi.staticfiles import StaticFiles
-from starlette.responses import FileResponse 
+from starlette.responses import FileResponse, JSONResponse, StreamingResponse
 
 from pydantic import BaseModel, Field
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, DECIMAL, ForeignKey, CheckConstraint, func
+from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, DECIMAL, ForeignKey, LargeBinary, CheckConstraint, Index, and_, bindparam, case, func, insert, inspect, literal, or_, select, text, update
 from sqlalchemy.orm import sessionmaker, Session, declarative_base
 from sqlalchemy.exc import IntegrityError
 
-# --- Configuration (Unchanged) ---
-DATABASE_URL = "sqlite:///./flight_booking.db"
+from forecast import DemandModel, FlightBatch, forecast, make_forecast_pool
+from pnr import PNR_SPACE, PnrAllocator, PnrCodec
+from price_history import CHARGED, PRICE_KINDS, PriceHistoryBuffer
+from pricing_rules import CompiledRules, PricingEngine
+from route_graph import Leg, RouteGraph
+from seat_map import SeatMap, cabin_layout, default_layout
 
-# --- SQLAlchemy Setup (Unchanged) ---
+# --- Configuration (MODIFIED) ---
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./flight_booking.db")
+# How long a write waits for SQLite's write lock before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+# Most passengers one group booking (/api/bookings/group) may hold
+GROUP_BOOKING_MAX_PASSENGERS = 9
+
+# --- SQLAlchemy Setup (MODIFIED) ---
 Base = declarative_base()
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False, "timeout": SQLITE_BUSY_TIMEOUT_SECONDS})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-# --- Database Models (Flight is Unchanged) ---
+# --- NEW: Airport Catalog ---
+class Airport(Base):
+    __tablename__ = "airports"
+    id = Column(Integer, primary_key=True, index=True)
+    code = Column(String(3), unique=True, nullable=False)
+    city = Column(String, unique=True, nullable=False)
+    country = Column(String)
+
+# --- Database Models (Flight is MODIFIED) ---
 class Flight(Base):
     __tablename__ = "flights"
     id = Column(Integer, primary_key=True, index=True)
@@ -35,7 +72,13 @@ class Flight(Base):
     total_seats = Column(Integer, nullable=False)
     seats_available = Column(Integer, nullable=False)
     airline_name = Column(String, nullable=False)
-    __table_args__ = (CheckConstraint('seats_available >= 0 AND seats_available <= total_seats'),)
+    # --- NEW --- Canonical airport references; origin/destination text is kept for display
+    origin_airport_id = Column(Integer, ForeignKey("airports.id"))
+    destination_airport_id = Column(Integer, ForeignKey("airports.id"))
+    __table_args__ = (
+        CheckConstraint('seats_available >= 0 AND seats_available <= total_seats'),
+        Index('ix_flights_route_departure', 'origin_airport_id', 'destination_airport_id', 'departure'),
+    )
 
 # --- Database Models (Booking is MODIFIED) ---
 class Booking(Base):
@@ -49,8 +92,56 @@ class Booking(Base):
     # --- MODIFIED ---
     # The default status is now 'Pending' until payment is confirmed.
     status = Column(String, default='Pending', nullable=False) 
+    # --- NEW --- Unix time a Pending booking's seat hold lapses unless it is paid for
+    expires_at = Column(Float)
+    __table_args__ = (
+        Index('ix_bookings_flight_id', 'flight_id'),
+        Index('ix_bookings_status_expires_at', 'status', 'expires_at'),
+    )
+
+# --- NEW: Price History ---
+class PriceHistory(Base):
+    __tablename__ = "price_history"
+    id = Column(Integer, primary_key=True)
+    flight_id = Column(Integer, ForeignKey("flights.id"), nullable=False)
+    recorded_at = Column(Float, nullable=False)  # Unix time in seconds
+    price = Column(Float, nullable=False)
+    kind = Column(Integer, nullable=False)       # price_history.QUOTED or CHARGED
+    __table_args__ = (
+        Index('ix_price_history_flight_time', 'flight_id', 'recorded_at'),
+    )
+
+# --- NEW: Seat Maps ---
+class FlightSeatMap(Base):
+    __tablename__ = "seat_maps"
+    flight_id = Column(Integer, ForeignKey("flights.id"), primary_key=True)
+    layout = Column(String, nullable=False)          # e.g. "ABC DEF", see seat_map.py
+    occupied = Column(LargeBinary, nullable=False)   # one bit per seat, little-endian
+    version = Column(Integer, nullable=False, default=0)
+
+# --- NEW: PNR Sequence ---
+# A single row: the next unreserved sequence number and the key of the permutation that turns
+# sequence numbers into PNRs (see pnr.py). The key must never change once PNRs are issued.
+class PnrSequence(Base):
+    __tablename__ = "pnr_sequence"
+    id = Column(Integer, primary_key=True)
+    next_value = Column(Integer, nullable=False, default=0)
+    scramble_key = Column(String, nullable=False)
+
+# --- NEW: Idempotency Keys ---
+class IdempotencyKey(Base):
+    __tablename__ = "idempotency_keys"
+    scope = Column(String, primary_key=True)     # the endpoint, e.g. "bookings.create"
+    key = Column(String, primary_key=True)       # the client's Idempotency-Key header
+    request_hash = Column(String, nullable=False)
+    status_code = Column(Integer)                # NULL while the first request is still running
+    response = Column(String)                    # JSON body of the completed response
+    created_at = Column(Float, nullable=False)   # unix time the key was claimed
+    __table_args__ = (
+        Index('ix_idempotency_keys_created_at', 'created_at'),
+    )
 
-# --- Pydantic Models (Unchanged) ---
+# --- Pydantic Models (MODIFIED) ---
 class Passenger(BaseModel):
     first_name: str = Field(..., min_length=1, example="John")
     last_name: str = Field(..., min_length=1, example="Doe")
@@ -58,6 +149,10 @@ class Passenger(BaseModel):
 class BookingRequest(BaseModel):
     flight_id: int
     passenger: Passenger
+    # --- NEW --- Token from a search result; when present the quoted price is charged
+    quote_token: Optional[str] = None
+    # --- NEW --- A specific seat such as "12C"; any free seat is assigned when omitted
+    seat_no: Optional[str] = None
 
 class FlightResponse(BaseModel):
     flight_id: int
@@ -70,6 +165,8 @@ class FlightResponse(BaseModel):
     dynamic_price: float
     seats_available: int
     airline_name: str
+    # --- NEW --- Signed price lock, pass it back in BookingRequest.quote_token
+    quote_token: Optional[str] = None
     class Config:
         orm_mode = True # orm_mode is deprecated, but we'll keep it as it's in your file
         from_attributes=True # Use this for Pydantic v2
@@ -78,6 +175,7 @@ class BookingResponse(BaseModel):
     pnr: str
     flight_no: str
     passenger_name: str
+    seat_no: Optional[str] = None
     status: str
     price: float
     departure: datetime
@@ -93,6 +191,88 @@ class PaymentResponse(BaseModel):
     status: str
     message: str
 
+class FareCalendarDay(BaseModel):
+    date: date_type
+    min_price: Optional[float] = None
+    median_price: Optional[float] = None
+    flights: int
+
+class ItineraryResponse(BaseModel):
+    legs: List[FlightResponse]
+    connections: int
+    total_price: float
+    total_duration_hours: float
+
+class RoundTripResponse(BaseModel):
+    outbound: FlightResponse
+    inbound: FlightResponse
+    total_price: float
+    total_duration_hours: float
+
+class FlightForecast(BaseModel):
+    flight_id: int
+    flight_no: str
+    departure: datetime
+    seats_available: int
+    expected_revenue: float
+    revenue_p10: float
+    revenue_p90: float
+    expected_seats_sold: float
+    expected_load_factor: float
+    sellout_probability: float
+
+class ForecastResponse(BaseModel):
+    paths: int
+    flights: List[FlightForecast]
+    total_expected_revenue: float
+    mean_expected_load_factor: Optional[float] = None
+
+class PricePoint(BaseModel):
+    recorded_at: datetime
+    price: float
+    kind: str
+
+class SeatMapResponse(BaseModel):
+    flight_id: int
+    layout: str
+    rows: int
+    seats_available: int
+    available_seats: List[str]
+    occupied_seats: List[str]
+
+class GroupBookingRequest(BaseModel):
+    flight_id: int
+    passengers: List[Passenger] = Field(..., min_length=1, max_length=GROUP_BOOKING_MAX_PASSENGERS)
+    # Rejected when given: a quote token locks the price of one seat, not of a group
+    quote_token: Optional[str] = None
+    # One seat per passenger, in order; seats side by side are assigned when omitted
+    seat_nos: Optional[List[str]] = None
+
+class BulkImportRow(BaseModel):
+    row: int
+    status: str  # "booked" or "rejected"
+    reference: Optional[str] = None
+    flight_id: Optional[int] = None
+    pnr: Optional[str] = None
+    seat_no: Optional[str] = None
+    price: Optional[float] = None
+    error: Optional[str] = None
+
+class BulkImportResponse(BaseModel):
+    rows: int
+    booked: int
+    rejected: int
+    results: List[BulkImportRow]
+
+class GroupBookingResponse(BaseModel):
+    flight_no: str
+    departure: datetime
+    origin: str
+    destination: str
+    price_per_passenger: float
+    total_price: float
+    bookings: List[BookingResponse]
+
 # --- Database Dependency (Unchanged) ---
 def get_db():
     db = SessionLocal()
@@ -101,39 +281,1097 @@ def get_db():
     finally:
         db.close()
 
-# --- Core Logic: Dynamic Pricing Engine (Unchanged) ---
-def calculate_dynamic_price(base_fare: float, seats_available: int, total_seats: int, departure: datetime) -> float:
-    occupancy = (total_seats - seats_available) / total_seats
-    if occupancy < 0.4: seat_factor = 0.9
-    elif occupancy < 0.8: seat_factor = 1.2
-    else: seat_factor = 1.5
+# --- NEW: Read-Only Data Access (Core) ---
+# Read endpoints select just the columns a response needs through SQLAlchemy Core, which skips
+# ORM identity-map and change-tracking work and hands back plain row tuples.
+FLIGHT_ROW_COLUMNS = (
+    Flight.id, Flight.flight_no, Flight.origin, Flight.destination, Flight.departure, Flight.arrival,
+    Flight.base_fare, Flight.seats_available, Flight.total_seats, Flight.airline_name,
+    Flight.origin_airport_id, Flight.destination_airport_id,
+)
+
+# Statements taking a list of ids are built once with an expanding bind parameter: bulk paths pass
+# thousands of ids, and coercing them into a fresh IN clause costs more than the query itself.
+_SELECT_FLIGHT_ROWS = select(*FLIGHT_ROW_COLUMNS).where(Flight.id.in_(bindparam("flight_ids", expanding=True)))
+
+# A SQLAlchemy Row looks attributes up by name on every access, which bulk paths reading a dozen
+# fields of thousands of flights feel; a namedtuple field is a plain index.
+FlightRow = namedtuple("FlightRow", [column.key for column in FLIGHT_ROW_COLUMNS])
+
+def fetch_flight_rows(db: Session, flight_ids) -> dict:
+    """Flight rows for the given ids as FlightRow tuples, keyed by id."""
+    rows = db.connection().execute(_SELECT_FLIGHT_ROWS, {"flight_ids": list(flight_ids)}).all()
+    return {row[0]: FlightRow._make(row) for row in rows}
+
+def fetch_booking_row(db: Session, pnr: str):
+    """One joined booking/flight row with the BookingResponse fields, or None.
+    PNRs are stored upper-case, so an equality match can use the unique index."""
+    return db.connection().execute(
+        select(
+            Booking.pnr, Booking.passenger_name, Booking.seat_no, Booking.status, Booking.price,
+            Flight.flight_no, Flight.departure, Flight.origin, Flight.destination,
+        ).join(Flight, Flight.id == Booking.flight_id).where(Booking.pnr == pnr.upper())
+    ).first()
+
+def list_fares_for_rows(rows, now: Optional[datetime] = None) -> np.ndarray:
+    """List fares for flight rows: read from the price table, or computed when pricing at a given time."""
+    columns = (
+        [float(r.base_fare) for r in rows], [r.seats_available for r in rows],
+        [r.total_seats for r in rows], [r.departure for r in rows],
+    )
+    rule_keys = [flight_rule_key(r) for r in rows]
+    if now is not None:
+        return calculate_list_fares(*columns, now=now, rule_keys=rule_keys)
+    return cached_list_fares([r.id for r in rows], *columns, rule_keys=rule_keys)
+
+def flight_response(row, price: float) -> FlightResponse:
+    """Builds a FlightResponse from a flight row (or Flight instance) and its dynamic price."""
+    return FlightResponse(
+        flight_id=row.id, flight_no=row.flight_no, origin=row.origin,
+        destination=row.destination, departure=row.departure, arrival=row.arrival,
+        duration_hours=round((row.arrival - row.departure).total_seconds() / 3600, 2), dynamic_price=price,
+        seats_available=row.seats_available, airline_name=row.airline_name,
+        quote_token=issue_quote_token(row.id, price)
+    )
+
+# --- NEW: Schema Migrations ---
+# IATA codes for the cities we already fly; unknown cities get a generated code.
+KNOWN_AIRPORTS = {
+    "delhi": ("DEL", "India"), "new delhi": ("DEL", "India"), "mumbai": ("BOM", "India"),
+    "chennai": ("MAA", "India"), "kolkata": ("CCU", "India"), "bengaluru": ("BLR", "India"),
+    "bangalore": ("BLR", "India"), "hyderabad": ("HYD", "India"), "pune": ("PNQ", "India"),
+    "ahmedabad": ("AMD", "India"), "goa": ("GOI", "India"), "jaipur": ("JAI", "India"),
+    "kochi": ("COK", "India"), "lucknow": ("LKO", "India"),
+}
+
+def _airport_code_for(city: str, used_codes: set) -> str:
+    known = KNOWN_AIRPORTS.get(normalize_city(city))
+    if known and known[0] not in used_codes:
+        return known[0]
+    letters = [c for c in city.upper() if c.isalpha()] or ["X"]
+    candidates = [letters[0] + a + b for i, a in enumerate(letters[1:], 1) for b in letters[i + 1:]]
+    for code in [''.join(letters[:3]).ljust(3, "X")] + candidates:
+        if code not in used_codes:
+            return code
+    n = 0
+    while f"{letters[0]}{n:02d}" in used_codes:
+        n += 1
+    return f"{letters[0]}{n:02d}"
+
+def apply_migrations(bind=engine):
+    """Brings an existing database up to the current models. Safe to run repeatedly."""
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        flight_columns = {c["name"] for c in inspect(conn).get_columns("flights")}
+        for column in ("origin_airport_id", "destination_airport_id"):
+            if column not in flight_columns:
+                conn.execute(text(f"ALTER TABLE flights ADD COLUMN {column} INTEGER REFERENCES airports(id)"))
+        if "expires_at" not in {c["name"] for c in inspect(conn).get_columns("bookings")}:
+            conn.execute(text("ALTER TABLE bookings ADD COLUMN expires_at FLOAT"))
+        # Holds taken before holds could expire get the full hold time from now
+        conn.execute(
+            text("UPDATE bookings SET expires_at = :expires_at WHERE status = 'Pending' AND expires_at IS NULL"),
+            {"expires_at": time.time() + PENDING_HOLD_SECONDS},
+        )
+        for index in (*Flight.__table__.indexes, *Booking.__table__.indexes):
+            index.create(conn, checkfirst=True)
+        _backfill_airports(conn)
+    _seed_pnr_sequence(bind)
+
+def _seed_pnr_sequence(bind):
+    """Creates the PNR sequence row with a fresh permutation key, unless some process already has."""
+    with bind.connect() as conn:
+        if conn.execute(select(PnrSequence.id)).first() is not None:
+            return
+    try:
+        with bind.begin() as conn:
+            conn.execute(insert(PnrSequence).values(id=1, next_value=0, scramble_key=secrets.token_hex(16)))
+    except IntegrityError:
+        pass  # another worker process seeded it first
+
+def _backfill_airports(conn):
+    """Creates catalog entries for every city used by a flight and fills in the airport ids."""
+    missing = conn.execute(text(
+        "SELECT origin FROM flights WHERE origin_airport_id IS NULL "
+        "UNION SELECT destination FROM flights WHERE destination_airport_id IS NULL"
+    )).scalars().all()
+    if not missing:
+        return
+    airports = {normalize_city(city): airport_id for airport_id, city in conn.execute(text("SELECT id, city FROM airports"))}
+    used_codes = set(conn.execute(text("SELECT code FROM airports")).scalars())
+    for city in missing:
+        if normalize_city(city) in airports:
+            continue
+        code = _airport_code_for(city, used_codes)
+        used_codes.add(code)
+        country = KNOWN_AIRPORTS.get(normalize_city(city), (None, None))[1]
+        airport_id = conn.execute(Airport.__table__.insert().values(code=code, city=city.strip(), country=country)).inserted_primary_key[0]
+        airports[normalize_city(city)] = airport_id
+    for column, text_column in (("origin_airport_id", "origin"), ("destination_airport_id", "destination")):
+        conn.execute(
+            text(f"UPDATE flights SET {column} = :airport_id WHERE {text_column} = :city AND {column} IS NULL"),
+            [{"airport_id": airports[normalize_city(city)], "city": city} for city in missing],
+        )
 
-    days_to_departure = (departure - datetime.now()).days
-    if days_to_departure > 45: time_factor = 0.85
-    elif days_to_departure > 10: time_factor = 1.1
-    else: time_factor = 1.4
+# --- Core Logic: Dynamic Pricing Engine (MODIFIED) ---
+# Seat/time factors now come from the active pricing rule set (see pricing_rules.py);
+# with no rules file the default set reproduces the original thresholds.
+def calculate_dynamic_price(base_fare: float, seats_available: int, total_seats: int, departure: datetime, rule_key: Optional[tuple] = None) -> float:
+    rules = pricing_engine.rules
+    rule_id = 0
+    if rule_key and not rules.single:
+        airline, origin_id, destination_id = rule_key
+        rule_id = rules.rule_id(airline, airport_catalog.code_of(origin_id), airport_catalog.code_of(destination_id))
+    list_fare = rules.list_fare(base_fare, seats_available, total_seats, departure, rule_id)
 
-    demand_factor = random.uniform(0.98, 1.08)
-    dynamic_price = base_fare * seat_factor * time_factor * demand_factor
+    demand_factor = random.uniform(*DEMAND_FACTOR_RANGE)
+    dynamic_price = list_fare * demand_factor
     return round(dynamic_price, 2)
 
-# --- Helper Functions (Unchanged) ---
+# --- NEW: Pricing Rule Sets ---
+PRICING_RULES_PATH = os.getenv("PRICING_RULES_PATH", "pricing_rules.json")
+PRICING_RULES_POLL_SECONDS = 5
+
+pricing_engine = PricingEngine(PRICING_RULES_PATH)
+
+def flight_rule_key(flight) -> tuple:
+    """What a flight's rule set is chosen by: (airline name, origin airport id, destination airport id)."""
+    return (flight.airline_name, flight.origin_airport_id, flight.destination_airport_id)
+
+def pricing_rule_ids(rules: CompiledRules, rule_keys) -> np.ndarray:
+    """Rule set index per flight under the given compiled rules; all zeros when only the default exists."""
+    if rules.single:
+        return np.zeros(len(rule_keys), dtype=np.int64)
+    code = airport_catalog.code_of
+    return np.fromiter(
+        (rules.rule_id(airline, code(origin_id), code(destination_id)) for airline, origin_id, destination_id in rule_keys),
+        dtype=np.int64, count=len(rule_keys),
+    )
+
+# --- NEW: Batch Pricing Engine ---
+# The rule sets are compiled into lookup arrays, so a whole result set is priced with a
+# few array operations instead of a Python loop.
+DEMAND_FACTOR_RANGE = (0.98, 1.08)
+
+_pricing_rng = np.random.default_rng()
+
+def calculate_list_fares(base_fares, seats_available, total_seats, departures, now: Optional[datetime] = None, rule_keys=None) -> np.ndarray:
+    """Vectorized base_fare * seat_factor * time_factor, i.e. the dynamic price before the demand jitter.
+    `rule_keys` (one flight_rule_key() per fare) selects each flight's rule set; omitted means the default."""
+    rules = pricing_engine.rules
+    rule_ids = pricing_rule_ids(rules, rule_keys) if rule_keys is not None else None
+    return rules.list_fares(base_fares, seats_available, total_seats, departures, rule_ids, now=now)
+
+def apply_demand_jitter(list_fares, rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """Applies one random demand factor per fare and rounds to the final dynamic price."""
+    list_fares = np.asarray(list_fares, dtype=np.float64)
+    demand_factor = (rng or _pricing_rng).uniform(*DEMAND_FACTOR_RANGE, size=list_fares.shape)
+    return np.round(list_fares * demand_factor, 2)
+
+JULIAN_DAY_UNIX_EPOCH = 2440587.5
+
+def julian_days_to_datetime64(julian_days) -> np.ndarray:
+    """Converts SQLite julianday() values to datetime64[us], rounded to the millisecond julianday keeps."""
+    millis = np.round((np.asarray(julian_days, dtype=np.float64) - JULIAN_DAY_UNIX_EPOCH) * 86_400_000)
+    return (millis.astype(np.int64) * 1000).astype("datetime64[us]")
+
+def calculate_dynamic_prices(base_fares, seats_available, total_seats, departures, now: Optional[datetime] = None, rng: Optional[np.random.Generator] = None, rule_keys=None) -> np.ndarray:
+    """Vectorized version of calculate_dynamic_price. Takes array-likes and returns an array of prices."""
+    return apply_demand_jitter(calculate_list_fares(base_fares, seats_available, total_seats, departures, now=now, rule_keys=rule_keys), rng=rng)
+
+def price_flights(flights, now: Optional[datetime] = None) -> np.ndarray:
+    """Prices a list of flight rows (or Flight instances) in one batch call. Use this for any endpoint returning many flights."""
+    if not flights:
+        return np.empty(0)
+    return apply_demand_jitter(list_fares_for_rows(flights, now=now))
+
+# --- NEW: Precomputed Price Table ---
+class FlightPriceTable:
+    """Per-flight list fares (base_fare * seat_factor * time_factor) in arrays indexed by flight id.
+
+    A list fare only moves when occupancy crosses a seat breakpoint or the days to departure cross
+    a time breakpoint of the flight's rule set, so entries are recomputed on those events alone:
+    seat changes arrive through notify_flight_changed(), and every entry remembers when its time
+    bucket runs out so a read refreshes it lazily. The day-boundary job and a pricing rules reload
+    rebuild everything.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rules = pricing_engine.rules
+        self._allocate(0)
+        self.built = False
+        self.recomputes = 0
+
+    def _allocate(self, size: int):
+        self._known = np.zeros(size, dtype=bool)
+        self._base_fare = np.zeros(size)
+        self._seats = np.zeros(size)
+        self._total = np.ones(size)
+        self._departure = np.full(size, np.datetime64("NaT"), dtype="datetime64[us]")
+        self._rule_id = np.zeros(size, dtype=np.int64)
+        self._seat_bucket = np.zeros(size, dtype=np.int8)
+        self._stale_at = np.full(size, np.datetime64("NaT"), dtype="datetime64[us]")
+        self._list_fare = np.zeros(size)
+
+    def _arrays(self) -> tuple:
+        return (self._known, self._base_fare, self._seats, self._total, self._departure, self._rule_id, self._seat_bucket, self._stale_at, self._list_fare)
+
+    def _grow(self, size: int):
+        old = self._arrays()
+        self._allocate(max(size, 2 * len(old[0])))
+        for new_array, old_array in zip(self._arrays(), old):
+            new_array[:len(old_array)] = old_array
+
+    def _recompute(self, idx: np.ndarray, now: np.datetime64):
+        list_fares, seat_bucket, stale_at = self._rules.evaluate(
+            self._base_fare[idx], self._seats[idx], self._total[idx], self._departure[idx], self._rule_id[idx], now=now
+        )
+        self._list_fare[idx] = list_fares
+        self._seat_bucket[idx] = seat_bucket
+        self._stale_at[idx] = stale_at
+        self.recomputes += len(idx)
+
+    def build(self, db: Session):
+        rules = pricing_engine.rules
+        rows = db.connection().execute(
+            select(
+                Flight.id, func.cast(Flight.base_fare, Float), Flight.seats_available, Flight.total_seats, Flight.departure,
+                Flight.airline_name, Flight.origin_airport_id, Flight.destination_airport_id,
+            )
+        ).all()
+        with self._lock:
+            self._rules = rules
+            self._allocate(max((r[0] for r in rows), default=-1) + 1)
+            if rows:
+                idx = np.array([r[0] for r in rows])
+                self._base_fare[idx] = [r[1] for r in rows]
+                self._seats[idx] = [r[2] for r in rows]
+                self._total[idx] = [r[3] for r in rows]
+                self._departure[idx] = np.array([r[4] for r in rows], dtype="datetime64[us]")
+                self._rule_id[idx] = pricing_rule_ids(rules, [r[5:] for r in rows])
+                self._known[idx] = True
+                self._recompute(idx, np.datetime64(datetime.now(), "us"))
+            self.built = True
+
+    def update(self, flight: "Flight"):
+        self.update_many([flight])
+
+    def update_many(self, flights: list):
+        """Takes the current rows of several flights under one lock and reprices them in one batch."""
+        if not flights:
+            return
+        idx = np.fromiter((flight.id for flight in flights), dtype=np.int64, count=len(flights))
+        base_fare = np.array([float(flight.base_fare) for flight in flights])
+        seats = np.array([flight.seats_available for flight in flights], dtype=np.float64)
+        total = np.array([flight.total_seats for flight in flights], dtype=np.float64)
+        departure = np.array([flight.departure for flight in flights], dtype="datetime64[us]")
+        with self._lock:
+            if idx.max() >= len(self._known):
+                self._grow(int(idx.max()) + 1)
+            rule_id = pricing_rule_ids(self._rules, [flight_rule_key(flight) for flight in flights])
+            changed = (
+                ~self._known[idx] | (self._base_fare[idx] != base_fare) | (self._total[idx] != total)
+                | (self._departure[idx] != departure) | (self._rule_id[idx] != rule_id)
+            )
+            self._base_fare[idx], self._total[idx], self._departure[idx] = base_fare, total, departure
+            self._seats[idx] = seats
+            self._rule_id[idx] = rule_id
+            self._known[idx] = True
+            changed |= self._rules.seat_buckets(seats, total, rule_id) != self._seat_bucket[idx]
+            if changed.any():
+                self._recompute(np.unique(idx[changed]), np.datetime64(datetime.now(), "us"))
+
+    def lookup(self, flight_ids, now: Optional[datetime] = None) -> np.ndarray:
+        """List fares for the given ids; NaN for flights the table does not know."""
+        ids = np.asarray(flight_ids, dtype=np.int64)
+        now = np.datetime64(now or datetime.now(), "us")
+        with self._lock:
+            in_range = (ids >= 0) & (ids < len(self._known))
+            safe_ids = np.where(in_range, ids, 0)
+            known = in_range & self._known[safe_ids]
+            stale = known & (self._stale_at[safe_ids] < now)
+            if stale.any():
+                self._recompute(np.unique(ids[stale]), now)
+            return np.where(known, self._list_fare[safe_ids], np.nan)
+
+price_table = FlightPriceTable()
+
+def rebuild_price_table():
+    with SessionLocal() as db:
+        price_table.build(db)
+
+def cached_list_fares(flight_ids, base_fares, seats_available, total_seats, departures, rule_keys=None) -> np.ndarray:
+    """List fares from the price table, computing only the flights it does not hold yet."""
+    if not price_table.built:
+        return calculate_list_fares(base_fares, seats_available, total_seats, departures, rule_keys=rule_keys)
+    fares = price_table.lookup(flight_ids)
+    missing = np.flatnonzero(np.isnan(fares))
+    if len(missing):
+        pick = lambda values: np.asarray(values)[missing]
+        fares[missing] = calculate_list_fares(
+            pick(base_fares), pick(seats_available), pick(total_seats), pick(departures),
+            rule_keys=[rule_keys[i] for i in missing] if rule_keys is not None else None,
+        )
+    return fares
+
+# --- NEW: In-Memory Route/Date Index ---
+def normalize_city(name: str) -> str:
+    """Case- and whitespace-insensitive form of a city name, used as an index key."""
+    return " ".join(name.split()).casefold()
+
+class AirportCatalog:
+    """Resolves user-typed city names or airport codes to airport ids, loaded once from the airports table."""
+    def __init__(self):
+        self._ids = {}
+        self._codes = {}
+        self.loaded = False
+
+    def load(self, db: Session):
+        ids, codes = {}, {}
+        for airport_id, code, city in db.query(Airport.id, Airport.code, Airport.city).all():
+            ids[normalize_city(city)] = airport_id
+            ids[code.casefold()] = airport_id
+            codes[airport_id] = code
+        self._ids, self._codes = ids, codes
+        self.loaded = True
+
+    def resolve(self, name: str) -> Optional[int]:
+        return self._ids.get(normalize_city(name))
+
+    def code_of(self, airport_id: Optional[int]) -> Optional[str]:
+        return self._codes.get(airport_id)
+
+airport_catalog = AirportCatalog()
+
+class FlightSearchIndex:
+    """Maps (origin airport, destination airport, departure date) to the ids of flights that still have seats.
+
+    Built once at startup from the flights table and kept current by notify_flight_changed(),
+    so exact-match searches become a dict lookup instead of a query.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}  # (origin_airport_id, destination_airport_id, date) -> set of flight ids with seats left
+        self._keys = {}    # flight id -> (origin_airport_id, destination_airport_id, date)
+        self.built = False
+
+    def build(self, db: Session):
+        rows = db.query(
+            Flight.id, Flight.origin_airport_id, Flight.destination_airport_id, Flight.departure, Flight.seats_available
+        ).all()
+        routes, keys = {}, {}
+        for flight_id, origin_id, destination_id, departure, seats_available in rows:
+            key = (origin_id, destination_id, departure.date())
+            keys[flight_id] = key
+            ids = routes.setdefault(key, set())
+            if seats_available > 0:
+                ids.add(flight_id)
+        with self._lock:
+            self._routes, self._keys = routes, keys
+            self.built = True
+
+    def update(self, flight: "Flight"):
+        self.update_many([flight])
+
+    def update_many(self, flights: list):
+        with self._lock:
+            for flight in flights:
+                key = (flight.origin_airport_id, flight.destination_airport_id, flight.departure.date())
+                old_key = self._keys.get(flight.id)
+                if old_key is not None and old_key != key:
+                    self._routes[old_key].discard(flight.id)
+                self._keys[flight.id] = key
+                ids = self._routes.setdefault(key, set())
+                if flight.seats_available > 0:
+                    ids.add(flight.id)
+                else:
+                    ids.discard(flight.id)
+
+    def lookup(self, origin_id: int, destination_id: int, day: date_type) -> List[int]:
+        with self._lock:
+            return list(self._routes.get((origin_id, destination_id, day), ()))
+
+flight_index = FlightSearchIndex()
+
+# --- NEW: Search Result Cache ---
+SEARCH_CACHE_SIZE = 1024
+SEARCH_CACHE_TTL_SECONDS = 30
+
+class SearchResultCache:
+    """Bounded LRU cache with a TTL for search results.
+
+    Each entry is stored with a set of tags (the flights it contains, the route/day it covers)
+    so a seat change on one flight only drops the entries that could show it.
+
+    Every invalidation bumps `generation`. A caller reads it before querying and passes it to
+    put(), which drops the entry if an invalidation happened meanwhile: the query may have read
+    rows from before the change, and that invalidation could not remove an entry not yet stored.
+    """
+    def __init__(self, maxsize: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._by_tag = {}              # tag -> set of keys
+        self.generation = 0
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = self.stale_puts = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, tags, generation: Optional[int] = None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                self.stale_puts += 1
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value, tags)
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self.generation += 1
+            for tag in tags:
+                for key in self._by_tag.pop(tag, ()):
+                    if key in self._entries:
+                        self._remove(key)
+                        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_tag.clear()
+
+    def _remove(self, key):
+        _, _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries), "maxsize": self.maxsize, "ttl_seconds": self.ttl,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "expirations": self.expirations, "invalidations": self.invalidations, "stale_puts": self.stale_puts,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+search_cache = SearchResultCache()
+
+# --- NEW: Connecting-Flight Route Graph ---
+route_graph = RouteGraph()
+
+def leg_from_flight(flight) -> Leg:
+    return Leg(
+        flight_id=flight.id, origin_id=flight.origin_airport_id, destination_id=flight.destination_airport_id,
+        departure=flight.departure, arrival=flight.arrival, base_fare=float(flight.base_fare),
+        total_seats=flight.total_seats, seats_available=flight.seats_available, airline_name=flight.airline_name,
+    )
+
+def build_route_graph(db: Session):
+    rows = db.query(
+        Flight.id, Flight.origin_airport_id, Flight.destination_airport_id, Flight.departure, Flight.arrival,
+        Flight.base_fare, Flight.total_seats, Flight.seats_available, Flight.airline_name
+    ).filter(Flight.departure > datetime.now()).all()
+    route_graph.build([leg_from_flight(row) for row in rows])
+
+def price_legs(legs: List[Leg]) -> np.ndarray:
+    """Batch list fares for route graph legs; the demand jitter is added once itineraries are chosen."""
+    return cached_list_fares(
+        [leg.flight_id for leg in legs], [leg.base_fare for leg in legs], [leg.seats_available for leg in legs],
+        [leg.total_seats for leg in legs], [leg.departure for leg in legs],
+        rule_keys=[(leg.airline_name, leg.origin_id, leg.destination_id) for leg in legs],
+    )
+
+def notify_flight_changed(flight: "Flight"):
+    """Call after committing any change to a flight so in-memory structures stay in sync."""
+    notify_flights_changed([flight])
+
+def notify_flights_changed(flights: list):
+    """notify_flight_changed() for many flights at once, taking each structure's lock once."""
+    if not flights:
+        return
+    if flight_index.built:
+        flight_index.update_many(flights)
+    if route_graph.built:
+        route_graph.upsert_many([leg_from_flight(flight) for flight in flights])
+    if price_table.built:
+        price_table.update_many(flights)
+    # A seat change can add the flight to, or drop it from, searches it is not cached in yet
+    tags = set()
+    for flight in flights:
+        day = flight.departure.date()
+        tags.update((("flight", flight.id), ("route", flight.origin_airport_id, flight.destination_airport_id, day), ("day", day)))
+    search_cache.invalidate(*tags)
+
+# --- NEW: Atomic Seat Inventory ---
+# SQLite ignores SELECT ... FOR UPDATE, so every inventory change is a single conditional UPDATE
+# whose WHERE clause does the availability check. RETURNING hands back the updated flight row
+# (or nothing when the condition failed), ready for pricing and notify_flight_changed().
+# The statements are built once; constructing them costs more than running them.
+_RESERVE_SEATS = (
+    update(Flight)
+    .where(Flight.id == bindparam("flight_id"), Flight.seats_available >= bindparam("count"))
+    .values(seats_available=Flight.seats_available - bindparam("count"))
+    .returning(*FLIGHT_ROW_COLUMNS)
+)
+_RELEASE_SEATS = (
+    update(Flight)
+    .where(Flight.id == bindparam("flight_id"), Flight.seats_available + bindparam("count") <= Flight.total_seats)
+    .values(seats_available=Flight.seats_available + bindparam("count"))
+    .returning(*FLIGHT_ROW_COLUMNS)
+)
+_SELECT_FLIGHT_ROW = select(*FLIGHT_ROW_COLUMNS).where(Flight.id == bindparam("flight_id"))
+_SELECT_SEATS_AVAILABLE = select(Flight.id, Flight.seats_available).where(Flight.id.in_(bindparam("flight_ids", expanding=True)))
+
+def reserve_seats(db: Session, flight_id: int, count: int = 1):
+    """Takes `count` seats inside db's transaction. Returns the updated flight row, or None when the
+    flight does not exist or has fewer than `count` seats left."""
+    return db.connection().execute(_RESERVE_SEATS, {"flight_id": flight_id, "count": count}).first()
+
+def release_seats(db: Session, flight_id: int, count: int = 1):
+    """Gives `count` seats back inside db's transaction, never above total_seats. Returns the updated row or None."""
+    return db.connection().execute(_RELEASE_SEATS, {"flight_id": flight_id, "count": count}).first()
+
+def reserve_seats_many(db: Session, requested: dict):
+    """Takes as many of requested[flight_id] seats as each flight has left, with one conditional
+    UPDATE per flight sent as a single executemany. Returns ({flight_id: updated row}, {flight_id:
+    seats taken}); flights missing from the rows do not exist. Returns None when a concurrent
+    booking changed a count between the read and the update; the caller should roll back and retry."""
+    conn = db.connection()
+    left = dict(conn.execute(_SELECT_SEATS_AVAILABLE, {"flight_ids": list(requested)}).all())
+    taken = {flight_id: min(count, left[flight_id]) for flight_id, count in requested.items() if left.get(flight_id)}
+    if taken:
+        result = conn.exec_driver_sql(
+            "UPDATE flights SET seats_available = seats_available - ? WHERE id = ? AND seats_available >= ?",
+            [(count, flight_id, count) for flight_id, count in taken.items()],
+        )
+        if result.rowcount != len(taken):
+            return None
+    return fetch_flight_rows(db, requested), taken
+
+def set_booking_status(db: Session, booking_id: int, from_statuses, to_status: str) -> bool:
+    """Moves a booking to `to_status` only if it is still in one of `from_statuses`, so two concurrent
+    requests cannot both act on the same transition (e.g. release its seat twice)."""
+    result = db.connection().execute(
+        update(Booking).where(Booking.booking_id == booking_id, Booking.status.in_(list(from_statuses))).values(status=to_status)
+    )
+    return result.rowcount == 1
+
+def fetch_booking_for_update(db: Session, pnr: str):
+    """The id, flight, seat, status and hold expiry of a booking, looked up through the unique PNR index."""
+    return db.connection().execute(
+        select(Booking.booking_id, Booking.flight_id, Booking.seat_no, Booking.status, Booking.expires_at).where(Booking.pnr == pnr.upper())
+    ).first()
+
+# --- NEW: Seat Assignment ---
+# Each flight's occupied seats are a bitmap in seat_maps (see seat_map.py). Seats are assigned
+# and freed in the same transaction as the matching seats_available change, and the bitmap is
+# written back with a version check, so the counter and the map commit together or not at all.
+# A flight gets its map the first time one is needed: seats of existing bookings keep (or are
+# given) a number, and seats sold without a booking, e.g. by the market simulator, are marked
+# occupied so the map always has total_seats - seats_available seats taken.
+HOLDING_STATUSES = ("Pending", "Confirmed")
+_SELECT_HOLDING_SEATS = (
+    select(Booking.booking_id, Booking.flight_id, Booking.seat_no)
+    .where(Booking.flight_id.in_(bindparam("flight_ids", expanding=True)), Booking.status.in_(HOLDING_STATUSES))
+    .order_by(Booking.booking_id)
+)
+_SELECT_SEAT_MAPS = (
+    select(FlightSeatMap.flight_id, FlightSeatMap.layout, FlightSeatMap.occupied, FlightSeatMap.version)
+    .where(FlightSeatMap.flight_id.in_(bindparam("flight_ids", expanding=True)))
+)
+
+def _build_seat_maps(db: Session, flights: dict, held: dict, assign_unseated: bool = True) -> dict:
+    """New seat maps for flights that have none yet. held[flight_id] is how many seats the flight
+    had sold before the caller's own change. Bookings without a valid seat get one, written back
+    unless assign_unseated is False."""
+    conn = db.connection()
+    seat_maps = {
+        flight_id: SeatMap(cabin_layout(default_layout(flight.total_seats), flight.total_seats))
+        for flight_id, flight in flights.items()
+    }
+    unseated = {flight_id: [] for flight_id in flights}
+    for booking_id, flight_id, seat_no in conn.execute(_SELECT_HOLDING_SEATS, {"flight_ids": list(flights)}):
+        seat_map = seat_maps[flight_id]
+        index = seat_map.layout.parse(seat_no)
+        if index is None or not seat_map.is_free(index):
+            unseated[flight_id].append(booking_id)
+        else:
+            seat_map.take(index)
+
+    assigned = []
+    for flight_id, seat_map in seat_maps.items():
+        booking_ids = unseated[flight_id][:seat_map.layout.total_seats - seat_map.occupied_count]
+        for booking_id, index in zip(booking_ids, seat_map.allocate(len(booking_ids))):
+            assigned.append((seat_map.layout.seat_no(index), booking_id))
+        unsold = held[flight_id] - seat_map.occupied_count
+        if unsold > 0:
+            seat_map.allocate(min(unsold, seat_map.layout.total_seats - seat_map.occupied_count))
+    if assign_unseated and assigned:
+        conn.exec_driver_sql("UPDATE bookings SET seat_no = ? WHERE booking_id = ?", assigned)
+    return seat_maps
+
+def load_seat_maps(db: Session, flights: dict, held: dict, assign_unseated: bool = True) -> dict:
+    """{flight_id: (SeatMap, version)} for the given flight rows; version is None for a map built
+    just now (see _build_seat_maps) that save_seat_maps() still has to insert."""
+    rows = db.connection().execute(_SELECT_SEAT_MAPS, {"flight_ids": list(flights)}).all()
+    seat_maps = {
+        row.flight_id: (SeatMap.from_bytes(cabin_layout(row.layout, flights[row.flight_id].total_seats), row.occupied), row.version)
+        for row in rows
+    }
+    missing = {flight_id: flight for flight_id, flight in flights.items() if flight_id not in seat_maps}
+    if missing:
+        built = _build_seat_maps(db, missing, held, assign_unseated)
+        seat_maps.update((flight_id, (seat_map, None)) for flight_id, seat_map in built.items())
+    return seat_maps
+
+def save_seat_maps(db: Session, seat_maps: dict) -> bool:
+    """Writes maps from load_seat_maps() back. False if another transaction changed one of them
+    since it was read, in which case the caller must roll back."""
+    conn = db.connection()
+    new = [(flight_id, seat_map.layout.pattern, seat_map.to_bytes()) for flight_id, (seat_map, version) in seat_maps.items() if version is None]
+    changed = [(seat_map.to_bytes(), flight_id, version) for flight_id, (seat_map, version) in seat_maps.items() if version is not None]
+    if new:
+        conn.exec_driver_sql("INSERT INTO seat_maps (flight_id, layout, occupied, version) VALUES (?, ?, ?, 0)", new)
+    if changed:
+        result = conn.exec_driver_sql("UPDATE seat_maps SET occupied = ?, version = version + 1 WHERE flight_id = ? AND version = ?", changed)
+        return result.rowcount == len(changed)
+    return True
+
+def assign_seats(db: Session, flight, count: int = 1, seat_nos: Optional[List[str]] = None, adjacent: bool = False) -> List[str]:
+    """Picks seats for `count` passengers right after reserve_seats(db, flight.id, count) returned
+    `flight`: the requested seat_nos, or free seats (side by side when adjacent). Raises HTTPException."""
+    seat_maps = load_seat_maps(db, {flight.id: flight}, {flight.id: flight.total_seats - flight.seats_available - count})
+    seat_map = seat_maps[flight.id][0]
+    if seat_nos:
+        indices = []
+        for seat_no in seat_nos:
+            index = seat_map.layout.parse(seat_no)
+            if index is None:
+                raise HTTPException(status_code=400, detail=f"Seat {seat_no} does not exist on this flight.")
+            if not seat_map.is_free(index):
+                raise HTTPException(status_code=409, detail=f"Seat {seat_no} is not available.")
+            seat_map.take(index)
+            indices.append(index)
+    else:
+        indices = seat_map.allocate(count, adjacent=adjacent)
+        if indices is None:
+            raise HTTPException(status_code=400, detail="No seats available.")
+    if not save_seat_maps(db, seat_maps):
+        raise HTTPException(status_code=409, detail="Seat map changed while booking. Please try again.")
+    return [seat_map.layout.seat_no(index) for index in indices]
+
+def free_seats(db: Session, flight, seat_nos: List[Optional[str]]):
+    """Marks seats free again after release_seats() returned `flight`. A flight without a map yet
+    needs nothing, as its map is built from the counter. Raises HTTPException on a conflict."""
+    row = db.connection().execute(
+        select(FlightSeatMap.layout, FlightSeatMap.occupied, FlightSeatMap.version).where(FlightSeatMap.flight_id == flight.id)
+    ).first()
+    if row is None:
+        return
+    seat_map = SeatMap.from_bytes(cabin_layout(row.layout, flight.total_seats), row.occupied)
+    for seat_no in seat_nos:
+        index = seat_map.layout.parse(seat_no)
+        if index is not None:
+            seat_map.release(index)
+    if not save_seat_maps(db, {flight.id: (seat_map, row.version)}):
+        raise HTTPException(status_code=409, detail="Seat map changed while releasing a seat. Please try again.")
+
+# --- NEW: Pending Hold Expiry ---
+# A Pending booking holds its seat for PENDING_HOLD_SECONDS. A background reaper finds lapsed holds
+# through the (status, expires_at) index and expires them in batches: one conditional UPDATE ...
+# RETURNING moves a batch from Pending to Expired, so a payment or cancel racing with it wins or
+# loses cleanly, then each flight gets its seats back with one conditional UPDATE (all flights in
+# one executemany) and its seat map written once.
+PENDING_HOLD_SECONDS = 15 * 60
+HOLD_REAPER_INTERVAL_SECONDS = 30
+HOLD_REAPER_BATCH = 1000
+HOLD_REAPER_ATTEMPTS = 3
+
+_EXPIRE_HOLDS = text(
+    "UPDATE bookings SET status = 'Expired' WHERE status = 'Pending' AND booking_id IN ("
+    "SELECT booking_id FROM bookings WHERE status = 'Pending' AND expires_at < :now ORDER BY expires_at LIMIT :limit"
+    ") RETURNING booking_id, flight_id, seat_no"
+)
+
+class HoldReaperStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.runs = self.expired = self.batches = 0
+        self.last_run_at = None
+
+    def add(self, expired: int, batches: int):
+        with self._lock:
+            self.runs += 1
+            self.expired += expired
+            self.batches += batches
+            self.last_run_at = time.time()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "reaper_runs": self.runs, "expired_total": self.expired,
+                "expired_batches": self.batches, "last_reaper_run_at": self.last_run_at,
+            }
+
+hold_reaper_stats = HoldReaperStats()
+
+def expire_hold_batch(now: float, limit: int = HOLD_REAPER_BATCH) -> int:
+    """Expires up to `limit` lapsed holds in one transaction and gives their seats back. Returns
+    how many bookings were expired."""
+    with SessionLocal() as db:
+        for attempt in range(HOLD_REAPER_ATTEMPTS):
+            expired = db.connection().execute(_EXPIRE_HOLDS, {"now": now, "limit": limit}).all()
+            if not expired:
+                db.rollback()
+                return 0
+            seats = {}
+            for booking in expired:
+                seats.setdefault(booking.flight_id, []).append(booking.seat_no)
+            db.connection().exec_driver_sql(
+                "UPDATE flights SET seats_available = seats_available + ? WHERE id = ? AND seats_available + ? <= total_seats",
+                [(len(seat_nos), flight_id, len(seat_nos)) for flight_id, seat_nos in seats.items()],
+            )
+            flights = fetch_flight_rows(db, seats)
+            # Flights without a map need nothing: their map is built from the counter
+            seat_maps = {}
+            for row in db.connection().execute(_SELECT_SEAT_MAPS, {"flight_ids": list(flights)}):
+                seat_map = SeatMap.from_bytes(cabin_layout(row.layout, flights[row.flight_id].total_seats), row.occupied)
+                for seat_no in seats[row.flight_id]:
+                    index = seat_map.layout.parse(seat_no)
+                    if index is not None:
+                        seat_map.release(index)
+                seat_maps[row.flight_id] = (seat_map, row.version)
+            if not save_seat_maps(db, seat_maps):
+                db.rollback()
+                continue
+            db.commit()
+            break
+        else:
+            return 0
+    notify_flights_changed(list(flights.values()))
+    return len(expired)
+
+def expire_lapsed_holds(now: Optional[float] = None) -> int:
+    """Expires every hold that lapsed by `now`, batch by batch. Returns how many were expired."""
+    now = time.time() if now is None else now
+    total = batches = 0
+    while True:
+        expired = expire_hold_batch(now)
+        total += expired
+        batches += 1 if expired else 0
+        if expired < HOLD_REAPER_BATCH:
+            break
+    hold_reaper_stats.add(total, batches)
+    return total
+
+def held_seat_stats(now: Optional[float] = None) -> dict:
+    """Seats held by Pending bookings, counted through the (status, expires_at) index."""
+    now = time.time() if now is None else now
+    with engine.connect() as conn:
+        held, lapsed, next_expiry = conn.execute(text(
+            "SELECT COUNT(*), COALESCE(SUM(CASE WHEN expires_at < :now THEN 1 ELSE 0 END), 0), MIN(expires_at) "
+            "FROM bookings WHERE status = 'Pending'"
+        ), {"now": now}).one()
+    return {
+        "held_seats": held, "lapsed_awaiting_reaper": lapsed,
+        "next_expiry_in_seconds": round(next_expiry - now, 1) if next_expiry is not None else None,
+        "hold_seconds": PENDING_HOLD_SECONDS, **hold_reaper_stats.stats(),
+    }
+
+async def expire_holds_periodically():
+    while True:
+        await asyncio.sleep(HOLD_REAPER_INTERVAL_SECONDS)
+        try:
+            expired = await asyncio.to_thread(expire_lapsed_holds)
+            if expired:
+                print(f"HOLDS: Expired {expired} unpaid bookings and released their seats.")
+        except Exception as e:
+            print(f"HOLDS: Reaper failed, will retry: {e}")
+
+# --- Helper Functions (MODIFIED) ---
+# PNRs are handed out from blocks of the shared PNR sequence (see pnr.py), so they are unique
+# across worker processes without a database round trip per PNR. Reserving a block is one
+# UPDATE of the sequence row; bookings that predate the sequence were given random PNRs, so
+# the block's codes are checked against existing bookings once, in a single query.
+PNR_BLOCK_SIZE = 1000
+
+_pnr_codecs = {}
+_SELECT_TAKEN_PNRS = select(Booking.pnr).where(Booking.pnr.in_(bindparam("pnrs", expanding=True)))
+
+def reserve_pnr_block(size: int) -> List[str]:
+    with engine.begin() as conn:
+        conn.execute(update(PnrSequence).where(PnrSequence.id == 1).values(next_value=PnrSequence.next_value + size))
+        row = conn.execute(select(PnrSequence.next_value, PnrSequence.scramble_key).where(PnrSequence.id == 1)).first()
+        if row is None:
+            raise RuntimeError("PNR sequence is missing; run apply_migrations() first.")
+        start = row.next_value - size
+        if row.next_value > PNR_SPACE:
+            raise RuntimeError("PNR sequence is exhausted.")
+        if row.scramble_key not in _pnr_codecs:
+            _pnr_codecs[row.scramble_key] = PnrCodec(row.scramble_key)
+        pnrs = _pnr_codecs[row.scramble_key].encode_range(start, size)
+        taken = set(conn.execute(_SELECT_TAKEN_PNRS, {"pnrs": pnrs}).scalars())
+    return [pnr for pnr in pnrs if pnr not in taken] if taken else pnrs
+
+pnr_allocator = PnrAllocator(reserve_pnr_block, PNR_BLOCK_SIZE)
+
 def generate_pnr() -> str:
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
+    """Draw PNRs before a booking transaction starts writing: reserving a block commits on a
+    connection of its own, which on SQLite would wait on the caller's write lock."""
+    return pnr_allocator.next()
+
+def generate_pnrs(count: int) -> List[str]:
+    return pnr_allocator.take(count)
+
+# --- NEW: Fare Quote Tokens ---
+# A quote token is "<flight_id>.<price in paise>.<expiry unix time>.<nonce>.<signature>", signed
+# with HMAC-SHA256, so create_booking can honor a searched price without looking the quote up.
+# Each token books once: redeem_quote_token() marks its signature used in an in-memory set, so
+# neither verification nor redemption touches the database or adds a commit to the booking, and
+# release_quote_token() unmarks it again if the booking fails. The set lives in this process:
+# with QUOTE_SECRET shared between worker processes, a token is single-use per worker.
+QUOTE_SECRET = (os.getenv("QUOTE_SECRET") or secrets.token_hex(32)).encode()
+QUOTE_TTL_SECONDS = 300
+
+class RedeemedQuotes:
+    """Signatures of quote tokens that have been booked with, kept until the tokens expire."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires = {}  # signature -> token expiry (unix time)
+        self.redeemed = self.rejected = self.released = self.purged = 0
+
+    def redeem(self, signature: str, expires: float) -> bool:
+        """Marks the token used; False if it already was."""
+        with self._lock:
+            if signature in self._expires:
+                self.rejected += 1
+                return False
+            self._expires[signature] = expires
+            self.redeemed += 1
+            return True
+
+    def release(self, signature: str):
+        with self._lock:
+            if self._expires.pop(signature, None) is not None:
+                self.released += 1
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Forgets tokens that have expired anyway. Returns how many were forgotten."""
+        now = now or time.time()
+        with self._lock:
+            expired = [signature for signature, expires in self._expires.items() if expires < now]
+            for signature in expired:
+                del self._expires[signature]
+            self.purged += len(expired)
+            return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "outstanding": len(self._expires), "redeemed": self.redeemed,
+                "rejected": self.rejected, "released": self.released, "purged": self.purged,
+            }
+
+redeemed_quotes = RedeemedQuotes()
+
+def _quote_signature(payload: str) -> str:
+    digest = hmac.new(QUOTE_SECRET, payload.encode(), hashlib.sha256).digest()[:16]
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+def issue_quote_token(flight_id: int, price: float, now: Optional[float] = None) -> str:
+    expires = int((now or time.time()) + QUOTE_TTL_SECONDS)
+    payload = f"{flight_id}.{round(price * 100)}.{expires}.{secrets.token_hex(4)}"
+    return f"{payload}.{_quote_signature(payload)}"
+
+def verify_quote_token(token: str, flight_id: int, now: Optional[float] = None) -> Optional[float]:
+    """Returns the quoted price if the token is authentic, unexpired and for this flight, else None."""
+    payload, _, signature = token.rpartition(".")
+    # Compared as bytes: compare_digest rejects str arguments that are not ASCII
+    if not payload or not hmac.compare_digest(signature.encode(), _quote_signature(payload).encode()):
+        return None
+    try:
+        token_flight_id, price_paise, expires = (int(part) for part in payload.split(".")[:3])
+    except ValueError:
+        return None
+    if token_flight_id != flight_id or expires < (now or time.time()):
+        return None
+    return price_paise / 100
+
+def redeem_quote_token(token: str, flight_id: int) -> float:
+    """Verifies the token and marks it used; returns the quoted price."""
+    price = verify_quote_token(token, flight_id)
+    if price is None:
+        raise HTTPException(status_code=400, detail="Fare quote is invalid or has expired. Please search again.")
+    payload, _, signature = token.rpartition(".")
+    if not redeemed_quotes.redeem(signature, int(payload.split(".")[2])):
+        raise HTTPException(status_code=409, detail="Fare quote has already been used. Please search again.")
+    return price
+
+def release_quote_token(token: str):
+    """Makes a redeemed token usable again after the booking it was redeemed for failed."""
+    redeemed_quotes.release(token.rpartition(".")[2])
+
+async def purge_redeemed_quotes_periodically():
+    while True:
+        await asyncio.sleep(QUOTE_TTL_SECONDS)
+        redeemed_quotes.purge()
+
+# --- NEW: Price History Recording ---
+# Every price shown in a search result or charged at booking is appended to an in-memory
+# buffer (see price_history.py) and written to the price_history table in batches.
+PRICE_HISTORY_FLUSH_SECONDS = 2
+
+price_history = PriceHistoryBuffer()
+
+def flush_price_history() -> int:
+    """Writes everything buffered so far in one transaction. Returns the number of samples written."""
+    blocks = price_history.drain()
+    if not blocks:
+        return 0
+    try:
+        with engine.begin() as conn:
+            for flight_ids, recorded_at, prices, kinds in blocks:
+                conn.exec_driver_sql(
+                    "INSERT INTO price_history (flight_id, recorded_at, price, kind) VALUES (?, ?, ?, ?)",
+                    list(zip(flight_ids.tolist(), recorded_at.tolist(), prices.tolist(), kinds.tolist())),
+                )
+    except Exception:
+        price_history.requeue(blocks)
+        raise
+    return sum(len(block[0]) for block in blocks)
+
+async def flush_price_history_periodically():
+    while True:
+        await asyncio.sleep(PRICE_HISTORY_FLUSH_SECONDS)
+        try:
+            await asyncio.to_thread(flush_price_history)
+        except Exception as e:
+            print(f"PRICE HISTORY: Flush failed, will retry: {e}")
+
+# --- NEW: Price Snapshots ---
+# A background job prices every open future flight in one batch and publishes the result as an
+# immutable, pre-serialized snapshot, so partners can poll /api/prices/snapshot with
+# If-None-Match and get a 304 until the next refresh. The ETag is a hash of the list fares and
+# seat counts, not of the jittered prices: a refresh that finds them unchanged keeps the current
+# snapshot, so partners only download it again when a fare or a flight actually changed.
+PRICE_SNAPSHOT_REFRESH_SECONDS = 60
+
+@dataclass(frozen=True)
+class PriceSnapshot:
+    version: int
+    generated_at: datetime
+    flights: int
+    etag: str
+    body: bytes
+    gzip_body: bytes
+
+class PriceSnapshotStore:
+    """Holds the latest published snapshot; publishing swaps the reference, readers never see a partial one."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.current: Optional[PriceSnapshot] = None
 
-# --- FastAPI Application (Unchanged) ---
+    def publish(self, generated_at: datetime, flights: list, etag: str) -> PriceSnapshot:
+        """Publishes a new version, or keeps the current snapshot when its ETag is the same."""
+        with self._lock:
+            if self.current is not None and self.current.etag == etag:
+                return self.current
+            version = self.current.version + 1 if self.current else 1
+            body = json.dumps(
+                {"version": version, "generated_at": generated_at.isoformat(), "flights": flights}, separators=(",", ":")
+            ).encode()
+            snapshot = PriceSnapshot(
+                version=version, generated_at=generated_at, flights=len(flights),
+                etag=etag, body=body, gzip_body=gzip.compress(body, compresslevel=6),
+            )
+            self.current = snapshot
+            return snapshot
+
+price_snapshots = PriceSnapshotStore()
+
+def build_price_snapshot() -> PriceSnapshot:
+    """Prices every future flight with seats left in one vectorized pass and publishes the snapshot,
+    unless the list fares and flights are the same as in the current one."""
+    generated_at = datetime.now()
+    with SessionLocal() as db:
+        rows = db.connection().execute(
+            select(*FLIGHT_ROW_COLUMNS)
+            .where(Flight.departure > generated_at, Flight.seats_available > 0)
+            .order_by(Flight.departure, Flight.id)
+        ).all()
+    list_fares = list_fares_for_rows(rows) if rows else np.empty(0)
+    flights = [
+        {
+            "flight_id": row.id, "flight_no": row.flight_no, "origin": row.origin, "destination": row.destination,
+            "departure": row.departure.isoformat(), "arrival": row.arrival.isoformat(), "airline_name": row.airline_name,
+            "seats_available": row.seats_available,
+        }
+        for row in rows
+    ]
+    # Hashed before the jitter is applied, so the ETag only changes with the fares and flights
+    content = json.dumps([flights, list_fares.tolist()], separators=(",", ":")).encode()
+    etag = f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+    if price_snapshots.current is not None and price_snapshots.current.etag == etag:
+        return price_snapshots.current
+    for flight, price in zip(flights, apply_demand_jitter(list_fares).tolist()):
+        flight["dynamic_price"] = price
+    return price_snapshots.publish(generated_at, flights, etag)
+
+async def refresh_price_snapshot_periodically():
+    published = None
+    while True:
+        try:
+            snapshot = await asyncio.to_thread(build_price_snapshot)
+            if snapshot.version != published:
+                published = snapshot.version
+                print(f"PRICING: Published price snapshot v{snapshot.version} with {snapshot.flights} flights.")
+        except Exception as e:
+            print(f"PRICING: Price snapshot refresh failed: {e}")
+        await asyncio.sleep(PRICE_SNAPSHOT_REFRESH_SECONDS)
+
+# --- FastAPI Application (MODIFIED) ---
 app = FastAPI(title="Flight Booking API", version="1.0")
 
-# --- Background Task (Unchanged) ---
+# --- Background Task (MODIFIED) ---
 async def simulate_market_changes():
     await asyncio.sleep(15)
     while True:
         try:
             db = SessionLocal()
-            flight = db.query(Flight).filter(Flight.seats_available > 0, Flight.departure > datetime.now()).order_by(func.random()).first()
-            if flight and flight.seats_available > 0:
-                flight.seats_available -= 1
+            flight_id = db.connection().execute(
+                select(Flight.id).where(Flight.seats_available > 0, Flight.departure > datetime.now()).order_by(func.random()).limit(1)
+            ).scalar()
+            flight = reserve_seats(db, flight_id) if flight_id else None
+            if flight:
+                assign_seats(db, flight)
                 db.commit()
+                notify_flight_changed(flight)
                 print(f"SIMULATOR: A seat was booked on {flight.flight_no}. Remaining: {flight.seats_available}")
         except Exception as e:
             db.rollback()
@@ -141,119 +1379,1428 @@ async def simulate_market_changes():
             db.close()
         await asyncio.sleep(random.randint(20, 45))
 
+async def refresh_prices_at_day_boundary():
+    """Rebuilds the price table just after every midnight so time buckets roll over in one batch."""
+    while True:
+        now = datetime.now()
+        next_day = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        await asyncio.sleep((next_day - now).total_seconds() + 1)
+        try:
+            await asyncio.to_thread(rebuild_price_table)
+            print(f"PRICING: Price table rebuilt, {price_table.recomputes} fares computed so far.")
+        except Exception as e:
+            print(f"PRICING: Price table rebuild failed: {e}")
+
+def apply_pricing_rules_change():
+    """Re-prices every flight under newly loaded rules and drops search results priced under the old ones."""
+    rebuild_price_table()
+    search_cache.clear()
+
+async def watch_pricing_rules():
+    """Hot-reloads the pricing rules file whenever it changes on disk. Any failure is logged and
+    polling goes on: a bad file leaves the current rules in place, and a failed re-price of the
+    flights is retried on the next poll."""
+    unapplied = False
+    while True:
+        await asyncio.sleep(PRICING_RULES_POLL_SECONDS)
+        try:
+            if await asyncio.to_thread(pricing_engine.load):
+                unapplied = True
+            if unapplied:
+                await asyncio.to_thread(apply_pricing_rules_change)
+                unapplied = False
+                print(f"PRICING: Loaded pricing rules version {pricing_engine.rules.version}.")
+        except ValueError as e:
+            print(f"PRICING: Keeping current pricing rules. {e}")
+        except Exception as e:
+            print(f"PRICING: Pricing rules reload failed, will retry: {e}")
+
 @app.on_event("startup")
 async def startup_event():
-    Base.metadata.create_all(bind=engine)
+    global forecast_pool
+    apply_migrations(engine)
+    pricing_engine.load()
+    with SessionLocal() as db:
+        airport_catalog.load(db)
+        flight_index.build(db)
+        build_route_graph(db)
+        price_table.build(db)
+    asyncio.create_task(refresh_prices_at_day_boundary())
+    asyncio.create_task(watch_pricing_rules())
+    asyncio.create_task(flush_price_history_periodically())
+    asyncio.create_task(refresh_price_snapshot_periodically())
+    asyncio.create_task(purge_idempotency_keys_periodically())
+    asyncio.create_task(purge_redeemed_quotes_periodically())
+    asyncio.create_task(expire_holds_periodically())
+    if BOOKING_GROUP_COMMIT:
+        booking_writer.start()
+    forecast_pool = make_forecast_pool()
     # Optional: You can uncomment the line below to start the background simulator
     # asyncio.create_task(simulate_market_changes())
 
+@app.on_event("shutdown")
+def shutdown_event():
+    booking_writer.stop()
+    if forecast_pool is not None:
+        forecast_pool.shutdown()
+    flush_price_history()
+
+# --- NEW: Keyset Pagination ---
+# Pages are ordered by (sort key, flight id). For price the key is the list fare before the
+# demand jitter, so the order is stable across requests; for duration it is whole minutes.
+# Price order therefore means list-fare order: pages follow one another by list fare, and
+# only within a page are the flights re-sorted by the jittered price they are shown with.
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+
+def encode_search_cursor(sort_by: str, key: float, flight_id: int) -> str:
+    payload = json.dumps([sort_by, key, flight_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str, sort_by: str) -> tuple:
+    try:
+        cursor_sort, key, flight_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        key, flight_id = float(key), int(flight_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
+    if cursor_sort != sort_by:
+        raise HTTPException(status_code=400, detail="Cursor does not match sort_by.")
+    return key, flight_id
+
+# Whole minutes between departure and arrival, computed by SQLite so duration order and limit run in SQL
+duration_minutes = func.cast(func.round((func.julianday(Flight.arrival) - func.julianday(Flight.departure)) * 1440), Integer)
+
+def _bucket_factor_sql(value, thresholds, factors):
+    """CASE picking factors[i] where i is how many of the ascending thresholds `value` has reached."""
+    whens = [(value >= threshold, factor) for threshold, factor in zip(reversed(thresholds), reversed(factors[1:]))]
+    return case(*whens, else_=factors[0]) if whens else literal(factors[0], Float)
+
+def _rule_list_fare_sql(rule, occupancy, days_to_departure):
+    # days_to_departure is fractional here; a whole-day breakpoint b is passed once floor(days) > b, i.e. days >= b + 1
+    fare = (
+        func.cast(Flight.base_fare, Float)
+        * _bucket_factor_sql(occupancy, rule.occupancy_breakpoints, rule.seat_factors)
+        * _bucket_factor_sql(days_to_departure, [b + 1 for b in rule.days_breakpoints], rule.time_factors)
+    )
+    if rule.floor is not None:
+        fare = func.max(fare, func.cast(Flight.base_fare, Float) * rule.floor)
+    if rule.cap is not None:
+        fare = func.min(fare, func.cast(Flight.base_fare, Float) * rule.cap)
+    return fare
+
+def list_fare_sql(rules: CompiledRules):
+    """The list fare as a SQL expression, so price order, keyset and limit can run in SQLite.
+
+    Mirrors CompiledRules.list_fares: the same buckets, rule selection (route, then airline,
+    then default) and floor/cap. Route rules whose airports are not in the catalog never match.
+    The pricing time is the `pricing_now` bind parameter, so one expression serves every request."""
+    occupancy = func.cast(Flight.total_seats - Flight.seats_available, Float) / Flight.total_seats
+    days_to_departure = func.julianday(Flight.departure) - func.julianday(bindparam("pricing_now", type_=String))
+    fares = [_rule_list_fare_sql(rule, occupancy, days_to_departure) for rule in rules.rule_sets]
+    if rules.single:
+        return fares[0]
+    whens = []
+    for (origin_code, destination_code), rule_id in rules.routes.items():
+        origin_id, destination_id = airport_catalog.resolve(origin_code), airport_catalog.resolve(destination_code)
+        if origin_id is not None and destination_id is not None:
+            whens.append((and_(Flight.origin_airport_id == origin_id, Flight.destination_airport_id == destination_id), fares[rule_id]))
+    for airline, rule_id in rules.airlines.items():
+        whens.append((func.lower(Flight.airline_name) == airline, fares[rule_id]))
+    return case(*whens, else_=fares[0]) if whens else fares[0]
+
+_price_sort_key = (None, None)  # (rules it was built for, rounded list fare expression)
+
+def price_sort_key_sql():
+    """ROUND(list fare, 2) under the current rules, built once per rules version."""
+    global _price_sort_key
+    rules, key = _price_sort_key
+    if rules is not pricing_engine.rules:
+        rules = pricing_engine.rules
+        key = func.round(list_fare_sql(rules), 2, type_=Float)
+        _price_sort_key = (rules, key)
+    return key
+
 # --- API Endpoints ---
 @app.get("/api/", tags=["Root"]) # --- MODIFIED --- Added /api prefix
 def read_root():
     return {"message": "Welcome to the Flight Booking API ✈️"}
 
 @app.get("/api/flights/search", response_model=List[FlightResponse], tags=["Flights"]) # --- MODIFIED --- Added /api prefix
-def search_flights(origin: str, destination: str, date: str, sort_by: Optional[str] = 'price', db: Session = Depends(get_db)):
+def search_flights(
+    response: Response, origin: str, destination: str, date: str, sort_by: Optional[str] = 'price', match: Optional[str] = 'exact',
+    limit: int = Query(SEARCH_DEFAULT_LIMIT, ge=1, le=SEARCH_MAX_LIMIT), cursor: Optional[str] = None,
+    stream: bool = False, accept: Optional[str] = Header(None), db: Session = Depends(get_db)
+):
+    """Searches one route-day. Results are paged with keyset pagination: pass the X-Next-Cursor
+    response header back as `cursor` to fetch the next page; the header is absent on the last page.
+
+    With `stream=true` or `Accept: application/x-ndjson` the whole result set is streamed as
+    newline-delimited JSON instead, and limit/cursor are ignored."""
     try:
         search_date = datetime.strptime(date, "%Y-%m-%d").date()
     except ValueError:
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+    if match not in ('exact', 'substring'):
+        raise HTTPException(status_code=400, detail="Invalid match mode. Use 'exact' or 'substring'.")
+    sort_by = 'duration' if sort_by == 'duration' else 'price'
+    if stream or "application/x-ndjson" in (accept or ""):
+        return StreamingResponse(_stream_flight_search(origin, destination, search_date, sort_by, match), media_type="application/x-ndjson")
+    after = decode_search_cursor(cursor, sort_by) if cursor else None
+
+    cache_key = (normalize_city(origin), normalize_city(destination), search_date, sort_by, match, limit, cursor)
+    cached = search_cache.get(cache_key)
+    if cached is None:
+        generation = search_cache.generation
+        flights, list_fares, next_cursor, route_tag = _run_flight_search(db, origin, destination, search_date, sort_by, match, limit, after)
+        tags = {("flight", f.id) for f in flights}
+        tags.add(route_tag)
+        cached = (tuple(flights), list_fares, next_cursor, np.array([f.id for f in flights], dtype=np.int64))
+        search_cache.put(cache_key, cached, tags, generation)
+
+    # The cache holds rows and list fares only: every response gets its own demand jitter and
+    # its own single-use quote tokens, so two clients served from one entry can both book
+    flights, list_fares, next_cursor, flight_ids = cached
+    prices = apply_demand_jitter(list_fares)
+    # Every quote shown is history, whether the rows were read just now or served from the cache
+    price_history.append(flight_ids, prices)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    order = np.argsort(prices, kind="stable") if sort_by == 'price' else range(len(flights))
+    return [flight_response(flights[i], prices[i].item()) for i in order]
 
-    query = db.query(Flight).filter(
-        Flight.origin.ilike(f"%{origin}%"),
-        Flight.destination.ilike(f"%{destination}%"),
+def _route_filters(db: Session, origin: str, destination: str, search_date: date_type, match: str, use_index: bool = True):
+    """Returns (filters, cache tag) for one route-day; filters is None when nothing can match.
+
+    use_index=False skips the in-memory id lookup and filters through ix_flights_route_departure,
+    which suits large scans better than a long IN list."""
+    if match == 'substring':
+        # Slow path: leading-wildcard ILIKE cannot use an index and scans the whole table
+        return [
+            Flight.origin.ilike(f"%{origin}%"),
+            Flight.destination.ilike(f"%{destination}%"),
+            Flight.departure >= datetime.combine(search_date, datetime.min.time()),
+            Flight.departure < datetime.combine(search_date, datetime.max.time()),
+            Flight.seats_available > 0
+        ], ("day", search_date)
+
+    if not airport_catalog.loaded:
+        airport_catalog.load(db)
+    origin_id, destination_id = airport_catalog.resolve(origin), airport_catalog.resolve(destination)
+    if origin_id is None or destination_id is None:
+        return None, ("day", search_date)
+    route_tag = ("route", origin_id, destination_id, search_date)
+    if use_index and flight_index.built:
+        flight_ids = flight_index.lookup(origin_id, destination_id, search_date)
+        if not flight_ids:
+            return None, route_tag
+        return [Flight.id.in_(flight_ids), Flight.seats_available > 0], route_tag
+    # Served by ix_flights_route_departure
+    return [
+        Flight.origin_airport_id == origin_id,
+        Flight.destination_airport_id == destination_id,
         Flight.departure >= datetime.combine(search_date, datetime.min.time()),
         Flight.departure < datetime.combine(search_date, datetime.max.time()),
         Flight.seats_available > 0
+    ], route_tag
+
+def _run_flight_search(db: Session, origin: str, destination: str, search_date: date_type, sort_by: str, match: str, limit: int, after: Optional[tuple]):
+    """Runs an uncached search for one page. Returns (rows, list fares, next cursor, cache tag for the route)."""
+    filters, route_tag = _route_filters(db, origin, destination, search_date, match)
+    if filters is None:
+        return [], np.empty(0), None, route_tag
+
+    if sort_by == 'duration':
+        query = select(*FLIGHT_ROW_COLUMNS).where(*filters)
+        if after:
+            query = query.where(or_(duration_minutes > after[0], and_(duration_minutes == after[0], Flight.id > after[1])))
+        flights = db.connection().execute(query.order_by(duration_minutes, Flight.id).limit(limit + 1)).all()
+        has_more = len(flights) > limit
+        flights = flights[:limit]
+        list_fares = list_fares_for_rows(flights)
+        keys = [round((f.arrival - f.departure).total_seconds() / 60) for f in flights]
+    else:
+        # The list fare is computed by SQLite, so only the requested page leaves the database
+        if not airport_catalog.loaded:
+            airport_catalog.load(db)
+        price_key = price_sort_key_sql()
+        query = select(*FLIGHT_ROW_COLUMNS, price_key.label("price_key")).where(*filters)
+        if after:
+            query = query.where(or_(price_key > after[0], and_(price_key == after[0], Flight.id > after[1])))
+        query = query.order_by(price_key, Flight.id).limit(limit + 1)
+        flights = db.connection().execute(query, {"pricing_now": datetime.now().isoformat(sep=" ")}).all()
+        has_more = len(flights) > limit
+        flights = flights[:limit]
+        list_fares = list_fares_for_rows(flights)
+        keys = [f.price_key for f in flights]
+
+    if not flights:
+        return [], np.empty(0), None, route_tag
+
+    next_cursor = encode_search_cursor(sort_by, keys[-1], flights[-1].id) if has_more else None
+    return flights, list_fares, next_cursor, route_tag
+
+# --- NEW: Streaming Search ---
+STREAM_CHUNK_SIZE = 500
+
+def _stream_flight_search(origin: str, destination: str, search_date: date_type, sort_by: str, match: str):
+    """Yields NDJSON lines for a route-day, pricing one server-side cursor chunk at a time.
+
+    Uses its own session because the request's session is closed before the body is streamed.
+    Duration order is done by SQL; price order would need the whole set in memory, so price
+    streams come out in departure order.
+    """
+    db = SessionLocal()
+    try:
+        filters, _ = _route_filters(db, origin, destination, search_date, match, use_index=False)
+        if filters is None:
+            return
+        order = (duration_minutes, Flight.id) if sort_by == 'duration' else (Flight.departure, Flight.id)
+        result = db.connection().execute(
+            select(*FLIGHT_ROW_COLUMNS).where(*filters).order_by(*order).execution_options(yield_per=STREAM_CHUNK_SIZE)
+        )
+        for rows in result.partitions():
+            prices = apply_demand_jitter(list_fares_for_rows(rows))
+            price_history.append([row.id for row in rows], prices)
+            lines = []
+            for row, price in zip(rows, prices.tolist()):
+                lines.append(json.dumps({
+                    "flight_id": row.id, "flight_no": row.flight_no, "origin": row.origin,
+                    "destination": row.destination, "departure": row.departure.isoformat(), "arrival": row.arrival.isoformat(),
+                    "duration_hours": round((row.arrival - row.departure).total_seconds() / 3600, 2), "dynamic_price": price,
+                    "seats_available": row.seats_available, "airline_name": row.airline_name,
+                    "quote_token": issue_quote_token(row.id, price),
+                }))
+            yield "\n".join(lines) + "\n"
+    finally:
+        db.close()
+
+# --- NEW ENDPOINT: CONNECTING ITINERARIES ---
+@app.get("/api/itineraries/search", response_model=List[ItineraryResponse], tags=["Flights"])
+def search_itineraries(
+    origin: str, destination: str, date: str, sort_by: Optional[str] = 'price',
+    max_legs: int = Query(2, ge=1, le=4), limit: int = Query(10, ge=1, le=50),
+    min_connection_minutes: int = Query(45, ge=0), max_connection_minutes: int = Query(360, ge=1),
+    db: Session = Depends(get_db)
+):
+    """Top itineraries (direct and connecting) departing on `date`, by total price or total travel time.
+
+    Price ranking uses list fares before the demand jitter, as in keyset-paged search."""
+    try:
+        search_date = datetime.strptime(date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+    if max_connection_minutes < min_connection_minutes:
+        raise HTTPException(status_code=400, detail="max_connection_minutes must not be below min_connection_minutes.")
+
+    if not airport_catalog.loaded:
+        airport_catalog.load(db)
+    origin_id, destination_id = airport_catalog.resolve(origin), airport_catalog.resolve(destination)
+    if origin_id is None or destination_id is None or origin_id == destination_id:
+        return []
+    if not route_graph.built:
+        build_route_graph(db)
+
+    itineraries = route_graph.search(
+        origin_id, destination_id,
+        datetime.combine(search_date, datetime.min.time()), datetime.combine(search_date, datetime.max.time()),
+        fares=price_legs, sort_by='duration' if sort_by == 'duration' else 'price', k=limit, max_legs=max_legs,
+        min_connection=timedelta(minutes=min_connection_minutes), max_connection=timedelta(minutes=max_connection_minutes),
     )
-    
-    flights = query.all()
+    if not itineraries:
+        return []
+
+    # One query for every flight used, and one jitter draw per leg
+    legs = [leg for itinerary in itineraries for leg in itinerary.legs]
+    flights = fetch_flight_rows(db, {leg.flight_id for leg in legs})
+    leg_prices = apply_demand_jitter(price_legs(legs))
+    price_history.append([leg.flight_id for leg in legs], leg_prices)
+    prices = iter(leg_prices.tolist())
+
+    response = []
+    for itinerary in itineraries:
+        leg_responses = [flight_response(flights[leg.flight_id], next(prices)) for leg in itinerary.legs]
+        response.append(ItineraryResponse(
+            legs=leg_responses, connections=len(leg_responses) - 1,
+            total_price=round(sum(leg.dynamic_price for leg in leg_responses), 2),
+            total_duration_hours=round((itinerary.legs[-1].arrival - itinerary.legs[0].departure).total_seconds() / 3600, 2),
+        ))
+    return response
+
+# --- NEW ENDPOINT: ROUND-TRIP SEARCH ---
+ROUND_TRIP_MAX_PAIRS_EXAMINED = 10000
+
+@app.get("/api/flights/roundtrip", response_model=List[RoundTripResponse], tags=["Flights"])
+def search_round_trips(
+    origin: str, destination: str, depart_date: str, return_date: str, sort_by: Optional[str] = 'price',
+    limit: int = Query(10, ge=1, le=100), db: Session = Depends(get_db)
+):
+    """Top-N outbound/return combinations by total price or total flight time.
+
+    Both directions come from one query and one batch pricing call; the best pairs are then
+    merged from the two sorted lists with a heap, without building the cross product."""
+    try:
+        out_date = datetime.strptime(depart_date, "%Y-%m-%d").date()
+        back_date = datetime.strptime(return_date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+    if back_date < out_date:
+        raise HTTPException(status_code=400, detail="return_date must not be before depart_date.")
+
+    if not airport_catalog.loaded:
+        airport_catalog.load(db)
+    origin_id, destination_id = airport_catalog.resolve(origin), airport_catalog.resolve(destination)
+    if origin_id is None or destination_id is None:
+        return []
+
+    def route_day(from_id, to_id, day):
+        return and_(
+            Flight.origin_airport_id == from_id,
+            Flight.destination_airport_id == to_id,
+            Flight.departure >= datetime.combine(day, datetime.min.time()),
+            Flight.departure < datetime.combine(day, datetime.max.time()),
+        )
+
+    flights = db.connection().execute(select(*FLIGHT_ROW_COLUMNS).where(
+        or_(route_day(origin_id, destination_id, out_date), route_day(destination_id, origin_id, back_date)),
+        Flight.seats_available > 0
+    )).all()
     if not flights:
         return []
 
-    response_flights = []
-    for flight in flights:
-        price = calculate_dynamic_price(float(flight.base_fare), flight.seats_available, flight.total_seats, flight.departure)
-        duration = (flight.arrival - flight.departure).total_seconds() / 3600
-        response_flights.append(
-            FlightResponse(
-                flight_id=flight.id, flight_no=flight.flight_no, origin=flight.origin,
-                destination=flight.destination, departure=flight.departure, arrival=flight.arrival,
-                duration_hours=round(duration, 2), dynamic_price=price,
-                seats_available=flight.seats_available, airline_name=flight.airline_name
+    prices = apply_demand_jitter(list_fares_for_rows(flights))
+    price_history.append([flight.id for flight in flights], prices)
+    responses = [flight_response(flight, price) for flight, price in zip(flights, prices.tolist())]
+
+    cost = (lambda r: r.duration_hours) if sort_by == 'duration' else (lambda r: r.dynamic_price)
+    outbound = sorted((r for r, f in zip(responses, flights) if f.origin_airport_id == origin_id and f.departure.date() == out_date), key=cost)
+    inbound = sorted((r for r, f in zip(responses, flights) if f.origin_airport_id == destination_id and f.departure.date() == back_date), key=cost)
+    if not outbound or not inbound:
+        return []
+
+    # k-smallest pair sums: pop the cheapest (i, j) and push its right/down neighbours.
+    # Pairs where the return leaves before the outbound lands are skipped but still expanded.
+    pairs = []
+    heap = [(cost(outbound[0]) + cost(inbound[0]), 0, 0)]
+    seen = {(0, 0)}
+    examined = 0
+    while heap and len(pairs) < limit and examined < ROUND_TRIP_MAX_PAIRS_EXAMINED:
+        _, i, j = heapq.heappop(heap)
+        examined += 1
+        out_leg, in_leg = outbound[i], inbound[j]
+        if in_leg.departure >= out_leg.arrival:
+            pairs.append(RoundTripResponse(
+                outbound=out_leg, inbound=in_leg,
+                total_price=round(out_leg.dynamic_price + in_leg.dynamic_price, 2),
+                total_duration_hours=round(out_leg.duration_hours + in_leg.duration_hours, 2),
+            ))
+        for ni, nj in ((i + 1, j), (i, j + 1)):
+            if ni < len(outbound) and nj < len(inbound) and (ni, nj) not in seen:
+                seen.add((ni, nj))
+                heapq.heappush(heap, (cost(outbound[ni]) + cost(inbound[nj]), ni, nj))
+    return pairs
+
+# --- NEW ENDPOINT: FLEXIBLE-DATE FARE CALENDAR ---
+CALENDAR_MAX_DAYS = 31
+
+@app.get("/api/flights/calendar", response_model=List[FareCalendarDay], tags=["Flights"])
+def fare_calendar(origin: str, destination: str, date: str, days: int = Query(3, ge=0, le=CALENDAR_MAX_DAYS), db: Session = Depends(get_db)):
+    """Cheapest and median fare per day for `date` ± `days`, from one range query priced in batch."""
+    try:
+        center = datetime.strptime(date, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+
+    first_day = center - timedelta(days=days)
+    window = [first_day + timedelta(days=i) for i in range(2 * days + 1)]
+    calendar = [FareCalendarDay(date=day, flights=0) for day in window]
+
+    if not airport_catalog.loaded:
+        airport_catalog.load(db)
+    origin_id, destination_id = airport_catalog.resolve(origin), airport_catalog.resolve(destination)
+    if origin_id is None or destination_id is None:
+        return calendar
+
+    # One range scan over ix_flights_route_departure covers the whole window. Columns come back as
+    # plain floats (julianday, REAL) so no per-row datetime or Decimal objects are built.
+    start = datetime.combine(first_day, datetime.min.time())
+    rows = db.connection().execute(select(
+        func.julianday(Flight.departure), func.cast(Flight.base_fare, Float), Flight.seats_available, Flight.total_seats, Flight.id, Flight.airline_name
+    ).where(
+        Flight.origin_airport_id == origin_id,
+        Flight.destination_airport_id == destination_id,
+        Flight.departure >= start,
+        Flight.departure < start + timedelta(days=len(window)),
+        Flight.seats_available > 0
+    )).all()
+    if not rows:
+        return calendar
+
+    data = np.array([tuple(r)[:5] for r in rows], dtype=np.float64)
+    departures = julian_days_to_datetime64(data[:, 0])
+    rule_keys = [(r[5], origin_id, destination_id) for r in rows]
+    prices = apply_demand_jitter(cached_list_fares(data[:, 4].astype(np.int64), data[:, 1], data[:, 2], data[:, 3], departures, rule_keys=rule_keys))
+    # julianday() keeps milliseconds, so a departure in the window's last half-millisecond reads back
+    # as the next midnight; the range filter already placed it in the window, so clip it back in
+    day_index = np.clip((departures - np.datetime64(start, "us")) // np.timedelta64(1, "D"), 0, len(window) - 1)
+
+    order = np.argsort(day_index, kind="stable")
+    day_index, prices = day_index[order], prices[order]
+    boundaries = np.flatnonzero(np.diff(day_index)) + 1
+    for group_days, group_prices in zip(np.split(day_index, boundaries), np.split(prices, boundaries)):
+        entry = calendar[int(group_days[0])]
+        entry.min_price = float(group_prices.min())
+        entry.median_price = round(float(np.median(group_prices)), 2)
+        entry.flights = len(group_prices)
+    return calendar
+
+@app.get("/api/metrics/search-cache", tags=["Metrics"])
+def search_cache_metrics():
+    """Hit/miss/eviction counters for sizing the search result cache."""
+    return search_cache.stats()
+
+# --- NEW ENDPOINT: RELOAD PRICING RULES ---
+@app.post("/api/pricing/reload", tags=["Pricing"])
+def reload_pricing_rules():
+    """Recompiles the pricing rules file now instead of waiting for the file watcher."""
+    try:
+        pricing_engine.load(force=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    apply_pricing_rules_change()
+    rules = pricing_engine.rules
+    return {"version": rules.version, "rule_sets": [rule.name for rule in rules.rule_sets]}
+
+# --- NEW ENDPOINT: PRICE HISTORY ---
+@app.get("/api/flights/{flight_id}/price-history", response_model=List[PricePoint], tags=["Flights"])
+def get_price_history(
+    flight_id: int, start: Optional[datetime] = None, end: Optional[datetime] = None, kind: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000), db: Session = Depends(get_db)
+):
+    """Quoted and charged prices for one flight over time, oldest first, including samples not yet flushed."""
+    kinds = {name: value for value, name in PRICE_KINDS.items()}
+    if kind is not None and kind not in kinds:
+        raise HTTPException(status_code=400, detail="Invalid kind. Use 'quoted' or 'charged'.")
+    if db.connection().execute(select(Flight.id).where(Flight.id == flight_id)).first() is None:
+        raise HTTPException(status_code=404, detail="Flight not found.")
+
+    since = start.timestamp() if start else float("-inf")
+    until = end.timestamp() if end else float("inf")
+    filters = [PriceHistory.flight_id == flight_id]
+    if start:
+        filters.append(PriceHistory.recorded_at >= since)
+    if end:
+        filters.append(PriceHistory.recorded_at <= until)
+    if kind:
+        filters.append(PriceHistory.kind == kinds[kind])
+    rows = db.connection().execute(
+        select(PriceHistory.recorded_at, PriceHistory.price, PriceHistory.kind)
+        .where(*filters).order_by(PriceHistory.recorded_at, PriceHistory.id).limit(limit)
+    ).all()
+    points = [tuple(r) for r in rows]
+
+    # Samples still in memory are newer than anything already in the table
+    if len(points) < limit:
+        _, recorded_at, prices, sample_kinds = price_history.pending(flight_id)
+        keep = (recorded_at >= since) & (recorded_at <= until)
+        if kind:
+            keep &= sample_kinds == kinds[kind]
+        points += list(zip(recorded_at[keep].tolist(), prices[keep].tolist(), sample_kinds[keep].tolist()))
+
+    return [
+        PricePoint(recorded_at=datetime.fromtimestamp(recorded_at), price=price, kind=PRICE_KINDS[sample_kind])
+        for recorded_at, price, sample_kind in points[:limit]
+    ]
+
+# --- NEW ENDPOINT: SEAT MAP ---
+@app.get("/api/flights/{flight_id}/seats", response_model=SeatMapResponse, tags=["Flights"])
+def get_seat_map(flight_id: int, db: Session = Depends(get_db)):
+    """Free and occupied seats of a flight, for choosing a seat to pass as BookingRequest.seat_no."""
+    flight = fetch_flight_rows(db, [flight_id]).get(flight_id)
+    if flight is None:
+        raise HTTPException(status_code=404, detail="Flight not found.")
+    # A flight without a stored map yet gets one built in memory; nothing is written here
+    seat_map = load_seat_maps(db, {flight_id: flight}, {flight_id: flight.total_seats - flight.seats_available}, assign_unseated=False)[flight_id][0]
+    return SeatMapResponse(
+        flight_id=flight_id, layout=seat_map.layout.pattern, rows=seat_map.layout.rows, seats_available=flight.seats_available,
+        available_seats=seat_map.seat_nos(free=True), occupied_seats=seat_map.seat_nos(free=False),
+    )
+
+# --- NEW ENDPOINT: PRICE SNAPSHOT ---
+@app.get("/api/prices/snapshot", tags=["Prices"])
+async def get_price_snapshot(if_none_match: Optional[str] = Header(None), accept_encoding: Optional[str] = Header(None)):
+    """Every open future flight with its dynamic price, as of the last repricing run.
+    Send the ETag back in If-None-Match to get 304 Not Modified until the next run."""
+    snapshot = price_snapshots.current
+    if snapshot is None:
+        raise HTTPException(status_code=503, detail="Price snapshot is not ready yet.", headers={"Retry-After": "5"})
+    headers = {
+        "ETag": snapshot.etag, "Cache-Control": f"max-age={PRICE_SNAPSHOT_REFRESH_SECONDS}", "Vary": "Accept-Encoding",
+        "Last-Modified": format_datetime(snapshot.generated_at.astimezone(timezone.utc), usegmt=True),
+    }
+    if if_none_match:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        if "*" in tags or snapshot.etag in tags:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    if "gzip" in (accept_encoding or ""):
+        return Response(content=snapshot.gzip_body, media_type="application/json", headers={**headers, "Content-Encoding": "gzip"})
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+# --- NEW ENDPOINT: REVENUE FORECAST ---
+FORECAST_DEFAULT_PATHS = 2000
+FORECAST_MAX_CELLS = 50_000_000  # flights x paths per request
+
+# One worker pool for every forecast request, started with the app and shut down with it
+# (None on a single-CPU host, where forecasts run in the request's own thread)
+forecast_pool = None
+
+@app.get("/api/analytics/forecast", response_model=ForecastResponse, tags=["Analytics"])
+def forecast_revenue(
+    flight_id: Optional[List[int]] = Query(None), origin: Optional[str] = None, destination: Optional[str] = None,
+    date: Optional[str] = None, paths: int = Query(FORECAST_DEFAULT_PATHS, ge=100, le=20000),
+    requests_per_seat_per_day: float = Query(DemandModel.requests_per_seat_per_day, gt=0),
+    late_surge: float = Query(DemandModel.late_surge, ge=0),
+    price_elasticity: float = Query(DemandModel.price_elasticity, ge=0),
+    seed: Optional[int] = None, db: Session = Depends(get_db)
+):
+    """Monte Carlo forecast of revenue, load factor and sell-out probability under the current pricing
+    rules, for the selected open future flights (all of them when no filter is given)."""
+    filters = [Flight.departure > datetime.now(), Flight.seats_available > 0]
+    if flight_id:
+        filters.append(Flight.id.in_(flight_id))
+    for name, column in ((origin, Flight.origin_airport_id), (destination, Flight.destination_airport_id)):
+        if name:
+            if not airport_catalog.loaded:
+                airport_catalog.load(db)
+            airport_id = airport_catalog.resolve(name)
+            if airport_id is None:
+                return ForecastResponse(paths=paths, flights=[], total_expected_revenue=0.0)
+            filters.append(column == airport_id)
+    if date:
+        try:
+            day = datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
+        filters += [Flight.departure >= day, Flight.departure < day + timedelta(days=1)]
+
+    rows = db.connection().execute(
+        select(
+            Flight.id, Flight.flight_no, Flight.departure, func.cast(Flight.base_fare, Float), Flight.seats_available, Flight.total_seats,
+            Flight.airline_name, Flight.origin_airport_id, Flight.destination_airport_id,
+        ).where(*filters).order_by(Flight.departure, Flight.id)
+    ).all()
+    if len(rows) * paths > FORECAST_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"{len(rows)} flights x {paths} paths is too large. Narrow the selection or lower paths.")
+    if not rows:
+        return ForecastResponse(paths=paths, flights=[], total_expected_revenue=0.0)
+
+    rules = pricing_engine.rules
+    flights = FlightBatch(
+        flight_ids=np.array([r[0] for r in rows]), base_fares=np.array([r[3] for r in rows], dtype=np.float64),
+        seats_available=np.array([r[4] for r in rows]), total_seats=np.array([r[5] for r in rows]),
+        departures=np.array([r[2] for r in rows], dtype="datetime64[us]"), rule_ids=pricing_rule_ids(rules, [r[6:] for r in rows]),
+    )
+    demand = DemandModel(requests_per_seat_per_day=requests_per_seat_per_day, late_surge=late_surge, price_elasticity=price_elasticity)
+    result = forecast(flights, rules, DEMAND_FACTOR_RANGE, paths=paths, demand=demand, seed=seed, pool=forecast_pool)
+
+    columns = {field: np.round(values, 4).tolist() for field, values in result.items()}
+    return ForecastResponse(
+        paths=paths,
+        flights=[
+            FlightForecast(
+                flight_id=r[0], flight_no=r[1], departure=r[2], seats_available=r[4],
+                **{field: values[i] for field, values in columns.items()}
             )
+            for i, r in enumerate(rows)
+        ],
+        total_expected_revenue=round(float(result["expected_revenue"].sum()), 2),
+        mean_expected_load_factor=round(float(result["expected_load_factor"].mean()), 4),
+    )
+
+@app.get("/api/metrics/price-history", tags=["Metrics"])
+def price_history_metrics():
+    """Samples recorded, still buffered, and dropped because the writer fell behind."""
+    return price_history.stats()
+
+# --- NEW: Idempotency Keys ---
+# Clients may send an Idempotency-Key header with POST /api/bookings and POST /api/bookings/{pnr}/pay
+# so a retry after a timeout cannot book or pay twice. The first request with a key claims it with
+# an INSERT into idempotency_keys and stores its response in the same transaction as the booking
+# change, so the two commit together. A retry gets the stored response without running again; a
+# duplicate that arrives while the first is still running waits for it, on an in-process event or,
+# across worker processes, by polling the claimed row. Only successful responses are kept: every
+# error rolls back, so the claim is dropped and a retry runs afresh. Completed responses are also
+# held in a bounded LRU, so replays in the same process skip the database.
+IDEMPOTENCY_CACHE_SIZE = 4096
+IDEMPOTENCY_TTL_SECONDS = 24 * 3600
+IDEMPOTENCY_WAIT_SECONDS = 30
+IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS = 60  # a claim this old with no response belonged to a crashed worker
+IDEMPOTENCY_POLL_SECONDS = 0.05
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+def idempotency_hash(*parts) -> str:
+    return hashlib.sha256(json.dumps(jsonable_encoder(parts), sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+class IdempotentCall:
+    """One request's hold on an idempotency key. `replay` is the stored response body when the key
+    already completed. Otherwise the caller runs the request and calls record() inside its
+    transaction, just before committing. Use as a context manager. Without a key it does nothing."""
+    def __init__(self, store: "IdempotencyStore", scope: str, key: Optional[str], request_hash: str, db: Session):
+        self.store, self.scope, self.key, self.request_hash, self.db = store, scope, key, request_hash, db
+        self.replay = None
+        self.body = None
+
+    def __enter__(self) -> "IdempotentCall":
+        if self.key is not None:
+            self.replay = self.store.begin(self.scope, self.key, self.request_hash)
+        return self
+
+    def record(self, body, status_code: int = 200, db: Optional[Session] = None):
+        """Stores the response in db's transaction (by default the request's own session)."""
+        if self.key is None:
+            return
+        self.body = jsonable_encoder(body)
+        (db or self.db).connection().execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.scope == self.scope, IdempotencyKey.key == self.key)
+            .values(status_code=status_code, response=json.dumps(self.body))
         )
 
-    if sort_by == 'duration':
-        response_flights.sort(key=lambda x: x.duration_hours)
-    else:
-        response_flights.sort(key=lambda x: x.dynamic_price)
-    return response_flights
+    def __exit__(self, exc_type, exc, tb):
+        if self.key is None or self.replay is not None:
+            return
+        if exc_type is None and self.body is not None:
+            self.store.finish(self.scope, self.key, self.request_hash, self.body)
+        else:
+            # End whatever the request still has open first; on SQLite it would block the delete
+            self.db.rollback()
+            self.store.abandon(self.scope, self.key)
+
+class IdempotencyStore:
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._responses = OrderedDict()  # (scope, key) -> (request_hash, body, stored_at)
+        self._running = {}               # (scope, key) -> threading.Event, set when that request ends
+        self.executed = self.replayed = self.waited = self.abandoned = 0
+
+    def call(self, scope: str, key: Optional[str], request_hash: str, db: Session) -> IdempotentCall:
+        """A hold on `key` for a request that does its work, and records its response, through db."""
+        if key is not None and not 0 < len(key) <= IDEMPOTENCY_MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {IDEMPOTENCY_MAX_KEY_LENGTH} characters.")
+        return IdempotentCall(self, scope, key, request_hash, db)
+
+    def _replay(self, request_hash: str, stored_hash: str, body):
+        if stored_hash != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request.")
+        with self._lock:
+            self.replayed += 1
+        return body
+
+    def begin(self, scope: str, key: str, request_hash: str):
+        """The stored response body if the key already completed, else None with the key claimed
+        for the caller. Waits while another request holding the key is running."""
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            with self._lock:
+                cached = self._responses.get((scope, key))
+                if cached is not None and cached[2] > time.time() - IDEMPOTENCY_TTL_SECONDS:
+                    self._responses.move_to_end((scope, key))
+                    event = None
+                else:
+                    event = self._running.get((scope, key))
+                    if event is None:
+                        self._running[(scope, key)] = threading.Event()
+                        break
+                    self.waited += 1
+            if cached is not None and event is None:
+                return self._replay(request_hash, cached[0], cached[1])
+            if not event.wait(max(deadline - time.monotonic(), 0)):
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress.")
+        try:
+            stored = self._claim(scope, key, request_hash, deadline)
+        except BaseException:
+            self._wake(scope, key)
+            raise
+        if stored is not None:
+            self._remember(scope, key, *stored)
+            self._wake(scope, key)
+            return self._replay(request_hash, *stored[:2])
+        return None
+
+    def _claim(self, scope: str, key: str, request_hash: str, deadline: float):
+        """Claims the key's row, or returns the (request hash, body, stored at) of a completed one.
+        Polls while a request in another process holds the claim."""
+        while True:
+            now = time.time()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(IdempotencyKey).values(scope=scope, key=key, request_hash=request_hash, created_at=now))
+                return None
+            except IntegrityError:
+                pass
+            with engine.begin() as conn:
+                row = conn.execute(
+                    select(IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response, IdempotencyKey.created_at)
+                    .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key)
+                ).first()
+                if row is None:
+                    continue  # the holder gave up between our insert and this read
+                if row.status_code is not None:
+                    if row.created_at > now - IDEMPOTENCY_TTL_SECONDS:
+                        return row.request_hash, json.loads(row.response), row.created_at
+                    stale = IdempotencyKey.status_code.isnot(None)
+                elif row.created_at < now - IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS:
+                    stale = IdempotencyKey.status_code.is_(None)
+                else:
+                    stale = None
+                if stale is not None:
+                    # An expired response or an abandoned claim: take the key over, unless someone else just did
+                    taken = conn.execute(
+                        update(IdempotencyKey)
+                        .where(IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.created_at == row.created_at, stale)
+                        .values(request_hash=request_hash, status_code=None, response=None, created_at=now)
+                    ).rowcount
+                    if taken:
+                        return None
+            if time.monotonic() > deadline:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress.")
+            time.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+    def _remember(self, scope: str, key: str, request_hash: str, body, stored_at: float):
+        with self._lock:
+            self._responses[(scope, key)] = (request_hash, body, stored_at)
+            self._responses.move_to_end((scope, key))
+            while len(self._responses) > self.maxsize:
+                self._responses.popitem(last=False)
+
+    def _wake(self, scope: str, key: str):
+        with self._lock:
+            event = self._running.pop((scope, key), None)
+        if event is not None:
+            event.set()
+
+    def finish(self, scope: str, key: str, request_hash: str, body):
+        """Call after the request's transaction committed its response."""
+        self._remember(scope, key, request_hash, body, time.time())
+        with self._lock:
+            self.executed += 1
+        self._wake(scope, key)
+
+    def abandon(self, scope: str, key: str):
+        """Drops the claim of a request that failed, so the next request with the key runs."""
+        try:
+            with engine.begin() as conn:
+                conn.execute(IdempotencyKey.__table__.delete().where(
+                    IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.status_code.is_(None),
+                ))
+        finally:
+            with self._lock:
+                self.abandoned += 1
+            self._wake(scope, key)
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Deletes responses older than IDEMPOTENCY_TTL_SECONDS. Returns how many were deleted."""
+        cutoff = (now or time.time()) - IDEMPOTENCY_TTL_SECONDS
+        with engine.begin() as conn:
+            return conn.execute(IdempotencyKey.__table__.delete().where(
+                IdempotencyKey.created_at < cutoff, IdempotencyKey.status_code.isnot(None),
+            )).rowcount
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "cached": len(self._responses), "maxsize": self.maxsize, "running": len(self._running),
+                "executed": self.executed, "replayed": self.replayed, "waited": self.waited, "abandoned": self.abandoned,
+            }
+
+idempotency = IdempotencyStore()
+
+async def purge_idempotency_keys_periodically():
+    while True:
+        await asyncio.sleep(3600)
+        try:
+            purged = await asyncio.to_thread(idempotency.purge)
+            if purged:
+                print(f"IDEMPOTENCY: Purged {purged} expired keys.")
+        except Exception as e:
+            print(f"IDEMPOTENCY: Purge failed, will retry: {e}")
+
+@app.get("/api/metrics/holds", tags=["Metrics"])
+def hold_metrics():
+    """Seats currently held by unpaid bookings, and what the expiry reaper has released."""
+    return held_seat_stats()
+
+@app.get("/api/metrics/idempotency", tags=["Metrics"])
+def idempotency_metrics():
+    """Keyed requests run, replayed from a stored response, and made to wait for a running duplicate."""
+    return idempotency.stats()
+
+# --- NEW: Group Commit for Bookings ---
+# With BOOKING_GROUP_COMMIT=1, create_booking hands each request to a single writer thread
+# instead of committing it on its own. The writer collects whatever arrives within
+# GROUP_COMMIT_WINDOW_SECONDS (up to GROUP_COMMIT_MAX_BATCH requests) and books the whole batch in
+# one transaction, the way a bulk import chunk is booked: one conditional UPDATE per flight sent as
+# a single executemany, one seat map update per flight and one multi-row INSERT. Each request's
+# future then resolves with its own BookingResponse or error. On SQLite that is one fsync per
+# batch rather than per booking.
+BOOKING_GROUP_COMMIT = os.getenv("BOOKING_GROUP_COMMIT", "0") == "1"
+GROUP_COMMIT_WINDOW_SECONDS = 0.002
+GROUP_COMMIT_MAX_BATCH = 256
+GROUP_COMMIT_ATTEMPTS = 3
+
+@dataclass
+class PendingBooking:
+    request: BookingRequest
+    pnr: str
+    quoted_price: Optional[float]
+    call: IdempotentCall
+    future: Future
+
+def commit_booking_batch(batch: List[PendingBooking]) -> list:
+    """Books every request of the batch in one transaction. Returns, per request, its
+    BookingResponse or the HTTPException it failed with."""
+    by_flight = {}
+    for i, item in enumerate(batch):
+        by_flight.setdefault(item.request.flight_id, []).append(i)
+
+    with SessionLocal() as db:
+        for attempt in range(GROUP_COMMIT_ATTEMPTS):
+            results = [None] * len(batch)
+            reservation = reserve_seats_many(db, {flight_id: len(indices) for flight_id, indices in by_flight.items()})
+            if reservation is None:
+                db.rollback()
+                continue
+            flights, taken = reservation
+            reserved = {}
+            for flight_id, indices in by_flight.items():
+                count = taken.get(flight_id, 0)
+                if count:
+                    reserved[flight_id] = indices[:count]
+                for i in indices[count:]:
+                    results[i] = HTTPException(status_code=400, detail="No seats available.") if flight_id in flights else HTTPException(status_code=404, detail="Flight not found.")
+            if not reserved:
+                db.rollback()
+                return results
+
+            seat_maps = load_seat_maps(
+                db, {flight_id: flights[flight_id] for flight_id in reserved},
+                {flight_id: flights[flight_id].total_seats - flights[flight_id].seats_available - len(indices) for flight_id, indices in reserved.items()},
+            )
+            booked = []  # (request index, flight row, seat_no, seats left before this booking)
+            for flight_id, indices in reserved.items():
+                flight, seat_map = flights[flight_id], seat_maps[flight_id][0]
+                seats_left, first = flight.seats_available + len(indices), len(booked)
+                # Requests for a named seat go first, so a request for any seat cannot take it from them
+                for i in sorted(indices, key=lambda i: batch[i].request.seat_no is None):
+                    seat_no = batch[i].request.seat_no
+                    index = seat_map.layout.parse(seat_no) if seat_no else seat_map.first_free()
+                    if seat_no and index is None:
+                        results[i] = HTTPException(status_code=400, detail=f"Seat {seat_no} does not exist on this flight.")
+                    elif index is None:
+                        results[i] = HTTPException(status_code=400, detail="No seats available.")
+                    elif not seat_map.is_free(index):
+                        results[i] = HTTPException(status_code=409, detail=f"Seat {seat_no} is not available.")
+                    else:
+                        seat_map.take(index)
+                        booked.append((i, flight, seat_map.layout.seat_no(index), seats_left))
+                        seats_left -= 1
+                unused = len(indices) - (len(booked) - first)
+                if unused:
+                    flights[flight_id] = release_seats(db, flight_id, unused) or flight
+            if not save_seat_maps(db, seat_maps):
+                db.rollback()
+                continue
+
+            prices = calculate_dynamic_prices(
+                [float(flight.base_fare) for _, flight, _, _ in booked], [left for _, _, _, left in booked],
+                [flight.total_seats for _, flight, _, _ in booked], [flight.departure for _, flight, _, _ in booked],
+                rule_keys=[flight_rule_key(flight) for _, flight, _, _ in booked],
+            ).tolist()
+            rows = []
+            for (i, flight, seat_no, _), price in zip(booked, prices):
+                item = batch[i]
+                price = item.quoted_price if item.quoted_price is not None else price
+                passenger_name = f"{item.request.passenger.first_name} {item.request.passenger.last_name}"
+                rows.append((flight.id, passenger_name, seat_no, item.pnr, price))
+                results[i] = BookingResponse(
+                    pnr=item.pnr, flight_no=flight.flight_no, passenger_name=passenger_name, seat_no=seat_no,
+                    status="Pending", price=price, departure=flight.departure,
+                    origin=flight.origin, destination=flight.destination
+                )
+                item.call.record(results[i], status.HTTP_201_CREATED, db=db)
+            if rows:
+                db.connection().exec_driver_sql(
+                    "INSERT INTO bookings (flight_id, passenger_name, seat_no, pnr, price, status, expires_at) VALUES (?, ?, ?, ?, ?, 'Pending', ?)",
+                    [(*row, time.time() + PENDING_HOLD_SECONDS) for row in rows],
+                )
+            db.commit()
+            break
+        else:
+            return [HTTPException(status_code=409, detail="Booking conflicted with other bookings. Please try again.") for _ in batch]
+
+    notify_flights_changed([flights[flight_id] for flight_id in reserved])
+    if rows:
+        price_history.append([row[0] for row in rows], [row[4] for row in rows], kind=CHARGED)
+    return results
+
+class BookingWriter:
+    """The single thread that commits group-commit bookings, batch by batch."""
+    def __init__(self, window: float = GROUP_COMMIT_WINDOW_SECONDS, max_batch: int = GROUP_COMMIT_MAX_BATCH):
+        self.window = window
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = self.bookings = self.largest_batch = 0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="booking-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """Commits everything already queued, then stops the thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def submit(self, item: PendingBooking) -> Optional[Future]:
+        """Queues a booking; None if the writer is not running and the caller must commit it itself."""
+        with self._lock:
+            if self._thread is None:
+                return None
+            self._queue.put(item)
+        return item.future
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._commit(batch)
+
+    def _commit(self, batch: List[PendingBooking]):
+        try:
+            results = commit_booking_batch(batch)
+        except Exception as e:
+            results = [HTTPException(status_code=500, detail=f"Booking failed. Please try again. Error: {e}") for _ in batch]
+        for item, result in zip(batch, results):
+            if isinstance(result, Exception):
+                item.future.set_exception(result)
+            else:
+                item.future.set_result(result)
+        with self._lock:
+            self.batches += 1
+            self.bookings += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._thread is not None, "queued": self._queue.qsize(), "batches": self.batches,
+                "bookings": self.bookings, "largest_batch": self.largest_batch,
+                "average_batch": round(self.bookings / self.batches, 2) if self.batches else 0.0,
+            }
+
+booking_writer = BookingWriter()
+
+@app.get("/api/metrics/booking-writer", tags=["Metrics"])
+def booking_writer_metrics():
+    """Group-commit batches written and their sizes."""
+    return booking_writer.stats()
+
+@app.get("/api/metrics/quotes", tags=["Metrics"])
+def quote_metrics():
+    """Quote tokens redeemed, rejected as reused, released after failed bookings, and purged."""
+    return redeemed_quotes.stats()
 
 @app.post("/api/bookings", response_model=BookingResponse, status_code=status.HTTP_201_CREATED, tags=["Bookings"]) # --- MODIFIED --- Added /api prefix
-def create_booking(request: BookingRequest, db: Session = Depends(get_db)):
-    """Creates a booking. This is a transactional and concurrency-safe endpoint."""
+def create_booking(request: BookingRequest, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """Creates a booking. This is a transactional and concurrency-safe endpoint.
+    A valid quote_token from search locks in the quoted price for one booking; an invalid, expired or
+    already used one is rejected.
+    A retry with the same Idempotency-Key header returns the first response instead of booking again."""
+    with idempotency.call("bookings.create", idempotency_key, idempotency_hash(request), db) as call:
+        if call.replay is not None:
+            return call.replay
+        return _create_booking(request, db, call)
+
+def _create_booking(request: BookingRequest, db: Session, call: IdempotentCall) -> BookingResponse:
+    if not request.quote_token:
+        return _book_seat(request, db, call, None)
+    quoted_price = redeem_quote_token(request.quote_token, request.flight_id)
     try:
-        flight = db.query(Flight).filter(Flight.id == request.flight_id).with_for_update().first()
+        return _book_seat(request, db, call, quoted_price)
+    except BaseException:
+        db.rollback()
+        release_quote_token(request.quote_token)
+        raise
 
-        if not flight:
-            raise HTTPException(status_code=404, detail="Flight not found.")
-        if flight.seats_available <= 0:
+def _book_seat(request: BookingRequest, db: Session, call: IdempotentCall, quoted_price: Optional[float]) -> BookingResponse:
+    pnr = generate_pnr()
+    future = booking_writer.submit(PendingBooking(request, pnr, quoted_price, call, Future()))
+    if future is not None:
+        return future.result()
+    try:
+        # The seat is taken first, atomically; everything after it runs in the same transaction
+        flight = reserve_seats(db, request.flight_id)
+        if flight is None:
+            if db.connection().execute(select(Flight.id).where(Flight.id == request.flight_id)).first() is None:
+                raise HTTPException(status_code=404, detail="Flight not found.")
             raise HTTPException(status_code=400, detail="No seats available.")
 
-        final_price = calculate_dynamic_price(float(flight.base_fare), flight.seats_available, flight.total_seats, flight.departure)
-        
-        flight.seats_available -= 1
+        if quoted_price is not None:
+            final_price = quoted_price
+        else:
+            # Priced on the seat count before this reservation, as search would have shown it
+            final_price = calculate_dynamic_price(float(flight.base_fare), flight.seats_available + 1, flight.total_seats, flight.departure, flight_rule_key(flight))
+        seat_no = assign_seats(db, flight, seat_nos=[request.seat_no] if request.seat_no else None)[0]
         
+        passenger_name = f"{request.passenger.first_name} {request.passenger.last_name}"
         new_booking = Booking(
             flight_id=flight.id,
-            passenger_name=f"{request.passenger.first_name} {request.passenger.last_name}",
-            pnr=generate_pnr(),
+            passenger_name=passenger_name,
+            seat_no=seat_no,
+            pnr=pnr,
             price=final_price,
             # --- MODIFIED ---
             # Status is now 'Pending' by default, so we don't set it to 'Confirmed' here.
-            status="Pending" 
+            status="Pending",
+            expires_at=time.time() + PENDING_HOLD_SECONDS,
         )
         
         db.add(new_booking)
-        db.commit()
-        db.refresh(new_booking)
-        
-        return BookingResponse(
-            pnr=new_booking.pnr, flight_no=flight.flight_no, passenger_name=new_booking.passenger_name,
-            status=new_booking.status, price=float(new_booking.price), departure=flight.departure,
+        # The response is built from what is being written; reading the expired instance back would
+        # check a connection out again and hold it until the request's session is closed
+        response = BookingResponse(
+            pnr=pnr, flight_no=flight.flight_no, passenger_name=passenger_name, seat_no=seat_no,
+            status="Pending", price=final_price, departure=flight.departure,
             origin=flight.origin, destination=flight.destination
         )
+        call.record(response, status.HTTP_201_CREATED)
+        db.commit()
+        notify_flight_changed(flight)
+        price_history.append([flight.id], [final_price], kind=CHARGED)
+        
+        return response
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Booking failed. Please try again. Error: {e}")
 
+# --- NEW ENDPOINT: GROUP BOOKING ---
+# A group takes all its seats with one reserve_seats() call (side by side where the cabin allows),
+# is priced once at the fare the first seat would have cost, and gets one Pending booking (and
+# PNR) per passenger so each traveller can be paid for, looked up and cancelled on their own.
+# Either every booking is created or none. Quote tokens are for single bookings only: one is
+# signed for one seat's price, which a group must not get for all of its seats.
+
+@app.post("/api/bookings/group", response_model=GroupBookingResponse, status_code=status.HTTP_201_CREATED, tags=["Bookings"])
+def create_group_booking(request: GroupBookingRequest, db: Session = Depends(get_db)):
+    """Books the same flight for several passengers in one transaction, all at the same price."""
+    count = len(request.passengers)
+    if request.seat_nos is not None and len(request.seat_nos) != count:
+        raise HTTPException(status_code=400, detail="seat_nos must list one seat per passenger.")
+    if request.quote_token:
+        raise HTTPException(status_code=400, detail="Fare quotes are for single bookings. Book a group without quote_token.")
+    pnrs = generate_pnrs(count)
+    try:
+        flight = reserve_seats(db, request.flight_id, count)
+        if flight is None:
+            if db.connection().execute(select(Flight.id).where(Flight.id == request.flight_id)).first() is None:
+                raise HTTPException(status_code=404, detail="Flight not found.")
+            raise HTTPException(status_code=400, detail=f"Fewer than {count} seats available.")
+
+        final_price = calculate_dynamic_price(float(flight.base_fare), flight.seats_available + count, flight.total_seats, flight.departure, flight_rule_key(flight))
+        seat_nos = assign_seats(db, flight, count, request.seat_nos, adjacent=True)
+
+        rows = [
+            {
+                "flight_id": flight.id, "passenger_name": f"{passenger.first_name} {passenger.last_name}",
+                "seat_no": seat_no, "pnr": pnr, "price": final_price, "status": "Pending",
+                "expires_at": time.time() + PENDING_HOLD_SECONDS,
+            }
+            for passenger, seat_no, pnr in zip(request.passengers, seat_nos, pnrs)
+        ]
+        db.connection().execute(insert(Booking), rows)
+        db.commit()
+    except HTTPException:
+        db.rollback()
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Group booking failed. Please try again. Error: {e}")
+
+    notify_flight_changed(flight)
+    price_history.append([flight.id] * count, [final_price] * count, kind=CHARGED)
+    return GroupBookingResponse(
+        flight_no=flight.flight_no, departure=flight.departure, origin=flight.origin, destination=flight.destination,
+        price_per_passenger=final_price, total_price=round(final_price * count, 2),
+        bookings=[
+            BookingResponse(
+                pnr=row["pnr"], flight_no=flight.flight_no, passenger_name=row["passenger_name"], seat_no=row["seat_no"], status=row["status"],
+                price=final_price, departure=flight.departure, origin=flight.origin, destination=flight.destination,
+            )
+            for row in rows
+        ],
+    )
+
+# --- NEW ENDPOINT: BULK BOOKING IMPORT ---
+# Partner batch files are read from the request body as it arrives and imported in chunks of
+# BULK_IMPORT_CHUNK_ROWS rows, one transaction per chunk. Within a chunk rows are grouped by
+# flight: reserve_seats_many() takes each flight's seats with one conditional update, each flight
+# is priced once and its seat map updated once, and all bookings go in with a single executemany.
+# Rows that find no seat left are rejected in file order. A chunk costs about as much per flight it
+# touches (counter, seat map, in-memory indexes) as per row, and partner files spread over
+# thousands of flights, so chunks are large enough that each flight comes up a few times per chunk.
+BULK_IMPORT_CHUNK_ROWS = 20000
+BULK_IMPORT_ATTEMPTS = 3
+BULK_IMPORT_FORMATS = ("csv", "ndjson")
+
+def _import_result(row: int, status: str, reference: Optional[str], flight_id: Optional[int] = None, pnr: Optional[str] = None,
+                   seat_no: Optional[str] = None, price: Optional[float] = None, error: Optional[str] = None) -> dict:
+    """A BulkImportRow as a plain dict with every field in model order, so the report can go out
+    through json.dumps without validating a model per row."""
+    return {"row": row, "status": status, "reference": reference, "flight_id": flight_id, "pnr": pnr, "seat_no": seat_no, "price": price, "error": error}
+
+def _read_csv_chunk(lines: List[tuple]) -> Optional[List[list]]:
+    """The values of every line through one csv.reader, or None when the lines must be read one at
+    a time: a quote can open a field that runs on into the next line, and a byte order mark or a
+    line that does not decode should only fail its own row."""
+    data = b"\n".join([line for _, line in lines])
+    if b'"' in data or codecs.BOM_UTF8 in data:
+        return None
+    try:
+        return list(csv.reader(data.decode("utf-8").split("\n")))
+    except (ValueError, csv.Error):
+        return None
+
+def _parse_import_rows(lines: List[tuple], fmt: str, header: Optional[List[str]]):
+    """Turns (row number, raw line) pairs into booking records and rejections."""
+    records, rejected = [], []
+    chunk_values = _read_csv_chunk(lines) if fmt == "csv" else None
+    for i, (row, line) in enumerate(lines):
+        reference = None
+        try:
+            if fmt == "csv":
+                values = chunk_values[i] if chunk_values is not None else next(csv.reader([line.decode("utf-8-sig")]))
+                fields = dict(zip(header, values))
+            else:
+                fields = json.loads(line)
+                if not isinstance(fields, dict):
+                    raise ValueError("Row is not a JSON object.")
+            reference = fields.get("reference")
+            reference = str(reference) if reference not in (None, "") else None
+            flight_id = int(fields.get("flight_id"))
+            first_name = str(fields.get("first_name") or "").strip()
+            last_name = str(fields.get("last_name") or "").strip()
+            if not first_name or not last_name:
+                raise ValueError("first_name and last_name are required.")
+        except UnicodeDecodeError:
+            rejected.append(_import_result(row, "rejected", reference, error="Invalid row: invalid encoding, expected UTF-8."))
+            continue
+        except (TypeError, ValueError, csv.Error) as e:
+            rejected.append(_import_result(row, "rejected", reference, error=f"Invalid row: {e}"))
+            continue
+        records.append((row, reference, flight_id, f"{first_name} {last_name}"))
+    return records, rejected
+
+def import_booking_chunk(lines: List[tuple], fmt: str, header: Optional[List[str]] = None) -> List[dict]:
+    """Imports one chunk of raw rows in a single transaction. Returns one result per row."""
+    records, results = _parse_import_rows(lines, fmt, header)
+    by_flight = {}
+    for record in records:
+        by_flight.setdefault(record[2], []).append(record)
+    # A PNR for every row that may be booked, drawn before the transaction; rejected rows' go unused
+    chunk_pnrs = generate_pnrs(len(records))
+
+    with SessionLocal() as db:
+        for attempt in range(BULK_IMPORT_ATTEMPTS):
+            try:
+                reservation = reserve_seats_many(db, {flight_id: len(group) for flight_id, group in by_flight.items()})
+                if reservation is None:
+                    db.rollback()
+                    continue
+                flights, taken = reservation
+                reserved, chunk_results, bookings = [], [], []
+                for flight_id, group in by_flight.items():
+                    count = taken.get(flight_id, 0)
+                    if count:
+                        reserved.append((flights[flight_id], group[:count]))
+                    error = "No seats available." if flight_id in flights else "Flight not found."
+                    chunk_results.extend(
+                        _import_result(row, "rejected", reference, flight_id, error=error)
+                        for row, reference, _, _ in group[count:]
+                    )
+                if reserved:
+                    # One price per flight, on its seat count before this chunk's reservation
+                    reserved_flights = [flight for flight, _ in reserved]
+                    prices = calculate_dynamic_prices(
+                        [float(f.base_fare) for f in reserved_flights], [f.seats_available + len(g) for f, g in reserved],
+                        [f.total_seats for f in reserved_flights], [f.departure for f in reserved_flights],
+                        rule_keys=[flight_rule_key(f) for f in reserved_flights],
+                    ).tolist()
+                    seat_maps = load_seat_maps(
+                        db, {f.id: f for f in reserved_flights}, {f.id: f.total_seats - f.seats_available - len(g) for f, g in reserved},
+                    )
+                    pnrs = iter(chunk_pnrs)
+                    for index, ((flight, group), price) in enumerate(zip(reserved, prices)):
+                        seat_map = seat_maps[flight.id][0]
+                        seats = seat_map.allocate(min(len(group), seat_map.layout.total_seats - seat_map.occupied_count))
+                        if len(seats) < len(group):
+                            # The map has fewer free seats than the counter said; hand the difference back
+                            reserved[index] = (release_seats(db, flight.id, len(group) - len(seats)) or flight, group)
+                        for (row, reference, flight_id, passenger_name), seat in zip(group, seats):
+                            pnr, seat_no = next(pnrs), seat_map.layout.seat_no(seat)
+                            bookings.append((flight_id, passenger_name, seat_no, pnr, price))
+                            chunk_results.append(_import_result(row, "booked", reference, flight_id, pnr, seat_no, price))
+                        chunk_results.extend(
+                            _import_result(row, "rejected", reference, flight_id, error="No seats available.")
+                            for row, reference, flight_id, _ in group[len(seats):]
+                        )
+                    if not save_seat_maps(db, seat_maps):
+                        # A seat map changed since it was read; start the chunk over
+                        db.rollback()
+                        continue
+                    expires_at = time.time() + PENDING_HOLD_SECONDS
+                    db.connection().exec_driver_sql(
+                        "INSERT INTO bookings (flight_id, passenger_name, seat_no, pnr, price, status, expires_at) VALUES (?, ?, ?, ?, ?, 'Pending', ?)",
+                        [(*booking, expires_at) for booking in bookings],
+                    )
+                db.commit()
+                break
+            except Exception as e:
+                db.rollback()
+                return sorted(results + [
+                    _import_result(row, "rejected", reference, flight_id, error=f"Import failed: {e}")
+                    for row, reference, flight_id, _ in records
+                ], key=lambda r: r["row"])
+        else:
+            return sorted(results + [
+                _import_result(row, "rejected", reference, flight_id, error="Import conflicted with other bookings. Please resend this row.")
+                for row, reference, flight_id, _ in records
+            ], key=lambda r: r["row"])
+
+    notify_flights_changed([flight for flight, _ in reserved])
+    if bookings:
+        price_history.append([b[0] for b in bookings], [b[4] for b in bookings], kind=CHARGED)
+    return sorted(results + chunk_results, key=lambda r: r["row"])
+
+async def _request_lines(request: Request):
+    """Yields the non-blank lines of the request body as it streams in."""
+    pending = b""
+    async for data in request.stream():
+        pending += data
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+    if pending.strip():
+        yield pending
+
+@app.post("/api/bookings/import", response_model=BulkImportResponse, tags=["Bookings"])
+async def import_bookings(request: Request, format: Optional[str] = Query(None, description="csv or ndjson; defaults from Content-Type")):
+    """Imports a partner batch file of bookings, one per line, as CSV (with a header row naming
+    flight_id, first_name, last_name and optionally reference) or NDJSON objects with the same keys.
+    Every imported booking is Pending. Chunks commit independently; the report has one entry per row."""
+    fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "ndjson")
+    if fmt not in BULK_IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(BULK_IMPORT_FORMATS)}.")
+
+    header, chunk, results = None, [], []
+    async for line in _request_lines(request):
+        if fmt == "csv" and header is None:
+            try:
+                header = [name.strip() for name in next(csv.reader([line.decode("utf-8-sig")]))]
+            except UnicodeDecodeError:
+                raise HTTPException(status_code=400, detail="CSV header has an invalid encoding, expected UTF-8.")
+            missing = {"flight_id", "first_name", "last_name"} - set(header)
+            if missing:
+                raise HTTPException(status_code=400, detail=f"CSV header is missing {', '.join(sorted(missing))}.")
+            continue
+        chunk.append((len(results) + len(chunk) + 1, line))
+        if len(chunk) == BULK_IMPORT_CHUNK_ROWS:
+            results.extend(await asyncio.to_thread(import_booking_chunk, chunk, fmt, header))
+            chunk = []
+    if chunk:
+        results.extend(await asyncio.to_thread(import_booking_chunk, chunk, fmt, header))
+
+    booked = sum(1 for r in results if r["status"] == "booked")
+    # Rendered directly: the rows are already in BulkImportRow shape (see _import_result)
+    return JSONResponse({"rows": len(results), "booked": booked, "rejected": len(results) - booked, "results": results})
+
 # --- NEW ENDPOINT: SIMULATE PAYMENT ---
 @app.post("/api/bookings/{pnr}/pay", response_model=PaymentResponse, tags=["Bookings"])
-def pay_for_booking(pnr: str, db: Session = Depends(get_db)):
-    booking = db.query(Booking).filter(Booking.pnr.ilike(pnr)).with_for_update().first()
+def pay_for_booking(pnr: str, idempotency_key: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """Simulates a payment. A retry with the same Idempotency-Key header gets the first outcome back
+    rather than a second payment attempt."""
+    with idempotency.call("bookings.pay", idempotency_key, idempotency_hash(pnr.upper()), db) as call:
+        if call.replay is not None:
+            return call.replay
+        return _pay_for_booking(pnr, db, call)
+
+def _pay_for_booking(pnr: str, db: Session, call: IdempotentCall) -> dict:
+    booking = fetch_booking_for_update(db, pnr)
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found.")
     
     if booking.status == "Confirmed":
         return {"pnr": pnr, "status": "Confirmed", "message": "This booking is already paid for."}
+    if booking.status != "Pending":
+        # Failed and cancelled bookings no longer hold a seat, so they cannot be confirmed
+        raise HTTPException(status_code=400, detail=f"Booking is {booking.status} and cannot be paid for.")
+    if booking.expires_at is not None and booking.expires_at < time.time():
+        # The reaper releases the seat; paying now could confirm a seat it is about to give back
+        raise HTTPException(status_code=400, detail="The seat hold for this booking has expired. Please book again.")
 
     # Simulate a payment success or failure
     payment_success = random.choice([True, False])
     
     if payment_success:
-        booking.status = "Confirmed"
+        if not set_booking_status(db, booking.booking_id, ["Pending"], "Confirmed"):
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Booking changed while paying. Please check its status.")
+        response = {"pnr": pnr, "status": "Confirmed", "message": "Payment successful. Your booking is confirmed."}
+        call.record(response)
         db.commit()
-        return {"pnr": pnr, "status": "Confirmed", "message": "Payment successful. Your booking is confirmed."}
+        return response
     else:
-        # If payment fails, we'll "cancel" the booking and restore the seat
-        booking.status = "Failed"
-        flight = db.query(Flight).filter(Flight.id == booking.flight_id).with_for_update().first()
+        # If payment fails, we'll "cancel" the booking and restore the seat, exactly once
+        if not set_booking_status(db, booking.booking_id, ["Pending"], "Failed"):
+            db.rollback()
+            raise HTTPException(status_code=409, detail="Booking changed while paying. Please check its status.")
+        flight = release_seats(db, booking.flight_id)
         if flight:
-            flight.seats_available += 1
+            free_seats(db, flight, [booking.seat_no])
         
+        response = {"pnr": pnr, "status": "Failed", "message": "Payment failed. Your booking has been cancelled and seat released."}
+        call.record(response)
         db.commit()
-        return {"pnr": pnr, "status": "Failed", "message": "Payment failed. Your booking has been cancelled and seat released."}
+        if flight:
+            notify_flight_changed(flight)
+        return response
 
 # --- NEW ENDPOINT: GET RECEIPT (JSON) ---
 @app.get("/api/bookings/{pnr}/receipt", response_model=BookingResponse, tags=["Bookings"])
@@ -264,36 +2811,43 @@ def get_booking_receipt(pnr: str, db: Session = Depends(get_db)):
 
 @app.get("/api/bookings/{pnr}", response_model=BookingResponse, tags=["Bookings"]) # --- MODIFIED --- Added /api prefix
 def get_booking(pnr: str, db: Session = Depends(get_db)):
-    booking = db.query(Booking).filter(Booking.pnr.ilike(pnr)).first()
-    if not booking:
+    row = fetch_booking_row(db, pnr)
+    if not row:
         raise HTTPException(status_code=404, detail="Booking not found.")
     
-    flight = db.query(Flight).filter(Flight.id == booking.flight_id).first()
-    
     return BookingResponse(
-        pnr=booking.pnr, flight_no=flight.flight_no, passenger_name=booking.passenger_name,
-        status=booking.status, price=float(booking.price), departure=flight.departure,
-        origin=flight.origin, destination=flight.destination
+        pnr=row.pnr, flight_no=row.flight_no, passenger_name=row.passenger_name, seat_no=row.seat_no,
+        status=row.status, price=float(row.price), departure=row.departure,
+        origin=row.origin, destination=row.destination
     )
 
 @app.delete("/api/bookings/{pnr}", status_code=status.HTTP_200_OK, tags=["Bookings"]) # --- MODIFIED --- Added /api prefix
 def cancel_booking(pnr: str, db: Session = Depends(get_db)):
     try:
-        booking = db.query(Booking).filter(Booking.pnr.ilike(pnr)).with_for_update().first()
+        booking = fetch_booking_for_update(db, pnr)
         if not booking:
             raise HTTPException(status_code=404, detail="Booking not found.")
         if booking.status == "Cancelled":
             raise HTTPException(status_code=400, detail="Booking is already cancelled.")
 
-        flight = db.query(Flight).filter(Flight.id == booking.flight_id).with_for_update().first()
+        # Conditional on the status just read, so concurrent cancels or payments cannot double-release
+        if not set_booking_status(db, booking.booking_id, [booking.status], "Cancelled"):
+            raise HTTPException(status_code=409, detail="Booking changed while cancelling. Please try again.")
 
-        # Only restore seat if booking was confirmed (not just pending or failed)
-        if flight and booking.status == "Confirmed":
-            flight.seats_available += 1
+        # Restore the seat if the booking still held one (pending or confirmed, not failed or expired)
+        flight = None
+        if booking.status in HOLDING_STATUSES:
+            flight = release_seats(db, booking.flight_id)
+            if flight:
+                free_seats(db, flight, [booking.seat_no])
         
-        booking.status = "Cancelled"
         db.commit()
+        if flight:
+            notify_flight_changed(flight)
         return {"message": f"Booking {pnr} has been cancelled successfully."}
+    except HTTPException:
+        db.rollback()
+        raise
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Cancellation failed. Error: {e}")
@@ -301,7 +2855,8 @@ def cancel_booking(pnr: str, db: Session = Depends(get_db)):
 
 # --- NEW: MOUNT THE FRONTEND ---
 # This line tells FastAPI to serve all files from the 'static' folder
-app.mount("/", StaticFiles(directory="static", html=True), name="static")
+if os.path.isdir("static"):
+    app.mount("/", StaticFiles(directory="static", html=True), name="static")
 
 # This is a fallback to ensure your index.html is served from the root
 @app.get("/")
@@ -0,0 +1,14 @@
+from sqlalchemy import create_engine
+from main import DATABASE_URL, apply_migrations
+
+def migrate():
+    """Upgrades flight_booking.db in place: adds the airport catalog and backfills flight references."""
+    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    try:
+        apply_migrations(engine)
+        print("✅ Database migrated successfully!")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+from collections import deque
+from typing import Callable, List
+
+import numpy as np
+
+# --- PNR Generation ---
+# PNRs come from one shared sequence rather than random draws. Each worker process reserves a
+# block of sequence numbers with a single database update and hands PNRs out of the block from
+# memory, so uniqueness needs no lookup per PNR. Sequence numbers are turned into codes by a
+# keyed permutation of the whole 6-character base-36 space, so consecutive bookings get
+# unrelated-looking PNRs while two different numbers can never map to the same code.
+
+PNR_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+PNR_LENGTH = 6
+PNR_SPACE = len(PNR_ALPHABET) ** PNR_LENGTH  # 2,176,782,336 codes
+
+_ALPHABET_BYTES = np.frombuffer(PNR_ALPHABET.encode(), dtype=np.uint8)
+_MASK32 = np.uint64(0xFFFFFFFF)
+_MASK16 = np.uint64(0xFFFF)
+FEISTEL_ROUNDS = 4
+
+class PnrCodec:
+    """A keyed bijection from [0, PNR_SPACE) onto 6-character PNRs.
+
+    A 4-round Feistel network permutes 32-bit values; values that land outside the PNR space
+    are permuted again until they fall inside it (cycle walking), which keeps the mapping a
+    bijection on the smaller space. About two rounds of the network are needed per value.
+    """
+    def __init__(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=4 * FEISTEL_ROUNDS).digest()
+        self.round_keys = [np.uint64(int.from_bytes(digest[i:i + 4], "little")) for i in range(0, len(digest), 4)]
+
+    def _feistel(self, values: np.ndarray) -> np.ndarray:
+        left, right = values >> np.uint64(16), values & _MASK16
+        for key in self.round_keys:
+            mixed = (right * np.uint64(0x9E3779B1) + key) & _MASK32
+            mixed ^= mixed >> np.uint64(15)
+            mixed = (mixed * np.uint64(0x2C1B3C6D)) & _MASK32
+            mixed ^= mixed >> np.uint64(12)
+            left, right = right, left ^ (mixed & _MASK16)
+        return (left << np.uint64(16)) | right
+
+    def permute(self, values) -> np.ndarray:
+        """The scrambled position in the PNR space of each sequence number."""
+        values = np.asarray(values, dtype=np.uint64)
+        if values.size and int(values.max()) >= PNR_SPACE:
+            raise ValueError("Sequence number is outside the PNR space.")
+        out = self._feistel(values)
+        walking = np.flatnonzero(out >= PNR_SPACE)
+        while walking.size:
+            out[walking] = self._feistel(out[walking])
+            walking = walking[out[walking] >= PNR_SPACE]
+        return out
+
+    def encode(self, values) -> np.ndarray:
+        """PNRs for the given sequence numbers, as an array of 6-byte ASCII strings."""
+        positions = self.permute(values)
+        chars = np.empty((len(positions), PNR_LENGTH), dtype=np.uint8)
+        for column in range(PNR_LENGTH - 1, -1, -1):
+            chars[:, column] = _ALPHABET_BYTES[positions % np.uint64(36)]
+            positions //= np.uint64(36)
+        return chars.view(f"S{PNR_LENGTH}").ravel()
+
+    def encode_range(self, start: int, count: int) -> List[str]:
+        return self.encode(np.arange(start, start + count, dtype=np.uint64)).astype(str).tolist()
+
+class PnrAllocator:
+    """Hands out PNRs from blocks reserved through `reserve_block(size)`, which must return up to
+    that many PNRs that no other caller, in any process, will ever get. Thread-safe."""
+    def __init__(self, reserve_block: Callable[[int], List[str]], block_size: int = 1000):
+        self.reserve_block = reserve_block
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._pnrs = deque()
+        self.issued = self.blocks = 0
+
+    def _refill(self, needed: int):
+        while len(self._pnrs) < needed:
+            self._pnrs.extend(self.reserve_block(max(self.block_size, needed - len(self._pnrs))))
+            self.blocks += 1
+
+    def next(self) -> str:
+        with self._lock:
+            if not self._pnrs:
+                self._refill(1)
+            self.issued += 1
+            return self._pnrs.popleft()
+
+    def take(self, count: int) -> List[str]:
+        with self._lock:
+            self._refill(count)
+            self.issued += count
+            return [self._pnrs.popleft() for _ in range(count)]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"issued": self.issued, "blocks_reserved": self.blocks, "left_in_block": len(self._pnrs)}
@@ -0,0 +1,94 @@
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+# --- Price History Buffer ---
+# Quoted and charged prices are appended to preallocated column arrays in memory; a writer
+# drains them periodically into the price_history table in one batch insert. Appending is a
+# few slice copies under a lock, so it stays cheap enough for the search path.
+
+QUOTED = 0
+CHARGED = 1
+PRICE_KINDS = {QUOTED: "quoted", CHARGED: "charged"}
+
+Block = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]  # flight ids, unix times, prices, kinds
+
+class PriceHistoryBuffer:
+    """Append-only columnar buffer of (flight id, time, price, kind) samples.
+
+    Samples go into the open block until it is full, then the block is sealed and queued for
+    the writer. If the writer falls behind by more than `max_blocks`, the oldest block is
+    dropped (and counted) rather than letting memory grow without bound.
+    """
+    def __init__(self, block_size: int = 65536, max_blocks: int = 64):
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self._lock = threading.Lock()
+        self._sealed: List[Block] = []
+        self._open_block()
+        self.recorded = self.dropped = 0
+
+    def _open_block(self):
+        self._flight_id = np.empty(self.block_size, dtype=np.int64)
+        self._recorded_at = np.empty(self.block_size)
+        self._price = np.empty(self.block_size)
+        self._kind = np.empty(self.block_size, dtype=np.int8)
+        self._size = 0
+
+    def _current(self) -> Block:
+        n = self._size
+        return (self._flight_id[:n], self._recorded_at[:n], self._price[:n], self._kind[:n])
+
+    def _seal(self):
+        self._sealed.append(self._current())
+        if len(self._sealed) > self.max_blocks:
+            self.dropped += len(self._sealed.pop(0)[0])
+        self._open_block()
+
+    def append(self, flight_ids, prices, kind: int = QUOTED, now: Optional[float] = None):
+        """Records one sample per flight id, all stamped with the same time."""
+        flight_ids = np.asarray(flight_ids, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+        now = time.time() if now is None else now
+        start, total = 0, len(flight_ids)
+        with self._lock:
+            while start < total:
+                take = min(total - start, self.block_size - self._size)
+                end = self._size + take
+                self._flight_id[self._size:end] = flight_ids[start:start + take]
+                self._price[self._size:end] = prices[start:start + take]
+                self._recorded_at[self._size:end] = now
+                self._kind[self._size:end] = kind
+                self._size, start = end, start + take
+                if self._size == self.block_size:
+                    self._seal()
+            self.recorded += total
+
+    def drain(self) -> List[Block]:
+        """Takes every buffered sample out of the buffer, as a list of column blocks."""
+        with self._lock:
+            if self._size:
+                self._seal()
+            blocks, self._sealed = self._sealed, []
+        return blocks
+
+    def requeue(self, blocks: List[Block]):
+        """Puts drained blocks back in front of the queue after a failed write."""
+        with self._lock:
+            self._sealed[:0] = blocks
+            while len(self._sealed) > self.max_blocks:
+                self.dropped += len(self._sealed.pop(0)[0])
+
+    def pending(self, flight_id: int) -> Block:
+        """Buffered samples for one flight that have not been written yet, oldest first."""
+        with self._lock:
+            blocks = self._sealed + [self._current()]
+            parts = [tuple(column[block[0] == flight_id] for column in block) for block in blocks]
+        return tuple(np.concatenate(columns) for columns in zip(*parts))
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffered = self._size + sum(len(block[0]) for block in self._sealed)
+            return {"recorded": self.recorded, "buffered": buffered, "dropped": self.dropped}
@@ -0,0 +1,348 @@
+import json
+import math
+import os
+import threading
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# --- Pricing Rule Sets ---
+# A rule set is the seat/time breakpoint tables plus optional floor and cap (both multiples of
+# the base fare, applied to the list fare). The default set reproduces the original
+# calculate_dynamic_price thresholds; airlines and routes can override any field in config:
+#
+#   {
+#     "default":  {"occupancy_breakpoints": [0.4, 0.8], "seat_factors": [0.9, 1.2, 1.5], ...},
+#     "airlines": {"IndiGo": {"seat_factors": [0.85, 1.15, 1.45], "floor": 0.8}},
+#     "routes":   {"DEL-BOM": {"days_breakpoints": [7, 30, 60], "time_factors": [1.5, 1.2, 1.0, 0.8]}}
+#   }
+#
+# A route rule beats an airline rule, which beats the default.
+
+DEFAULT_RULES = {
+    "occupancy_breakpoints": [0.4, 0.8],
+    "seat_factors": [0.9, 1.2, 1.5],
+    "days_breakpoints": [10, 45],
+    "time_factors": [1.4, 1.1, 0.85],
+    "floor": None,
+    "cap": None,
+}
+
+@dataclass(frozen=True)
+class RuleSet:
+    name: str
+    occupancy_breakpoints: Tuple[float, ...]
+    seat_factors: Tuple[float, ...]
+    days_breakpoints: Tuple[int, ...]
+    time_factors: Tuple[float, ...]
+    floor: Optional[float] = None
+    cap: Optional[float] = None
+
+    @classmethod
+    def from_config(cls, name: str, config: dict, parent: Optional[dict] = None) -> "RuleSet":
+        merged = dict(parent or DEFAULT_RULES)
+        unknown = set(config) - set(DEFAULT_RULES)
+        if unknown:
+            raise ValueError(f"{name}: unknown keys {sorted(unknown)}")
+        merged.update(config)
+        rule_set = cls(
+            name=name,
+            occupancy_breakpoints=tuple(float(x) for x in merged["occupancy_breakpoints"]),
+            seat_factors=tuple(float(x) for x in merged["seat_factors"]),
+            days_breakpoints=tuple(int(x) for x in merged["days_breakpoints"]),
+            time_factors=tuple(float(x) for x in merged["time_factors"]),
+            floor=None if merged["floor"] is None else float(merged["floor"]),
+            cap=None if merged["cap"] is None else float(merged["cap"]),
+        )
+        rule_set.validate()
+        return rule_set
+
+    def validate(self):
+        # json accepts Infinity and NaN, which would also break the generated scalar list_fare
+        values = self.occupancy_breakpoints + self.seat_factors + self.days_breakpoints + self.time_factors
+        if not all(math.isfinite(x) for x in values + (self.floor or 0.0, self.cap or 0.0)):
+            raise ValueError(f"{self.name}: breakpoints, factors, floor and cap must be finite numbers")
+        for breakpoints, factors, label in (
+            (self.occupancy_breakpoints, self.seat_factors, "seat"),
+            (self.days_breakpoints, self.time_factors, "time"),
+        ):
+            if len(factors) != len(breakpoints) + 1:
+                raise ValueError(f"{self.name}: {label} factors need exactly one more entry than breakpoints")
+            if list(breakpoints) != sorted(set(breakpoints)):
+                raise ValueError(f"{self.name}: {label} breakpoints must be strictly increasing")
+            if any(f <= 0 for f in factors):
+                raise ValueError(f"{self.name}: {label} factors must be positive")
+        if self.floor is not None and self.cap is not None and self.floor > self.cap:
+            raise ValueError(f"{self.name}: floor is above cap")
+
+    def as_config(self) -> dict:
+        return {
+            "occupancy_breakpoints": list(self.occupancy_breakpoints), "seat_factors": list(self.seat_factors),
+            "days_breakpoints": list(self.days_breakpoints), "time_factors": list(self.time_factors),
+            "floor": self.floor, "cap": self.cap,
+        }
+
+class CompiledRules:
+    """Every rule set stacked into padded 2-D lookup arrays; row i is rule set i, row 0 the default.
+
+    Breakpoint rows are padded with +inf so a bucket is just the count of breakpoints passed,
+    which lets flights under different rule sets be priced in the same vectorized call.
+    """
+    def __init__(self, rule_sets: List[RuleSet], airlines: Dict[str, int], routes: Dict[Tuple[str, str], int], version: int = 0):
+        self.rule_sets = rule_sets
+        self.airlines = airlines
+        self.routes = routes
+        self.version = version
+        self.single = len(rule_sets) == 1
+
+        count = len(rule_sets)
+        seat_width = max(len(r.occupancy_breakpoints) for r in rule_sets)
+        time_width = max(len(r.days_breakpoints) for r in rule_sets)
+        self.occupancy_breakpoints = np.full((count, seat_width), np.inf)
+        self.seat_factors = np.ones((count, seat_width + 1))
+        self.days_breakpoints = np.full((count, time_width), np.inf)
+        self.time_factors = np.ones((count, time_width + 1))
+        # Days before departure at which each time bucket stops applying (bucket 0 never does)
+        self.time_expiry_days = np.zeros((count, time_width + 1), dtype=np.int64)
+        self.floor = np.zeros(count)
+        self.cap = np.full(count, np.inf)
+        for i, rule in enumerate(rule_sets):
+            self.occupancy_breakpoints[i, :len(rule.occupancy_breakpoints)] = rule.occupancy_breakpoints
+            self.seat_factors[i, :len(rule.seat_factors)] = rule.seat_factors
+            self.days_breakpoints[i, :len(rule.days_breakpoints)] = rule.days_breakpoints
+            self.time_factors[i, :len(rule.time_factors)] = rule.time_factors
+            self.time_expiry_days[i, 1:len(rule.days_breakpoints) + 1] = np.asarray(rule.days_breakpoints) + 1
+            if rule.floor is not None:
+                self.floor[i] = rule.floor
+            if rule.cap is not None:
+                self.cap[i] = rule.cap
+        # Unpadded per-rule arrays for the common case of a batch under a single rule set
+        self._arrays = [
+            (np.array(r.occupancy_breakpoints), np.array(r.seat_factors), np.array(r.days_breakpoints), np.array(r.time_factors))
+            for r in rule_sets
+        ]
+        # list_fare(base_fare, seats_available, total_seats, departure, rule_id=0, now=None): scalar list
+        # fare for one flight, for single-booking paths where NumPy overhead would dominate
+        self.list_fare = _compile_list_fare(rule_sets)
+
+    def __getstate__(self):
+        # The generated list_fare cannot be pickled, and forecast() sends rules to worker processes
+        state = self.__dict__.copy()
+        del state["list_fare"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.list_fare = _compile_list_fare(self.rule_sets)
+
+    @classmethod
+    def from_config(cls, config: dict, version: int = 0) -> "CompiledRules":
+        default = RuleSet.from_config("default", config.get("default", {}))
+        rule_sets, airlines, routes = [default], {}, {}
+        for airline, rules in config.get("airlines", {}).items():
+            airlines[airline.casefold()] = len(rule_sets)
+            rule_sets.append(RuleSet.from_config(f"airline:{airline}", rules, default.as_config()))
+        for route, rules in config.get("routes", {}).items():
+            origin, _, destination = route.upper().partition("-")
+            if not origin or not destination:
+                raise ValueError(f"route:{route}: routes are written ORIGIN-DESTINATION, e.g. DEL-BOM")
+            routes[(origin, destination)] = len(rule_sets)
+            rule_sets.append(RuleSet.from_config(f"route:{route}", rules, default.as_config()))
+        return cls(rule_sets, airlines, routes, version)
+
+    def rule_id(self, airline: Optional[str], origin_code: Optional[str], destination_code: Optional[str]) -> int:
+        if self.single:
+            return 0
+        route_rule = self.routes.get(((origin_code or "").upper(), (destination_code or "").upper()))
+        if route_rule is not None:
+            return route_rule
+        return self.airlines.get((airline or "").casefold(), 0)
+
+    def _buckets(self, seats_available, total_seats, departures, rule_ids, now):
+        total_seats = np.asarray(total_seats, dtype=np.float64)
+        occupancy = (total_seats - np.asarray(seats_available, dtype=np.float64)) / total_seats
+        departures = np.asarray(departures, dtype="datetime64[us]")
+        days_to_departure = (departures - np.datetime64(now or datetime.now(), "us")) // np.timedelta64(1, "D")
+        single = self._single_rule_id(rule_ids)
+        if single is not None:
+            # One rule set: plain searchsorted over its own breakpoints
+            rule = self._arrays[single]
+            seat_bucket = np.searchsorted(rule[0], occupancy, side="right")
+            time_bucket = np.searchsorted(rule[2], days_to_departure, side="left")
+        else:
+            # Mixed rule sets: count the (inf-padded) breakpoints each value has passed
+            seat_bucket = (self.occupancy_breakpoints[rule_ids] <= occupancy[..., None]).sum(axis=-1)
+            time_bucket = (self.days_breakpoints[rule_ids] < days_to_departure[..., None]).sum(axis=-1)
+        return single, departures, seat_bucket, time_bucket
+
+    def _single_rule_id(self, rule_ids) -> Optional[int]:
+        if rule_ids is None or self.single:
+            return 0
+        if len(rule_ids) and (rule_ids == rule_ids[0]).all():
+            return int(rule_ids[0])
+        return None
+
+    def _fares(self, base_fares, single, rule_ids, seat_bucket, time_bucket):
+        base_fares = np.asarray(base_fares, dtype=np.float64)
+        if single is not None:
+            occupancy_breakpoints, seat_factors, days_breakpoints, time_factors = self._arrays[single]
+            list_fares = base_fares * seat_factors[seat_bucket] * time_factors[time_bucket]
+            rule = self.rule_sets[single]
+            if rule.floor is not None or rule.cap is not None:
+                list_fares = np.clip(list_fares, base_fares * self.floor[single], base_fares * self.cap[single])
+            return list_fares
+        list_fares = base_fares * self.seat_factors[rule_ids, seat_bucket] * self.time_factors[rule_ids, time_bucket]
+        return np.clip(list_fares, base_fares * self.floor[rule_ids], base_fares * self.cap[rule_ids])
+
+    def list_fares(self, base_fares, seats_available, total_seats, departures, rule_ids=None, now=None) -> np.ndarray:
+        """Vectorized list fares; `rule_ids` gives each flight's rule set (default set when omitted)."""
+        rule_ids = None if rule_ids is None else np.asarray(rule_ids, dtype=np.int64)
+        single, _, seat_bucket, time_bucket = self._buckets(seats_available, total_seats, departures, rule_ids, now)
+        return self._fares(base_fares, single, rule_ids, seat_bucket, time_bucket)
+
+    def evaluate(self, base_fares, seats_available, total_seats, departures, rule_ids=None, now=None):
+        """Like list_fares, but returns (list_fares, seat_buckets, time_bucket_expiry) where the expiry is
+        the datetime64 after which the flight's time factor changes (NaT when it never does)."""
+        rule_ids = None if rule_ids is None else np.asarray(rule_ids, dtype=np.int64)
+        single, departures, seat_bucket, time_bucket = self._buckets(seats_available, total_seats, departures, rule_ids, now)
+        list_fares = self._fares(base_fares, single, rule_ids, seat_bucket, time_bucket)
+        expiry_days = self.time_expiry_days[single][time_bucket] if single is not None else self.time_expiry_days[rule_ids, time_bucket]
+        expiry = departures - expiry_days.astype("timedelta64[D]")
+        return list_fares, seat_bucket, np.where(time_bucket > 0, expiry, np.datetime64("NaT"))
+
+    def _per_rule(self, table: np.ndarray, rule_ids: np.ndarray, ndim: int) -> np.ndarray:
+        """Rows of `table` for each rule id, shaped to broadcast against an ndim-dimensional array."""
+        rows = table[rule_ids]
+        return rows.reshape(rows.shape[:1] + (1,) * (ndim - 1) + rows.shape[1:])
+
+    def seat_factor(self, occupancy, rule_ids) -> np.ndarray:
+        """Seat factor for an occupancy array of any shape whose first axis lines up with rule_ids."""
+        occupancy = np.asarray(occupancy, dtype=np.float64)
+        rule_ids = np.asarray(rule_ids, dtype=np.int64)
+        single = self._single_rule_id(rule_ids)
+        if single is not None:
+            breakpoints, factors = self._arrays[single][:2]
+            return factors[np.searchsorted(breakpoints, occupancy, side="right")]
+        bucket = (self._per_rule(self.occupancy_breakpoints, rule_ids, occupancy.ndim) <= occupancy[..., None]).sum(axis=-1)
+        return self.seat_factors[rule_ids.reshape(rule_ids.shape + (1,) * (occupancy.ndim - 1)), bucket]
+
+    def time_factor(self, days_to_departure, rule_ids) -> np.ndarray:
+        """Time factor per flight for whole days to departure (floored, as in list_fares)."""
+        days_to_departure = np.asarray(days_to_departure)
+        rule_ids = np.asarray(rule_ids, dtype=np.int64)
+        single = self._single_rule_id(rule_ids)
+        if single is not None:
+            breakpoints, factors = self._arrays[single][2:]
+            return factors[np.searchsorted(breakpoints, days_to_departure, side="left")]
+        bucket = (self.days_breakpoints[rule_ids] < days_to_departure[..., None]).sum(axis=-1)
+        return self.time_factors[rule_ids, bucket]
+
+    def bound(self, list_fares, base_fares, rule_ids) -> np.ndarray:
+        """Applies each rule set's floor and cap; list_fares' first axis lines up with base_fares and rule_ids."""
+        list_fares = np.asarray(list_fares, dtype=np.float64)
+        if self.single and self.rule_sets[0].floor is None and self.rule_sets[0].cap is None:
+            return list_fares
+        rule_ids = np.asarray(rule_ids, dtype=np.int64)
+        shape = rule_ids.shape + (1,) * (list_fares.ndim - 1)
+        base_fares = np.asarray(base_fares, dtype=np.float64).reshape(shape)
+        return np.clip(list_fares, base_fares * self.floor[rule_ids].reshape(shape), base_fares * self.cap[rule_ids].reshape(shape))
+
+    def seat_bucket(self, seats_available: int, total_seats: int, rule_id: int = 0) -> int:
+        return bisect_right(self.rule_sets[rule_id].occupancy_breakpoints, (total_seats - seats_available) / total_seats)
+
+    def seat_buckets(self, seats_available, total_seats, rule_ids) -> np.ndarray:
+        """Vectorized seat_bucket, matching the buckets evaluate() returns."""
+        total_seats = np.asarray(total_seats, dtype=np.float64)
+        occupancy = (total_seats - np.asarray(seats_available, dtype=np.float64)) / total_seats
+        rule_ids = np.asarray(rule_ids, dtype=np.int64)
+        single = self._single_rule_id(rule_ids)
+        if single is not None:
+            return np.searchsorted(self._arrays[single][0], occupancy, side="right")
+        return (self.occupancy_breakpoints[rule_ids] <= occupancy[..., None]).sum(axis=-1)
+
+def _bucket_chain(name: str, value: str, breakpoints, factors, descending: bool) -> List[str]:
+    """if/elif lines setting `name` to the factor of the bucket `value` falls in. Ascending chains
+    test `value < breakpoint` (bisect_right buckets), descending ones `value > breakpoint`
+    (bisect_left buckets), so either way the tests match CompiledRules.list_fares."""
+    if not breakpoints:
+        return [f"{name} = {factors[0]!r}"]
+    if descending:
+        tests = [(f"{value} > {b!r}", f) for b, f in zip(reversed(breakpoints), reversed(factors[1:]))]
+        last = factors[0]
+    else:
+        tests = [(f"{value} < {b!r}", f) for b, f in zip(breakpoints, factors)]
+        last = factors[-1]
+    chain = [f"{'elif' if i else 'if'} {test}: {name} = {factor!r}" for i, (test, factor) in enumerate(tests)]
+    return chain + [f"else: {name} = {last!r}"]
+
+def _rule_body(rule: RuleSet) -> List[str]:
+    body = (
+        _bucket_chain("seat_factor", "occupancy", rule.occupancy_breakpoints, rule.seat_factors, descending=False)
+        + _bucket_chain("time_factor", "days_to_departure", rule.days_breakpoints, rule.time_factors, descending=True)
+        + ["fare = base_fare * seat_factor * time_factor"]
+    )
+    if rule.floor is not None:
+        body.append(f"if fare < base_fare * {rule.floor!r}: return base_fare * {rule.floor!r}")
+    if rule.cap is not None:
+        body.append(f"if fare > base_fare * {rule.cap!r}: return base_fare * {rule.cap!r}")
+    return body + ["return fare"]
+
+def _compile_list_fare(rule_sets: List[RuleSet]):
+    """Generates the scalar list fare function with every rule set's breakpoints written out as
+    if/elif chains (the way the original calculate_dynamic_price had its thresholds), so pricing
+    one flight costs about what it did before rule sets. The default set is tested last and
+    needs no rule id comparison."""
+    lines = [
+        "def list_fare(base_fare, seats_available, total_seats, departure, rule_id=0, now=None):",
+        "    occupancy = (total_seats - seats_available) / total_seats",
+        "    days_to_departure = (departure - (now or datetime.now())).days",
+    ]
+    lines.append("    if rule_id:")
+    for rule_id, rule in enumerate(rule_sets[1:], start=1):
+        lines.append(f"        {'elif' if rule_id > 1 else 'if'} rule_id == {rule_id}:")
+        lines.extend(f"            {line}" for line in _rule_body(rule))
+    lines.append("        raise IndexError(f'no rule set {rule_id}')")
+    lines.extend(f"    {line}" for line in _rule_body(rule_sets[0]))
+    namespace = {"datetime": datetime}
+    exec("\n".join(lines), namespace)
+    return namespace["list_fare"]
+
+class PricingEngine:
+    """Holds the compiled rules loaded from a JSON file and swaps in new ones when the file changes."""
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.rules = CompiledRules.from_config({})
+        self.last_error = None
+
+    def load(self, force: bool = False) -> bool:
+        """(Re)compiles the rules if the file changed. Returns True when new rules were installed.
+        A bad file raises ValueError and leaves the current rules in place."""
+        with self._lock:
+            if not self.path or not os.path.exists(self.path):
+                if self._mtime is None and not force:
+                    return False
+                config, mtime = {}, None
+            else:
+                mtime = os.path.getmtime(self.path)
+                if mtime == self._mtime and not force:
+                    return False
+                # Remember the mtime even if the file turns out to be bad, so it is reported once
+                self._mtime = mtime
+                try:
+                    with open(self.path) as f:
+                        config = json.load(f)
+                except (OSError, json.JSONDecodeError) as e:
+                    self.last_error = str(e)
+                    raise ValueError(f"Could not read pricing rules: {e}")
+            try:
+                rules = CompiledRules.from_config(config, version=self.rules.version + 1)
+            except (ValueError, TypeError, KeyError, AttributeError, OverflowError) as e:
+                self.last_error = str(e)
+                raise ValueError(f"Invalid pricing rules: {e}")
+            self.rules, self._mtime, self.last_error = rules, mtime, None
+            return True
@@ -0,0 +1,132 @@
+import heapq
+import threading
+from bisect import bisect_left, insort
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Sequence, Tuple
+
+# --- Time-Expanded Route Graph ---
+# Each flight is a node; an edge joins flight A to flight B when B leaves from A's destination
+# within the allowed connection window. Edges are never stored: departures are kept sorted per
+# airport, so the successors of a flight are one bisect away.
+
+@dataclass
+class Leg:
+    flight_id: int
+    origin_id: int
+    destination_id: int
+    departure: datetime
+    arrival: datetime
+    base_fare: float
+    total_seats: int
+    seats_available: int
+    airline_name: str = ""
+
+@dataclass
+class Itinerary:
+    legs: List[Leg]
+    cost: float
+
+class RouteGraph:
+    """Departures per airport, kept sorted and updated in place as flights or seat counts change."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._legs: Dict[int, Leg] = {}
+        self._departures: Dict[int, List[Tuple[datetime, int]]] = {}  # airport id -> sorted (departure, flight id)
+        self.built = False
+
+    def build(self, legs: Sequence[Leg]):
+        by_id, departures = {}, {}
+        for leg in legs:
+            by_id[leg.flight_id] = leg
+            departures.setdefault(leg.origin_id, []).append((leg.departure, leg.flight_id))
+        for entries in departures.values():
+            entries.sort()
+        with self._lock:
+            self._legs, self._departures = by_id, departures
+            self.built = True
+
+    def upsert(self, leg: Leg):
+        self.upsert_many([leg])
+
+    def upsert_many(self, legs: Sequence[Leg]):
+        with self._lock:
+            for leg in legs:
+                old = self._legs.get(leg.flight_id)
+                if old is not None and (old.origin_id, old.departure) != (leg.origin_id, leg.departure):
+                    entries = self._departures[old.origin_id]
+                    del entries[bisect_left(entries, (old.departure, old.flight_id))]
+                    old = None
+                if old is None:
+                    insort(self._departures.setdefault(leg.origin_id, []), (leg.departure, leg.flight_id))
+                self._legs[leg.flight_id] = leg
+
+    def _departing(self, airport_id: int, earliest: datetime, latest: datetime) -> List[Leg]:
+        entries = self._departures.get(airport_id, ())
+        start = bisect_left(entries, (earliest, -1))
+        legs = []
+        for departure, flight_id in entries[start:]:
+            if departure > latest:
+                break
+            leg = self._legs[flight_id]
+            if leg.seats_available > 0:
+                legs.append(leg)
+        return legs
+
+    def search(
+        self, origin_id: int, destination_id: int, earliest: datetime, latest: datetime,
+        fares: Callable[[List[Leg]], Sequence[float]], sort_by: str = "price", k: int = 10, max_legs: int = 2,
+        min_connection: timedelta = timedelta(minutes=45), max_connection: timedelta = timedelta(hours=6),
+        max_expansions: int = 20000,
+    ) -> List[Itinerary]:
+        """Best-first search for the k cheapest (or shortest) itineraries.
+
+        `fares` prices a batch of legs; it is called once per expanded airport and memoized per
+        flight. Both costs only grow as legs are added, so itineraries reach the destination in
+        cost order and the search stops after k of them or `max_expansions` heap pops.
+        """
+        fare_of: Dict[int, float] = {}
+
+        def priced(legs: List[Leg]) -> List[Leg]:
+            missing = [leg for leg in legs if leg.flight_id not in fare_of]
+            if missing:
+                for leg, fare in zip(missing, fares(missing)):
+                    fare_of[leg.flight_id] = float(fare)
+            return legs
+
+        def cost(path: Tuple[Leg, ...], leg: Leg, path_cost: float) -> float:
+            if sort_by == "duration":
+                return (leg.arrival - (path[0] if path else leg).departure).total_seconds()
+            return path_cost + fare_of[leg.flight_id]
+
+        results: List[Itinerary] = []
+        heap: List[Tuple[float, int, Tuple[Leg, ...]]] = []
+        counter = 0
+        with self._lock:
+            for leg in priced(self._departing(origin_id, earliest, latest)):
+                if leg.destination_id == origin_id or (max_legs == 1 and leg.destination_id != destination_id):
+                    continue
+                heapq.heappush(heap, (cost((), leg, 0.0), counter, (leg,)))
+                counter += 1
+
+            expansions = 0
+            while heap and len(results) < k and expansions < max_expansions:
+                path_cost, _, path = heapq.heappop(heap)
+                expansions += 1
+                last = path[-1]
+                if last.destination_id == destination_id:
+                    results.append(Itinerary(legs=list(path), cost=path_cost))
+                    continue
+                if len(path) >= max_legs:
+                    continue
+                visited = {leg.origin_id for leg in path}
+                candidates = self._departing(last.destination_id, last.arrival + min_connection, last.arrival + max_connection)
+                if len(path) + 1 == max_legs:
+                    # Last allowed leg: only flights into the destination are worth pricing
+                    candidates = [leg for leg in candidates if leg.destination_id == destination_id]
+                for leg in priced(candidates):
+                    if leg.destination_id in visited:
+                        continue
+                    heapq.heappush(heap, (cost(path, leg, path_cost), counter, path + (leg,)))
+                    counter += 1
+        return results
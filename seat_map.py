@@ -0,0 +1,157 @@
+import math
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# --- Seat Maps ---
+# Seats are numbered row by row through a cabin layout such as "ABC DEF": letters are seats,
+# spaces are aisles, so "12C" is the aisle seat on the left of row 12. A flight's occupied seats
+# are one bit per seat in a Python int (bit i = i-th seat in that order), which makes "any free
+# seat" and "n free seats side by side" a handful of bit operations on a few machine words.
+
+# (largest cabin the layout is used for, layout); no seat letter I, as on real aircraft
+CABIN_LAYOUTS = (
+    (90, "AB CD"),
+    (240, "ABC DEF"),
+    (None, "ABC DEFG HJK"),
+)
+
+SEAT_NO_PATTERN = re.compile(r"^\s*(\d+)\s*([A-Za-z])\s*$")
+
+def default_layout(total_seats: int) -> str:
+    """The layout for a cabin of this size."""
+    for max_seats, layout in CABIN_LAYOUTS:
+        if max_seats is None or total_seats <= max_seats:
+            return layout
+
+class CabinLayout:
+    """Seat numbering for a cabin of `total_seats` seats; the last row may be partly filled."""
+    def __init__(self, pattern: str, total_seats: int):
+        sections = pattern.split()
+        letters = "".join(sections)
+        if not letters.isalpha() or len(set(letters.upper())) != len(letters):
+            raise ValueError(f"Invalid cabin layout {pattern!r}.")
+        self.pattern = pattern
+        self.letters = letters.upper()
+        self.width = len(letters)
+        self.total_seats = total_seats
+        self.rows = math.ceil(total_seats / self.width)
+        self.all_seats = (1 << total_seats) - 1
+        self._columns = {letter: column for column, letter in enumerate(self.letters)}
+        # (first column, width) of each block of seats between aisles
+        self._sections: List[Tuple[int, int]] = []
+        column = 0
+        for section in sections:
+            self._sections.append((column, len(section)))
+            column += len(section)
+        self._windows: Dict[Tuple[int, bool], int] = {}
+        self._seat_nos = [f"{row + 1}{letter}" for row in range(self.rows) for letter in self.letters][:total_seats]
+
+    def seat_no(self, index: int) -> str:
+        if 0 <= index < self.total_seats:
+            return self._seat_nos[index]
+        row, column = divmod(index, self.width)
+        return f"{row + 1}{self.letters[column]}"
+
+    def parse(self, seat_no: Optional[str]) -> Optional[int]:
+        """The seat index for a seat number like "12C", or None if there is no such seat."""
+        match = SEAT_NO_PATTERN.match(seat_no or "")
+        if not match or match.group(2).upper() not in self._columns:
+            return None
+        index = (int(match.group(1)) - 1) * self.width + self._columns[match.group(2).upper()]
+        return index if 0 <= index < self.total_seats else None
+
+    def windows(self, n: int, within_sections: bool = True) -> int:
+        """Bit mask of the seats that can start a run of n side-by-side seats in one row, without
+        crossing an aisle unless within_sections is False. Built once per (n, within_sections)."""
+        key = (n, within_sections)
+        if key not in self._windows:
+            spans = self._sections if within_sections else [(0, self.width)]
+            row_mask = 0
+            for start, width in spans:
+                for offset in range(width - n + 1):
+                    row_mask |= 1 << (start + offset)
+            mask = 0
+            for row in range(self.rows):
+                mask |= row_mask << (row * self.width)
+            # A run may not hang past the last seat of a partly filled last row
+            self._windows[key] = mask & (self.all_seats >> (n - 1))
+        return self._windows[key]
+
+@lru_cache(maxsize=256)
+def cabin_layout(pattern: str, total_seats: int) -> CabinLayout:
+    """A shared CabinLayout for this pattern and size. Layouts are never changed once built (the
+    window masks are only ever filled in), so every seat map of the same cabin can use one."""
+    return CabinLayout(pattern, total_seats)
+
+class SeatMap:
+    """The occupied seats of one flight."""
+    def __init__(self, layout: CabinLayout, occupied: int = 0):
+        self.layout = layout
+        self.occupied = occupied
+
+    @classmethod
+    def from_bytes(cls, layout: CabinLayout, data: bytes) -> "SeatMap":
+        return cls(layout, int.from_bytes(data, "little") & layout.all_seats)
+
+    def to_bytes(self) -> bytes:
+        return self.occupied.to_bytes((self.layout.total_seats + 7) // 8, "little")
+
+    @property
+    def free(self) -> int:
+        return self.layout.all_seats & ~self.occupied
+
+    @property
+    def occupied_count(self) -> int:
+        return bin(self.occupied).count("1")
+
+    def is_free(self, index: int) -> bool:
+        return 0 <= index < self.layout.total_seats and not (self.occupied >> index) & 1
+
+    def take(self, index: int):
+        if not self.is_free(index):
+            raise ValueError(f"Seat {self.layout.seat_no(index)} is not free.")
+        self.occupied |= 1 << index
+
+    def release(self, index: int):
+        self.occupied &= ~(1 << index)
+
+    def first_free(self) -> Optional[int]:
+        free = self.free
+        return (free & -free).bit_length() - 1 if free else None
+
+    def find_adjacent(self, n: int) -> Optional[int]:
+        """First seat of the lowest run of n free seats in one row, preferring runs that do not
+        cross an aisle. None if there is no such run."""
+        free = self.free
+        runs = free
+        for k in range(1, n):
+            runs &= free >> k
+        for within_sections in (True, False):
+            starts = runs & self.layout.windows(n, within_sections)
+            if starts:
+                return (starts & -starts).bit_length() - 1
+        return None
+
+    def allocate(self, n: int, adjacent: bool = False) -> Optional[List[int]]:
+        """Takes n free seats and returns their indices, or None (taking nothing) if fewer are free.
+        With adjacent=True, seats side by side in one row are used when there is such a run."""
+        if n > self.layout.total_seats - self.occupied_count:
+            return None
+        start = self.find_adjacent(n) if adjacent and n > 1 else None
+        if start is not None:
+            self.occupied |= ((1 << n) - 1) << start
+            return list(range(start, start + n))
+        # Peel off the lowest free seat n times
+        free, seats = self.free, []
+        for _ in range(n):
+            lowest = free & -free
+            seats.append(lowest.bit_length() - 1)
+            free ^= lowest
+        self.occupied = self.layout.all_seats & ~free
+        return seats
+
+    def seat_nos(self, free: bool) -> List[str]:
+        """Seat numbers of every free (or occupied) seat, in seat order."""
+        bits = self.free if free else self.occupied
+        return [self.layout.seat_no(i) for i in range(self.layout.total_seats) if (bits >> i) & 1]
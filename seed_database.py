@@ -1,7 +1,7 @@
 from datetime import datetime
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from main import Flight, Base, DATABASE_URL
+from main import Flight, Base, DATABASE_URL, apply_migrations
 
 # Data to insert into the flights table
 flights_data = [
@@ -55,6 +55,8 @@ def seed_data():
                 flight = Flight(**flight_info)
                 db.add(flight)
             db.commit()
+            # Link the new flights to the airport catalog
+            apply_migrations(engine)
             print("✅ Database seeded successfully!")
         else:
             print("Database already contains data. Skipping seed.")